@@ -0,0 +1,41 @@
+"""
+Times consolidating many generated ledger files with different numbers of worker processes.
+Run from the root directory:
+    python -m benchmarks.consolidation --ledgers 200 --accounts 2000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.ledger import populate
+from db_layer.consolidation import consolidate
+from db_layer.database import SqliteDb
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ledgers', type=int, default=200)
+    parser.add_argument('--accounts', type=int, default=2000)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=4)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for index in range(args.ledgers):
+            with SqliteDb(os.path.join(directory, f"ledger_{index}.db")) as db:
+                populate(db, args.accounts, args.depth, args.fanout, seed=index)
+
+        cores = os.cpu_count() or 1
+        worker_counts = sorted({count for count in (1, 2, 4, 8, 16) if count < cores} | {cores})
+        baseline = None
+        for workers in worker_counts:
+            started = time.perf_counter()
+            consolidate([directory], workers=workers)
+            seconds = time.perf_counter() - started
+            baseline = baseline or seconds
+            print(f"{workers:>3} workers: {seconds:.2f}s ({baseline / seconds:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Deterministic generator of synthetic ledgers for benchmarks.
+"""
+import random
+
+from models.accounting import Category, Account
+
+
+def generate_categories(depth=3, fanout=4):
+    """
+    Builds Assets and Liabilities trees where every category down to the given depth has fanout subcategories.
+    Parents always come before their children.
+    :return: list of Category objects, and the list of leaf categories that accounts go into.
+    """
+    categories = []
+    leaves = []
+    for root_name in ('Assets', 'Liabilities'):
+        root = Category(root_name)
+        categories.append(root)
+        level = [root]
+        for _ in range(depth):
+            next_level = []
+            for parent in level:
+                for index in range(fanout):
+                    child = Category(f"{parent.name}.{index + 1}", parent=parent)
+                    categories.append(child)
+                    next_level.append(child)
+            level = next_level
+        leaves.extend(level)
+    return categories, leaves
+
+
+def generate_accounts(leaves, accounts=1000, seed=0):
+    """
+    Yields accounts spread round-robin over the leaf categories, with values drawn from a seeded generator so every
+    run produces the same ledger.
+    :return: generator of Account objects
+    """
+    rng = random.Random(seed)
+    for index in range(accounts):
+        category = leaves[index % len(leaves)]
+        yield Account(f"Account {index}", round(rng.uniform(0, 100000), 2), category=category,
+                      remarks=f"generated #{index}")
+
+
+def generate_ledger(accounts=1000, depth=3, fanout=4, seed=0):
+    """
+    :return: tuple of (list of Category objects, generator of Account objects)
+    """
+    categories, leaves = generate_categories(depth, fanout)
+    return categories, generate_accounts(leaves, accounts, seed)
+
+
+def populate(db, accounts=1000, depth=3, fanout=4, seed=0):
+    """
+    Writes a generated ledger to the given SqliteDb with the bulk upserts.
+    :return: list of leaf categories.
+    """
+    categories, leaves = generate_categories(depth, fanout)
+    db.bulk_upsert_categories(categories)
+    db.bulk_upsert_accounts(generate_accounts(leaves, accounts, seed))
+    return leaves
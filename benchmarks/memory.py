@@ -0,0 +1,64 @@
+"""
+Compares the memory held by the nested dict tree of get_category_tree() with a CompactTree of the same ledger.
+Run from the root directory:
+    python -m benchmarks.memory --accounts 200000
+"""
+import argparse
+import gc
+import tracemalloc
+
+from benchmarks.ledger import generate_ledger
+from models.compact import CompactTree
+
+
+def ledger_rows(accounts, depth, fanout):
+    """
+    :return: (category rows, account rows) of the Assets subtree in the shape the database queries return.
+    """
+    categories, generated_accounts = generate_ledger(accounts, depth, fanout)
+    ids = {}
+    category_rows = []
+    for category in categories:
+        if category.name == 'Liabilities' or category.name.startswith('Liabilities.'):
+            continue
+        ids[category.name] = len(ids) + 1
+        parent_id = ids[category.parent.name] if category.parent is not None else None
+        category_rows.append((ids[category.name], category.name, parent_id))
+    account_rows = [(ids[account.category.name], account.name, account.value, account.remarks)
+                    for account in generated_accounts if account.category.name in ids]
+    return category_rows, account_rows
+
+
+def measure(build):
+    """
+    :return: bytes still allocated by the object build() returns.
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--accounts', type=int, default=200000)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=4)
+    args = parser.parse_args(argv)
+
+    category_rows, account_rows = ledger_rows(args.accounts * 2, args.depth, args.fanout)
+    nodes = len(category_rows) + len(account_rows)
+    # names and remarks are shared with the rows, so both sizes count only the tree structure itself
+    compact = measure(lambda: CompactTree.from_rows(category_rows, account_rows))
+    nested = measure(lambda: CompactTree.from_rows(category_rows, account_rows).to_dict())
+    print(f"{nodes:,} nodes")
+    print(f"  nested dict tree: {nested / 1e6:,.1f} MB ({nested / nodes:,.0f} bytes/node)")
+    print(f"  compact tree:     {compact / 1e6:,.1f} MB ({compact / nodes:,.0f} bytes/node)")
+
+
+if __name__ == '__main__':
+    main()
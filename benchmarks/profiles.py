@@ -0,0 +1,65 @@
+"""
+Compares write and read throughput of the SQLite performance profiles on a generated ledger.
+Run from the root directory:
+    python -m benchmarks.profiles --accounts 100000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.ledger import generate_categories, generate_accounts
+from db_layer.connections import PROFILES
+from db_layer.database import SqliteDb
+from models.accounting import Account
+
+
+def run_profile(profile, directory, accounts, depth, fanout, single_writes, tree_reads):
+    """
+    Times a bulk import, single-row upserts that commit one by one, and full tree loads against a fresh file.
+    :return: dict of rates per second.
+    """
+    db = SqliteDb(os.path.join(directory, f"{profile}.db"), profile=profile)
+    categories, leaves = generate_categories(depth, fanout)
+    db.bulk_upsert_categories(categories)
+
+    started = time.perf_counter()
+    db.bulk_upsert_accounts(generate_accounts(leaves, accounts))
+    bulk_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for index in range(single_writes):
+        db.upsert_account(Account(f"Account {index}", float(index), category=leaves[index % len(leaves)]))
+    single_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(tree_reads):
+        db.get_category_tree('Assets')
+    read_seconds = time.perf_counter() - started
+    db.close()
+
+    return {
+        'bulk rows/s': accounts / bulk_seconds,
+        'single upserts/s': single_writes / single_seconds,
+        'tree loads/s': tree_reads / read_seconds,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--accounts', type=int, default=100000)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--single-writes', type=int, default=500)
+    parser.add_argument('--tree-reads', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in PROFILES:
+            rates = run_profile(profile, directory, args.accounts, args.depth, args.fanout, args.single_writes,
+                                args.tree_reads)
+            print(f"{profile:>12}: " + ", ".join(f"{rate:,.0f} {label}" for label, rate in rates.items()))
+
+
+if __name__ == '__main__':
+    main()
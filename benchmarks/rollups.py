@@ -0,0 +1,49 @@
+"""
+Times a full recalculation of the category rollups with NumPy against the per-category SQL path on a generated ledger.
+Needs NumPy. Run from the root directory:
+    python -m benchmarks.rollups --accounts 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.ledger import populate
+from db_layer import vectorized
+from db_layer.database import SqliteDb
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--accounts', type=int, default=1000000)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--fanout', type=int, default=6)
+    parser.add_argument('--skip-sql', action='store_true', help="only time the NumPy path")
+    args = parser.parse_args(argv)
+    vectorized.require_numpy()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = SqliteDb(os.path.join(directory, 'rollups.db'))
+        populate(db, args.accounts, args.depth, args.fanout)
+
+        started = time.perf_counter()
+        arrays = vectorized.load_arrays(db.cursor)
+        load_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        vectorized.rollup(*arrays[1:])
+        compute_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        db.calculate_every_category(vectorized=True)
+        numpy_seconds = time.perf_counter() - started
+        print(f"{len(arrays[0])} categories, {args.accounts} accounts")
+        print(f"numpy: {numpy_seconds:.3f}s end to end ({load_seconds:.3f}s loading, {compute_seconds:.4f}s rollup)")
+
+        if not args.skip_sql:
+            started = time.perf_counter()
+            db.calculate_every_category()
+            print(f"sql:   {time.perf_counter() - started:.3f}s")
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
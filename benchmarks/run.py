@@ -0,0 +1,186 @@
+"""
+Benchmark suite. Generates deterministic ledgers of each size, times the main SqliteDb paths and CLI startup, and
+writes the results as JSON. Pass the JSON of an earlier run with --baseline to see regressions.
+Run from the root directory:
+    python -m benchmarks.run --sizes 1000,10000,100000 --output results.json
+    python -m benchmarks.run --sizes 1000,10000,100000 --baseline results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks.ledger import populate
+from benchmarks.startup import ROOT, run_cli_help
+from db_layer.database import SqliteDb
+from models.accounting import Account, print_balance_sheet
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_THRESHOLD = 1.25
+
+
+def timed(function, repeat):
+    """
+    Calls function once untimed, so lazy imports and cold caches are not counted, then repeat times.
+    :return: tuple of (fastest, median) seconds.
+    """
+    function()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings), statistics.median(timings)
+
+
+def result(name, accounts, operations, timings):
+    best, median = timings
+    return {'benchmark': name, 'accounts': accounts, 'operations': operations, 'seconds': best,
+            'median_seconds': median, 'per_second': operations / best if best else None}
+
+
+def run_size(directory, accounts, depth, fanout, seed, repeat):
+    """
+    Times every benchmark against a fresh ledger of the given number of accounts.
+    :return: list of result dicts.
+    """
+    results = []
+    db = SqliteDb(os.path.join(directory, f"ledger_{accounts}.db"))
+    started = time.perf_counter()
+    leaves = populate(db, accounts, depth, fanout, seed)
+    seconds = time.perf_counter() - started
+    results.append(result('bulk_import', accounts, accounts, (seconds, seconds)))
+
+    upserts = min(accounts, 500)
+    results.append(result('upsert_account', accounts, upserts, timed(
+        lambda: [db.upsert_account(Account(f"Account {index}", float(index), category=leaves[index % len(leaves)]))
+                 for index in range(upserts)], repeat)))
+    results.append(result('calculate_every_category', accounts, 1, timed(db.calculate_every_category, repeat)))
+    try:
+        results.append(result('calculate_every_category_vectorized', accounts, 1,
+                              timed(lambda: db.calculate_every_category(vectorized=True), repeat)))
+    except ImportError:
+        pass
+    results.append(result('get_category_tree', accounts, 1, timed(lambda: db.get_category_tree('Assets'), repeat)))
+
+    def print_sheet():
+        with contextlib.redirect_stdout(io.StringIO()):
+            print_balance_sheet(db)
+    results.append(result('print_balance_sheet', accounts, 1, timed(print_sheet, repeat)))
+
+    toggles = min(accounts, 200)
+    results.append(result('disable_enable_account', accounts, toggles * 2, timed(
+        lambda: [(db.set_account_disabled(f"Account {index}", 1), db.set_account_disabled(f"Account {index}", 0))
+                 for index in range(toggles)], repeat)))
+    names = [f"Account {index}" for index in range(0, accounts, 10)]
+    results.append(result('disable_enable_many_accounts', accounts, len(names) * 2, timed(
+        lambda: (db.disable_many_accounts(names), db.enable_many_accounts(names)), repeat)))
+    db.close()
+    return results
+
+
+def metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'recorded_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'depth': args.depth,
+        'fanout': args.fanout,
+        'seed': args.seed,
+        'repeat': args.repeat,
+    }
+
+
+def run_suite(args):
+    """
+    :return: dict of 'meta' and a list of 'results'.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for accounts in args.sizes:
+            print(f"{accounts:,} accounts...", file=sys.stderr)
+            results.extend(run_size(directory, accounts, args.depth, args.fanout, args.seed, args.repeat))
+    if not args.skip_startup:
+        timings = [run_cli_help()[0] for _ in range(args.repeat)]
+        results.append(result('cli_startup', 0, 1, (min(timings), statistics.median(timings))))
+    return {'meta': metadata(args), 'results': results}
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Matches results to a baseline run by benchmark and size.
+    :return: list of (benchmark, accounts, baseline seconds, seconds, ratio) where ratio is above the threshold.
+    """
+    before = {(item['benchmark'], item['accounts']): item['seconds'] for item in baseline['results']}
+    regressions = []
+    for item in results['results']:
+        key = (item['benchmark'], item['accounts'])
+        if before.get(key) and item['seconds'] / before[key] > threshold:
+            regressions.append(key + (before[key], item['seconds'], item['seconds'] / before[key]))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    before = {}
+    if baseline is not None:
+        before = {(item['benchmark'], item['accounts']): item['seconds'] for item in baseline['results']}
+    for item in results['results']:
+        line = f"{item['benchmark']:<38} {item['accounts']:>9,} accounts {item['seconds'] * 1000:>11.2f} ms"
+        previous = before.get((item['benchmark'], item['accounts']))
+        if previous:
+            line += f"  {item['seconds'] / previous:5.2f}x baseline"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=lambda text: [int(size) for size in text.split(',')],
+                        default=list(DEFAULT_SIZES), help="comma-separated numbers of accounts, up to 1000000")
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="runs per benchmark, the fastest is kept")
+    parser.add_argument('--skip-startup', action='store_true', help="do not time CLI startup")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="JSON file of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="slowdown against the baseline that counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for benchmark, accounts, previous, seconds, ratio in regressions:
+            print(f"REGRESSION {benchmark} at {accounts:,} accounts: {previous * 1000:.2f} ms -> "
+                  f"{seconds * 1000:.2f} ms ({ratio:.2f}x)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
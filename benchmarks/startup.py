@@ -0,0 +1,60 @@
+"""
+Times `python -m cli_layer.cli --help` and counts the SQLite connections it opens, which should be none.
+Run from the root directory:
+    python -m benchmarks.startup --runs 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Runs the CLI module as __main__ with sqlite3.connect wrapped, then reports the number of connections on stderr.
+COUNT_CONNECTIONS = """
+import runpy, sqlite3, sys
+connections = []
+original_connect = sqlite3.connect
+def connect(*args, **kwargs):
+    connections.append(args)
+    return original_connect(*args, **kwargs)
+sqlite3.connect = connect
+try:
+    runpy.run_module('cli_layer.cli', run_name='__main__', alter_sys=True)
+except SystemExit:
+    pass
+finally:
+    sys.stderr.write(f'sqlite connections: {len(connections)}\\n')
+"""
+
+
+def run_cli_help():
+    """
+    Runs the CLI help once in a fresh interpreter.
+    :return: tuple of (seconds, number of sqlite connections opened)
+    """
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', COUNT_CONNECTIONS, '--help'], cwd=ROOT,
+                               capture_output=True, text=True, check=True)
+    seconds = time.perf_counter() - started
+    connections = int(completed.stderr.strip().rsplit(' ', 1)[-1])
+    return seconds, connections
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = [run_cli_help() for _ in range(args.runs)]
+    timings = [seconds for seconds, _ in results]
+    connections = max(count for _, count in results)
+    print(f"cli --help: median {statistics.median(timings) * 1000:.1f} ms, "
+          f"min {min(timings) * 1000:.1f} ms over {args.runs} runs, {connections} sqlite connections")
+    return 1 if connections else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,47 +1,72 @@
+from pathlib import Path
+from typing import List
+
 import typer
 from rich import print
 
-from cli_layer.enums import CategoryChoice, enabled_accounts, prompt_selected_choice, disabled_accounts
-from models.accounting import Category, Account
+from cli_layer import exporter, importer
+from cli_layer.enums import prompt_selected_choice, resolve_category_choice, search_selected_choice
+from models.accounting import Category, Account, print_balance_sheet, print_balance_sheet_dict
+from db_layer import consolidation
+from db_layer.connections import registry
 from db_layer.database import SqliteDb
+from db_layer.instrumentation import format_report
 
 app = typer.Typer()
 
 BLUE = "\033[94m"
 RESET = "\033[0m"
 
+# commands that take arguments on the command line and cannot be started from the menu
+NON_MENU_COMMANDS = ('start_menu', 'import_ledger', 'export_ledger', 'consolidate')
+
+# set by --profile. Every database the command opens is instrumented and reported on when it finishes.
+profiled_dbs = None
+
+
+def open_db(use_test_db=False):
+    """
+    Opens the ledger database for a command, instrumented when --profile was given.
+    :return: SqliteDb object
+    """
+    db = SqliteDb('ledger.db', test=use_test_db, instrument=profiled_dbs is not None)
+    if profiled_dbs is not None:
+        profiled_dbs.append(db)
+    return db
+
+
+def print_profile():
+    for db in profiled_dbs:
+        print(f"\nProfile of {db.path}")
+        for line in format_report(db.stats()):
+            typer.echo(line)
+
 
 @app.command()
 def save_category(
         use_test_db: bool = False,
         name: str = typer.Option(..., prompt="What's the category name?"),
-        parent: CategoryChoice = typer.Option(default=None, prompt="Select a parent category:",
-                                              show_choices=True,
-                                              case_sensitive=False),
+        parent: str = typer.Option(default=None, help="Parent category. Prompted for when omitted."),
         description: str = typer.Option("", prompt="Description?")
 ):
-    kwargs = locals()
-    del kwargs['use_test_db']
-    # convert CategoryChoice obj to Category obj
-    category_choice = kwargs['parent']
-    category = Category.from_enum(category_choice)
-    kwargs['parent'] = category
-
-    category = Category.from_dict(kwargs)
-    if use_test_db:
-        db = SqliteDb('ledger.db', test=use_test_db)
-        db.upsert_category(category)
-        print(f"Saved {category.name} under {category.parent.name}.")
-        db.close()
-    else:
-        if typer.confirm("Do you want to save?", default=True):
-            db = SqliteDb('ledger.db')
+    # categories are only loaded from the database once this command runs, and the connection is handed back even
+    # when the choice is rejected
+    with open_db(use_test_db) as db:
+        parent = resolve_category_choice(parent, db)
+        kwargs = locals()
+        del kwargs['use_test_db']
+        del kwargs['db']
+        # convert the category name or CategoryEnum obj to Category obj
+        category_choice = kwargs['parent']
+        category = Category.from_enum(category_choice)
+        kwargs['parent'] = category
+
+        category = Category.from_dict(kwargs)
+        if use_test_db or typer.confirm("Do you want to save?", default=True):
             db.upsert_category(category)
             print(f"Saved {category.name} under {category.parent.name}.")
-            db.close()
-            typer.run(start_menu)
-        else:
-            typer.run(start_menu)
+    if not use_test_db:
+        typer.run(start_menu)
     return kwargs
 
 
@@ -50,36 +75,27 @@ def save_account(
         use_test_db: bool = False,
         name: str = typer.Option(..., prompt="What's the account name?"),
         value: float = typer.Option(0.0, prompt="What's the account balance?"),
-        category: CategoryChoice = typer.Option(default=None, prompt="Select a category:",
-                                                show_choices=True,
-                                                case_sensitive=False),
+        category: str = typer.Option(default=None, help="Category. Prompted for when omitted."),
         remarks: str = typer.Option("", prompt="Any remarks?")
 ):
-    if category is None:
-        category = CategoryChoice.Assets  # Set default value
-
-    kwargs = locals()
-    del kwargs['use_test_db']
-    # convert CategoryChoice obj to Category obj
-    category_choice = kwargs['category']
-    category = Category.from_enum(category_choice)
-    kwargs['category'] = category
-
-    account = Account.from_dict(kwargs)
-    if use_test_db:
-        db = SqliteDb('ledger.db', test=use_test_db)
-        db.upsert_account(account)
-        print(f"Saved {account.name}: {account.value:.2f} under {account.category.name}.")
-        db.close()
-    else:
-        if typer.confirm("Do you want to save?", default=True):
-            db = SqliteDb('ledger.db')
+    # categories are only loaded from the database once this command runs, and the connection is handed back even
+    # when the choice is rejected
+    with open_db(use_test_db) as db:
+        category = resolve_category_choice(category, db)
+        kwargs = locals()
+        del kwargs['use_test_db']
+        del kwargs['db']
+        # convert the category name or CategoryEnum obj to Category obj
+        category_choice = kwargs['category']
+        category = Category.from_enum(category_choice)
+        kwargs['category'] = category
+
+        account = Account.from_dict(kwargs)
+        if use_test_db or typer.confirm("Do you want to save?", default=True):
             db.upsert_account(account)
             print(f"Saved {account.name}: {account.value:.2f} under {account.category.name}.")
-            db.close()
-            typer.run(start_menu)
-        else:
-            typer.run(start_menu)
+    if not use_test_db:
+        typer.run(start_menu)
     return kwargs
 
 
@@ -87,8 +103,8 @@ def save_account(
 def disable_account(
         use_test_db: bool = False,
 ):
-    selected_choice = prompt_selected_choice(enabled_accounts)
-    db = SqliteDb('ledger.db', test=use_test_db)
+    db = open_db(use_test_db)
+    selected_choice = search_selected_choice(db, 'account', is_disabled=0)
     db.disable_account(selected_choice)
     db.close()
 
@@ -97,8 +113,8 @@ def disable_account(
 def enable_account(
         use_test_db: bool = False,
 ):
-    selected_choice = prompt_selected_choice(disabled_accounts)
-    db = SqliteDb('ledger.db', test=use_test_db)
+    db = open_db(use_test_db)
+    selected_choice = search_selected_choice(db, 'account', is_disabled=1)
     db.enable_account(selected_choice)
     db.close()
 
@@ -107,11 +123,10 @@ def enable_account(
 def disable_accounts_in_leaf_category(
         use_test_db: bool = False,
 ):
-    db = SqliteDb('ledger.db', test=use_test_db)
-    choices = db.get_category_names()
-    leaves = db.get_leaf_categories('Assets')
-    leaves.extend(db.get_leaf_categories('Liabilities'))
-    selected_choice = prompt_selected_choice(choices, leaves)
+    db = open_db(use_test_db)
+    leaves = set(db.get_leaf_categories('Assets'))
+    leaves.update(db.get_leaf_categories('Liabilities'))
+    selected_choice = search_selected_choice(db, 'category', matching_items=leaves)
     subcategories = db.get_subcategories(selected_choice)
     if len(subcategories) != 0:
         print(f'{selected_choice} has subcategories {subcategories}.'
@@ -122,7 +137,8 @@ def disable_accounts_in_leaf_category(
         child_accounts = db.get_all_account_names_in_category(selected_choice)
         print(f'{selected_choice} is a leaf category with accounts:', child_accounts)
         if typer.confirm("Do you want to disable?", default=True):
-            db.disable_many_accounts(child_accounts)
+            disabled_accounts = db.disable_many_accounts(child_accounts)
+            print(f'Disabled {len(disabled_accounts)} accounts in {selected_choice}.')
             db.close()
             typer.run(start_menu)
         else:
@@ -130,6 +146,117 @@ def disable_accounts_in_leaf_category(
             typer.run(start_menu)
 
 
+@app.command(name="import")
+def import_ledger(
+        file: Path = typer.Argument(..., exists=True, dir_okay=False, help="CSV or JSONL file of records."),
+        use_test_db: bool = False,
+        batch_size: int = typer.Option(importer.DEFAULT_BATCH_SIZE, min=1, help="Records per committed batch."),
+        file_format: str = typer.Option(None, "--format", help="csv or jsonl. Guessed from the extension."),
+        restart: bool = typer.Option(False, help="Ignore the checkpoint of an unfinished import of this file."),
+):
+    """
+    Import categories and accounts from a CSV or JSONL file, resuming an unfinished import of the same file.
+    """
+    def report(rows, rate):
+        print(f"Committed {rows:,} rows ({rate:,.0f} rows/s)")
+
+    db = open_db(use_test_db)
+    try:
+        imported, skipped, seconds = importer.import_file(db, str(file), batch_size=batch_size,
+                                                          file_format=file_format, restart=restart,
+                                                          on_batch=report)
+    except ValueError as error:
+        print(f"Import stopped: {error}")
+        raise typer.Exit(code=1)
+    finally:
+        db.close()
+    if skipped:
+        print(f"Resumed after {skipped:,} rows committed by an earlier run.")
+    print(f"Imported {imported:,} rows in {seconds:.2f}s ({imported / max(seconds, 1e-9):,.0f} rows/s).")
+    return imported
+
+
+@app.command(name="export")
+def export_ledger(
+        output: str = typer.Argument(..., help="Output file, or - for standard output."),
+        use_test_db: bool = False,
+        file_format: str = typer.Option(None, "--format", help="csv, json, jsonl or columnar. Guessed from the "
+                                                               "extension."),
+        category: str = typer.Option(None, help="Only export this category and everything below it."),
+):
+    """
+    Export categories and accounts as CSV, JSON, JSON Lines or a columnar binary file, streamed from the database.
+    """
+    db = open_db(use_test_db)
+    try:
+        count = exporter.export_ledger(db, output, file_format=file_format, name=category)
+    except ValueError as error:
+        print(f"Export stopped: {error}")
+        raise typer.Exit(code=1)
+    finally:
+        db.close()
+    if output != '-':
+        print(f"Exported {count:,} rows to {output}.")
+    return count
+
+
+@app.command()
+def show_balance_sheet(
+        use_test_db: bool = False,
+        as_of: str = typer.Option(None, help="Date or ISO timestamp to show the balance sheet as it was then."),
+):
+    db = open_db(use_test_db)
+    try:
+        print_balance_sheet(db, as_of=as_of)
+    except ValueError as error:
+        print(error)
+    finally:
+        db.close()
+
+
+@app.command()
+def consolidate(
+        ledgers: List[Path] = typer.Argument(..., exists=True, help="Ledger files, or directories of .db files."),
+        workers: int = typer.Option(None, min=1, help="Processes loading ledgers. Defaults to the number of cores."),
+        as_of: str = typer.Option(None, help="Date or ISO timestamp to consolidate the ledgers as they were then."),
+):
+    """
+    Show one balance sheet that adds up every given ledger, with categories and accounts merged by name.
+    """
+    try:
+        merged = consolidation.consolidate([str(ledger) for ledger in ledgers], as_of=as_of, workers=workers)
+    except ValueError as error:
+        print(error)
+        raise typer.Exit(code=1)
+    for path, problem in merged['skipped']:
+        print(f"Skipped {path}: {problem}")
+    print_balance_sheet_dict(merged['Assets'], merged['Liabilities'], as_of=as_of,
+                             title=f"Consolidated Balance Sheet of {merged['ledgers']} ledgers")
+    return merged
+
+
+@app.command()
+def check_rollups(
+        use_test_db: bool = False,
+        repair: bool = typer.Option(False, help="Recalculate every category when a mismatch is found."),
+):
+    """
+    Compare the incrementally maintained category totals against a full recalculation.
+    """
+    db = open_db(use_test_db)
+    mismatches = db.check_rollups()
+    if not mismatches:
+        print("All category totals are consistent.")
+    else:
+        for name, stored, expected in mismatches:
+            print(f"{name}: stored {stored:,.2f}, expected {expected:,.2f}")
+        if repair:
+            db.calculate_every_category()
+            print("Recalculated every category.")
+    db.close()
+    return mismatches
+
+
 @app.command()
 def exit_menu():
     raise typer.Exit
@@ -143,13 +270,30 @@ def start_menu():
     """
     print(BLUE + "Main menu" + RESET)
     commands_dict = {command.callback.__name__: command.callback for command in app.registered_commands}
-    actions = list(commands_dict.keys())
-    actions.remove('start_menu')
+    actions = [action for action in commands_dict.keys() if action not in NON_MENU_COMMANDS]
     selected_choice = prompt_selected_choice(actions)
     command_func = commands_dict[selected_choice]
     typer.run(command_func)
     return selected_choice
 
 
+@app.callback(invoke_without_command=True)
+def main(
+        ctx: typer.Context,
+        profile: bool = typer.Option(False, "--profile", help="Report time spent per database method and statement."),
+):
+    """
+    Opens the main menu when no command is given.
+    """
+    global profiled_dbs
+    # the pooled connections outlive each SqliteDb, so they are closed when the command is done
+    ctx.call_on_close(registry.close_all)
+    if profile:
+        profiled_dbs = []
+        ctx.call_on_close(print_profile)
+    if ctx.invoked_subcommand is None:
+        start_menu()
+
+
 if __name__ == "__main__":
-    typer.run(start_menu)
+    app()
@@ -1,9 +1,12 @@
 from enum import Enum
-from rich import print
 
 import typer
 
-from db_layer.database import SqliteDb
+from db_layer.database import SEARCH_LIMIT
+
+# Choices are read from the database only when a command asks for them, never at import time, so --help and
+# commands that need no choices do no database I/O. Categories and accounts are looked up in the search index as
+# the user types rather than listed in full.
 
 
 class CategoryEnum(str, Enum):
@@ -12,36 +15,66 @@ class CategoryEnum(str, Enum):
     """
     @classmethod
     def from_category_list(cls, list_data):
-        print(list_data)
         enum_values = [(name.upper(), name) for name in list_data]  # enum class attributes
         return cls("CategoryEnum", enum_values)
 
 
-def load_category_enum():
+def resolve_category_choice(choice, db):
     """
-    Reads the database for list of category names and convert that into a CategoryEnum object.
-    :return: CategoryEnum object instance
+    Checks a category name typed on the command line against the database, ignoring case. Enum members are passed
+    through unchanged. Prompts with search_selected_choice() when choice is None.
+    :param choice: str, CategoryEnum member or None.
+    :param db: SqliteDb object the command opened.
+    :return: str category name, or the CategoryEnum member given.
     """
-    db = SqliteDb('ledger.db')
-    category_names = db.get_category_names()
-    db.close()
-    if not category_names:
-        result = CategoryEnum.from_category_list(['Assets', 'Liabilities'])
-    else:
-        result = CategoryEnum.from_category_list(category_names)
-    return result
-
+    if isinstance(choice, Enum):
+        return choice
+    if choice is None:
+        return search_selected_choice(db, 'category')
+    if db.get_category_id(choice) is not None:
+        return choice
+    matches = [match['name'] for match in db.search(choice, kind='category')]
+    for name in matches:
+        if name.lower() == choice.lower():
+            return name
+    if matches:
+        raise typer.BadParameter(f"{choice} is not a category. Did you mean {', '.join(matches)}?")
+    raise typer.BadParameter(f"{choice} is not a category.")
 
-def load_accounts(enabled=True):
-    db = SqliteDb('ledger.db')
-    result = db.get_accounts(enabled=enabled)
-    db.close()
-    return result
 
-
-CategoryChoice = load_category_enum()
-enabled_accounts = load_accounts(enabled=True)
-disabled_accounts = load_accounts(enabled=False)
+def search_selected_choice(db, kind, is_disabled=None, limit=SEARCH_LIMIT, matching_items=None):
+    """
+    Asks for part of a name and numbers only the best matches from the search index, rather than every choice,
+    indenting matching items if provided.
+    :param db: SqliteDb object
+    :param kind: 'account' or 'category'
+    :param is_disabled: offer only disabled accounts when 1, only enabled ones when 0.
+    :param limit: most matches listed.
+    :param matching_items: set (optional)
+    :return: str
+    """
+    while True:
+        query = typer.prompt(f"Search {kind} names")
+        matches = [match['name'] for match in db.search(query, kind=kind, limit=limit, is_disabled=is_disabled)]
+        if not matches:
+            typer.echo(f"No {kind} matches {query}. Please try again.")
+            continue
+        numbered_choices = "\n".join(f"\t{index + 1}. {name}" if matching_items and name in matching_items
+                                     else f"{index + 1}. {name}" for index, name in enumerate(matches))
+        while True:
+            choice = typer.prompt(f"Enter number to select, 0 to search again:\n{numbered_choices}\t")
+            if choice.strip() == '0':
+                break
+            try:
+                index = int(choice) - 1
+                if index < 0:
+                    raise IndexError
+                selected_choice = matches[index]
+            except (ValueError, IndexError):
+                typer.echo("Invalid choice. Please try again.")
+                continue
+            typer.echo(f"{selected_choice} selected.")
+            return selected_choice
 
 
 def prompt_selected_choice(choices, matching_items=None):
@@ -69,4 +102,3 @@ def prompt_selected_choice(choices, matching_items=None):
         typer.echo("Invalid choice. Please try again.")
         return prompt_selected_choice(choices)
         return prompt_selected_choice(choices, matching_items)
-
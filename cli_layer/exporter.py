@@ -0,0 +1,188 @@
+"""
+Exports the category tree and accounts for other programs. Rows are written as they come off the database cursor,
+so an export runs in constant memory however large the ledger is. The csv and jsonl exports can be imported again.
+"""
+import csv
+import json
+import os
+import struct
+import sys
+from array import array
+from itertools import islice
+
+from db_layer.database import LEDGER_COLUMNS
+
+FORMATS = {'.csv': 'csv', '.json': 'json', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.ledgerc': 'columnar'}
+BINARY_FORMATS = ('columnar',)
+
+# columnar format: magic, a length-prefixed JSON header naming the columns and their types, then row groups that
+# each start with their row count. A row group holds every column in turn as a null mask of one byte per row followed
+# by the values: little-endian float64 for real, int64 for integer, and uint32 end offsets then UTF-8 bytes for text.
+# A row group of zero rows ends the file.
+COLUMNAR_MAGIC = b'LEDGERC1'
+COLUMN_TYPES = {'type': 'text', 'name': 'text', 'parent': 'text', 'category': 'text', 'value': 'real',
+                'description': 'text', 'remarks': 'text', 'is_disabled': 'integer', 'depth': 'integer'}
+ROW_GROUP_SIZE = 8192
+NUMBER_TYPECODES = {'real': 'd', 'integer': 'q'}
+
+
+def detect_format(path):
+    """
+    Guesses the export format from the extension of the output file.
+    :return: 'csv', 'json', 'jsonl' or 'columnar'
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Cannot tell the format of {path}. Use a {', '.join(FORMATS)} file or pass the format.")
+    return FORMATS[extension]
+
+
+def write_csv(rows, file):
+    writer = csv.writer(file)
+    writer.writerow(LEDGER_COLUMNS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def write_jsonl(rows, file):
+    count = 0
+    for row in rows:
+        file.write(json.dumps(dict(zip(LEDGER_COLUMNS, row))) + '\n')
+        count += 1
+    return count
+
+
+def write_json(rows, file):
+    """
+    Writes one JSON array of row objects, element by element.
+    """
+    count = 0
+    file.write('[')
+    for row in rows:
+        file.write((',\n' if count else '\n') + json.dumps(dict(zip(LEDGER_COLUMNS, row))))
+        count += 1
+    file.write('\n]\n')
+    return count
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tobytes()
+
+
+def encode_column(column_type, values):
+    """
+    :return: bytes of one column of a row group.
+    """
+    nulls = bytes(value is None for value in values)
+    if column_type in NUMBER_TYPECODES:
+        numbers = array(NUMBER_TYPECODES[column_type], (0 if value is None else value for value in values))
+        return nulls + _little_endian(numbers)
+    encoded = [b'' if value is None else str(value).encode('utf-8') for value in values]
+    offsets = array('I')
+    end = 0
+    for item in encoded:
+        end += len(item)
+        offsets.append(end)
+    return nulls + _little_endian(offsets) + b''.join(encoded)
+
+
+def write_columnar(rows, file, row_group_size=ROW_GROUP_SIZE):
+    """
+    Writes rows in the columnar format, one row group at a time. See COLUMNAR_MAGIC.
+    :param file: binary stream.
+    """
+    header = json.dumps({'columns': [[name, COLUMN_TYPES[name]] for name in LEDGER_COLUMNS]}).encode('utf-8')
+    file.write(COLUMNAR_MAGIC + struct.pack('<I', len(header)) + header)
+    count = 0
+    rows = iter(rows)
+    while True:
+        group = list(islice(rows, row_group_size))
+        file.write(struct.pack('<I', len(group)))
+        if not group:
+            return count
+        for index, name in enumerate(LEDGER_COLUMNS):
+            file.write(encode_column(COLUMN_TYPES[name], [row[index] for row in group]))
+        count += len(group)
+
+
+def _read_exactly(file, size):
+    data = file.read(size)
+    if len(data) != size:
+        raise ValueError("Columnar export ends early")
+    return data
+
+
+def decode_column(file, column_type, length):
+    nulls = _read_exactly(file, length)
+    if column_type in NUMBER_TYPECODES:
+        values = array(NUMBER_TYPECODES[column_type])
+        values.frombytes(_read_exactly(file, length * values.itemsize))
+    else:
+        offsets = array('I')
+        offsets.frombytes(_read_exactly(file, length * offsets.itemsize))
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        data = _read_exactly(file, offsets[-1] if length else 0)
+        starts = [0] + offsets[:-1].tolist()
+        values = [data[start:end].decode('utf-8') for start, end in zip(starts, offsets)]
+        return [None if null else value for null, value in zip(nulls, values)]
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return [None if null else value for null, value in zip(nulls, values.tolist())]
+
+
+def read_columnar(file):
+    """
+    Reads a columnar export back one row group at a time.
+    :param file: binary stream.
+    :return: generator of dicts keyed by column name.
+    """
+    if _read_exactly(file, len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError("Not a columnar ledger export")
+    header_length, = struct.unpack('<I', _read_exactly(file, 4))
+    columns = json.loads(_read_exactly(file, header_length))['columns']
+    while True:
+        length, = struct.unpack('<I', _read_exactly(file, 4))
+        if not length:
+            return
+        values = [decode_column(file, column_type, length) for _, column_type in columns]
+        names = [name for name, _ in columns]
+        for row in zip(*values):
+            yield dict(zip(names, row))
+
+
+WRITERS = {'csv': write_csv, 'json': write_json, 'jsonl': write_jsonl, 'columnar': write_columnar}
+
+
+def export_ledger(db, path, file_format=None, name=None):
+    """
+    Streams the ledger, or the subtree of one category, to a file.
+    :param db: SqliteDb object.
+    :param path: path of the output file, or '-' for standard output.
+    :param file_format: 'csv', 'json', 'jsonl' or 'columnar', guessed from the extension when omitted.
+    :param name: root category to export. Every root when None.
+    :return: number of rows written.
+    """
+    if file_format is None:
+        if path == '-':
+            raise ValueError("Pass the format when exporting to standard output.")
+        file_format = detect_format(path)
+    if file_format not in WRITERS:
+        raise ValueError(f"Unknown export format {file_format}. Choose one of {', '.join(WRITERS)}.")
+    if name is not None and db.get_category_id(name) is None:
+        raise ValueError(f"No category found with name {name}")
+    rows = db.iter_ledger_rows(name)
+    binary = file_format in BINARY_FORMATS
+
+    if path == '-':
+        stream = sys.stdout.buffer if binary else sys.stdout
+        count = WRITERS[file_format](rows, stream)
+        stream.flush()
+        return count
+    with open(path, 'wb' if binary else 'w', **({} if binary else {'newline': '', 'encoding': 'utf-8'})) as file:
+        return WRITERS[file_format](rows, file)
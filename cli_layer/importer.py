@@ -0,0 +1,130 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from db_layer.database import chunked
+from models.accounting import Category, Account
+
+DEFAULT_BATCH_SIZE = 1000
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+
+def detect_format(path):
+    """
+    Guesses the file format from its extension.
+    :param path: path of the file to import.
+    :return: 'csv' or 'jsonl'
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Cannot tell the format of {path}. Use a .csv or .jsonl file or pass the format.")
+    return FORMATS[extension]
+
+
+def read_records(path, file_format=None):
+    """
+    Streams raw records from a CSV file with a header row or a JSONL file with one object per line.
+    :param path: path of the file to import.
+    :param file_format: 'csv' or 'jsonl', guessed from the extension when omitted.
+    :return: generator of (line number, dict)
+    """
+    file_format = file_format or detect_format(path)
+    with open(path, newline='', encoding='utf-8') as file:
+        if file_format == 'csv':
+            reader = csv.DictReader(file)
+            for record in reader:
+                yield reader.line_num, record
+        elif file_format == 'jsonl':
+            for line_number, line in enumerate(file, start=1):
+                if line.strip():
+                    yield line_number, json.loads(line)
+        else:
+            raise ValueError(f"Unknown import format {file_format}.")
+
+
+def parse_record(record, line_number=None):
+    """
+    Validates a raw record and turns it into a Category or an Account.
+    Every record needs a type of either 'category' or 'account' and a name. Categories take an optional parent and
+    description, accounts need a category and take an optional value, remarks and is_disabled.
+    Empty CSV cells count as missing.
+    :param record: dict
+    :param line_number: used in error messages.
+    :return: Category or Account object.
+    """
+    def field(key, default=None):
+        value = record.get(key)
+        if value is None or value == '':
+            return default
+        return value
+
+    where = f"Line {line_number}: " if line_number is not None else ""
+    record_type = str(field('type', '')).strip().lower()
+    name = field('name')
+    if not name:
+        raise ValueError(f"{where}missing name.")
+
+    if record_type == 'category':
+        parent = field('parent')
+        return Category.from_dict({
+            'name': name,
+            'parent': Category(parent) if parent else None,
+            'description': field('description', ''),
+        })
+
+    if record_type == 'account':
+        category = field('category')
+        if not category:
+            raise ValueError(f"{where}account {name} has no category.")
+        try:
+            value = float(field('value', 0))
+        except (TypeError, ValueError):
+            raise ValueError(f"{where}account {name} has a value that is not a number.")
+        is_disabled = str(field('is_disabled', 0)).strip().lower()
+        if is_disabled not in ('0', '1', 'false', 'true'):
+            raise ValueError(f"{where}account {name} has is_disabled that is not 0 or 1.")
+        return Account.from_dict({
+            'name': name,
+            'value': value,
+            'category': Category(category),
+            'remarks': field('remarks', ''),
+            'is_disabled': int(is_disabled in ('1', 'true')),
+        })
+
+    raise ValueError(f"{where}type must be 'category' or 'account'.")
+
+
+def import_file(db, path, batch_size=DEFAULT_BATCH_SIZE, file_format=None, restart=False, on_batch=None):
+    """
+    Streams a CSV or JSONL file into the database in batches. Categories and accounts of a batch are each written
+    in one bulk upsert, and each batch is committed in one transaction together with the number of rows done, so a
+    crashed import resumes from the last committed batch. A category must appear before the accounts that use it.
+    :param db: SqliteDb object.
+    :param path: path of the file to import.
+    :param batch_size: number of records per batch.
+    :param file_format: 'csv' or 'jsonl', guessed from the extension when omitted.
+    :param restart: ignore the saved checkpoint and start from the first record.
+    :param on_batch: optional callback(rows committed, rows per second) called after each batch.
+    :return: tuple of (rows imported by this run, rows skipped because an earlier run committed them, seconds).
+    """
+    source = os.path.abspath(path)
+    skipped = 0 if restart else db.get_import_checkpoint(source)
+    records = islice(read_records(path, file_format), skipped, None)
+
+    imported = 0
+    started = time.perf_counter()
+    for batch in chunked(records, batch_size):
+        parsed = [parse_record(record, line_number) for line_number, record in batch]
+        # the batch and its checkpoint commit together, so a crash never leaves one without the other
+        with db.transaction():
+            db.bulk_upsert_categories(item for item in parsed if isinstance(item, Category))
+            db.bulk_upsert_accounts(item for item in parsed if isinstance(item, Account))
+            db.save_import_checkpoint(source, skipped + imported + len(batch))
+        imported += len(batch)
+        if on_batch is not None:
+            on_batch(skipped + imported, imported / max(time.perf_counter() - started, 1e-9))
+
+    db.clear_import_checkpoint(source)
+    return imported, skipped, time.perf_counter() - started
@@ -0,0 +1,111 @@
+"""
+Asyncio front-end for SqliteDb. Every call runs on a worker thread so the event loop never blocks on SQLite: writes go
+one at a time through a single writer thread, and reads are spread over a pool of reader threads, each with its own
+connection. With the WAL journal of the 'performance' profile the readers keep serving while an import is writing.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from db_layer.database import SqliteDb
+
+DEFAULT_READERS = 4
+
+# methods that only read, served concurrently by the reader threads
+READ_METHODS = (
+    'is_descendant', 'get_expected_category_values', 'check_rollups', 'get_postings', 'get_balance_summary',
+    'get_category_tree', 'get_compact_tree', 'get_category_tree_as_of', 'get_import_checkpoint', 'get_category_id',
+    'get_category_names', 'get_subcategories', 'get_leaf_categories', 'get_ancestors', 'get_account_by_name',
+    'get_accounts', 'get_all_account_names_in_category', 'search',
+)
+
+# methods that write, queued on the writer thread in the order they were awaited
+WRITE_METHODS = (
+    'calculate_category_value', 'calculate_every_category', 'upsert_category', 'upsert_account',
+    'bulk_upsert_categories', 'bulk_upsert_accounts', 'post_entry', 'bulk_post', 'delete_account', 'delete_category',
+    'set_account_disabled', 'disable_account', 'enable_account', 'set_many_accounts_disabled',
+    'disable_many_accounts', 'enable_many_accounts', 'save_import_checkpoint', 'clear_import_checkpoint',
+)
+
+# methods without a coroutine: propagate_value() does not commit and only makes sense inside another write, the
+# generators of iter_ledger_rows() and transaction() would be used away from the thread that owns the connection,
+# and stats() would only report on whichever worker thread happened to run it
+NOT_DELEGATED = ('close', 'propagate_value', 'iter_ledger_rows', 'transaction', 'stats')
+
+
+class AsyncSqliteDb:
+    """
+    Awaitable counterpart of SqliteDb with the same methods, e.g. `await db.get_category_tree('Assets')`.
+    Each worker thread opens its own SqliteDb on first use, so connections are never shared between threads.
+    """
+
+    def __init__(self, filename=None, test=False, readers=DEFAULT_READERS, **options):
+        """
+        :param filename: see SqliteDb.
+        :param test: see SqliteDb.
+        :param readers: number of reader threads.
+        :param options: further SqliteDb arguments, e.g. profile or incremental.
+        """
+        self._arguments = dict(options, filename=filename, test=test)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ledger-writer')
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='ledger-reader')
+        self._local = threading.local()
+        self._opened = []
+        self._lock = threading.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def _db(self):
+        """
+        :return: the SqliteDb of the calling worker thread.
+        """
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = SqliteDb(**self._arguments)
+            self._local.db = db
+            with self._lock:
+                self._opened.append(db)
+        return db
+
+    def _call(self, name, args, kwargs):
+        return getattr(self._db(), name)(*args, **kwargs)
+
+    async def _run(self, executor, name, args, kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, partial(self._call, name, args, kwargs))
+
+    async def close(self):
+        """
+        Waits for queued calls to finish, then hands every connection back to the registry.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._shutdown)
+
+    def _shutdown(self):
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._lock:
+            for db in self._opened:
+                db.close()
+            self._opened.clear()
+
+
+def _delegate(name, write):
+    method = getattr(SqliteDb, name)
+
+    @wraps(method)
+    async def call(self, *args, **kwargs):
+        return await self._run(self._writer if write else self._readers, name, args, kwargs)
+
+    return call
+
+
+for _name in READ_METHODS:
+    setattr(AsyncSqliteDb, _name, _delegate(_name, write=False))
+for _name in WRITE_METHODS:
+    setattr(AsyncSqliteDb, _name, _delegate(_name, write=True))
@@ -0,0 +1,83 @@
+"""
+In-process read-through cache for lookups that rarely change, such as category ids by name or the list of category
+names. Entries are evicted least recently used first, and the write methods of SqliteDb invalidate exactly the kinds
+of entries they can change. Writes made outside SqliteDb, e.g. by another process, are not seen until clear() is called.
+"""
+import threading
+from collections import OrderedDict
+
+LOOKUP_CACHE_SIZE = 1024
+
+
+class LookupCache:
+    """
+    Bounded LRU mapping of (kind, argument) keys to loaded values, with hit and miss counters. Safe to share between
+    threads and between SqliteDb instances on the same file.
+    """
+
+    def __init__(self, max_entries=LOOKUP_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped by every invalidation, so a value loaded while a write committed is not stored
+        self._generation = 0
+
+    def get(self, kind, argument, load):
+        """
+        Returns the cached value of (kind, argument), or calls load() and caches its result. None is never cached,
+        so a name that does not exist yet is looked up again next time.
+        :param kind: name of the lookup, used by invalidate().
+        :param argument: hashable argument of the lookup.
+        :param load: function without arguments that reads the value from the database.
+        """
+        key = (kind, argument)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            generation = self._generation
+        value = load()
+        if value is None:
+            return value
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, kind, argument=None):
+        """
+        Drops one entry, or every entry of the given kind when argument is None.
+        """
+        with self._lock:
+            self._generation += 1
+            if argument is not None:
+                self._entries.pop((kind, argument), None)
+                return
+            for key in [key for key in self._entries if key[0] == kind]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        """
+        :return: dict of hits, misses, evictions and the number of entries held.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries)}
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
@@ -0,0 +1,199 @@
+"""
+Process-wide registry of SQLite connections keyed by database path. Closing a SqliteDb hands its connection back here
+instead of closing it, and the schema of a file is checked once per process rather than once per SqliteDb. The lookup
+cache of a file lives here too, so every SqliteDb on the same file shares it. A file deleted or replaced under the
+same path is told apart by its device and inode, and set up again from scratch.
+"""
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from db_layer import schema
+from db_layer.cache import LookupCache
+
+MAX_IDLE_CONNECTIONS = 4
+
+# Named sets of PRAGMAs applied to every connection. cache_size is in KiB when negative, mmap_size in bytes.
+PROFILES = {
+    # WAL lets readers run alongside a writer and, with synchronous=NORMAL, only syncs at checkpoints. A power loss
+    # can drop the last few commits but never corrupts the file.
+    'performance': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -64000,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    },
+    # SQLite defaults: rollback journal and a sync on every commit.
+    'durable': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+    },
+}
+DEFAULT_PROFILE = 'performance'
+
+
+def resolve_profile(profile=DEFAULT_PROFILE, **overrides):
+    """
+    Looks up a named profile and applies any overrides, e.g. resolve_profile('performance', cache_size=-200000).
+    :return: tuple of (pragma, value) pairs
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile {profile}. Choose one of {', '.join(PROFILES)}.")
+    pragmas = dict(PROFILES[profile])
+    for pragma, value in overrides.items():
+        if pragma not in pragmas:
+            raise ValueError(f"Unknown pragma {pragma}.")
+        if value is not None:
+            pragmas[pragma] = value
+    return tuple(pragmas.items())
+
+
+def apply_pragmas(connection, pragmas):
+    for pragma, value in pragmas:
+        connection.execute(f"PRAGMA {pragma} = {value}")
+
+
+def file_identity(path):
+    """
+    Tells a file apart from another one later created under the same path. Open connections keep their file's inode
+    alive, so a replacement made while any is open always gets a different one.
+    :return: (device, inode) tuple, or None when there is no file at the path.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+def open_read_only(path, pragmas=None):
+    """
+    Opens a connection that cannot change the file: nothing is created or migrated and the journal mode is left as
+    the file has it. Not pooled, so close it when done.
+    :param path: path of an existing database file.
+    :param pragmas: (pragma, value) pairs from resolve_profile().
+    :return: sqlite3 connection
+    """
+    pragmas = pragmas if pragmas is not None else resolve_profile()
+    uri = Path(os.path.abspath(path)).as_uri() + '?mode=ro'
+    connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    apply_pragmas(connection, [(pragma, value) for pragma, value in pragmas if pragma != 'journal_mode'])
+    return connection
+
+
+class ConnectionRegistry:
+    """
+    Pools idle connections per database file. A connection is only ever used by one SqliteDb at a time, so they are
+    opened with check_same_thread=False and may be handed to a different thread next time.
+    """
+
+    def __init__(self, max_idle=MAX_IDLE_CONNECTIONS):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}
+        # file_identity() of each file when it was set up, and of the file each connection was opened on
+        self._initialised = {}
+        self._identities = {}
+        self._pragmas = {}
+        self._caches = {}
+
+    def acquire(self, path, pragmas=None):
+        """
+        Returns an idle connection to the given file, or opens a new one. The first connection to a file creates its
+        directory and migrates its schema. When the file was deleted or replaced since, the idle connections and the
+        cache of the old one are dropped and the new file is set up the same way.
+        :param path: path of the database file.
+        :param pragmas: (pragma, value) pairs from resolve_profile(). Only re-applied when they differ from the ones
+        the connection was last set up with.
+        :return: sqlite3 connection
+        """
+        path = os.path.abspath(path)
+        pragmas = pragmas if pragmas is not None else resolve_profile()
+        identity = file_identity(path)
+        with self._lock:
+            stale = []
+            if path in self._initialised and self._initialised[path] != identity:
+                stale = self._idle.pop(path, [])
+                del self._initialised[path]
+                if path in self._caches:
+                    self._caches[path].clear()
+            idle = self._idle.get(path)
+            if idle:
+                connection = idle.pop()
+            elif path not in self._initialised:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                connection = sqlite3.connect(path, check_same_thread=False)
+                schema.migrate(connection)
+                self._initialised[path] = self._identities[connection] = file_identity(path)
+            else:
+                connection = None
+            for old in stale:
+                self._forget(old)
+        for old in stale:
+            old.close()
+        if connection is None:
+            connection = sqlite3.connect(path, check_same_thread=False)
+            with self._lock:
+                self._identities[connection] = identity
+        if self._pragmas.get(connection) != pragmas:
+            apply_pragmas(connection, pragmas)
+            self._pragmas[connection] = pragmas
+        return connection
+
+    def release(self, path, connection):
+        """
+        Takes a connection back. Anything left uncommitted is rolled back. Connections beyond max_idle, and those to a
+        file that has been replaced since they were opened, are closed.
+        """
+        path = os.path.abspath(path)
+        if connection.in_transaction:
+            connection.rollback()
+        with self._lock:
+            idle = self._idle.setdefault(path, [])
+            current = self._identities.get(connection) == self._initialised.get(path)
+            if current and len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+            self._forget(connection)
+        connection.close()
+
+    def _forget(self, connection):
+        self._pragmas.pop(connection, None)
+        self._identities.pop(connection, None)
+
+    def cache(self, path):
+        """
+        :return: the LookupCache shared by every SqliteDb on the given file.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            if path not in self._caches:
+                self._caches[path] = LookupCache()
+            return self._caches[path]
+
+    def idle_count(self, path):
+        with self._lock:
+            return len(self._idle.get(os.path.abspath(path), []))
+
+    def close_all(self):
+        """
+        Closes every idle connection and forgets which files were set up and what was cached from them, e.g. before
+        deleting database files.
+        """
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    self._forget(connection)
+                    connection.close()
+            self._idle.clear()
+            self._initialised.clear()
+            for cache in self._caches.values():
+                cache.clear()
+
+
+registry = ConnectionRegistry()
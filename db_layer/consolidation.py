@@ -0,0 +1,111 @@
+"""
+Consolidated balance sheet over many ledger files. Each file is opened and its trees are loaded in a worker process,
+and the trees are merged by name in the parent as they come back, so the work spreads over every core. Files are only
+ever opened read-only: a report never migrates, or otherwise changes, a file it reads.
+"""
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_context
+
+from db_layer.connections import open_read_only
+from db_layer.database import SqliteDb
+from db_layer.schema import check_ledger
+from models.accounting import merge_trees
+
+ROOT_CATEGORIES = ('Assets', 'Liabilities')
+
+
+def load_trees(path, as_of=None):
+    """
+    Loads the root category trees of one ledger. Runs in a worker process.
+    :param path: path of the ledger file.
+    :param as_of: see SqliteDb.get_category_tree().
+    :return: tuple of nested dicts, one per name in ROOT_CATEGORIES.
+    """
+    with SqliteDb(path, read_only=True) as db:
+        try:
+            return tuple(db.get_category_tree(name, as_of=as_of) for name in ROOT_CATEGORIES)
+        except ValueError as error:
+            raise ValueError(f"{path}: {error}") from error
+
+
+def ledger_problem(path):
+    """
+    :return: str saying why the file cannot be consolidated, or None when it is a ledger.
+    """
+    try:
+        connection = open_read_only(path)
+    except sqlite3.Error as error:
+        return str(error)
+    try:
+        return check_ledger(connection)
+    except sqlite3.DatabaseError as error:
+        return str(error)
+    finally:
+        connection.close()
+
+
+def find_ledgers(paths, skipped=None):
+    """
+    Expands directories into the ledger files directly inside them, in name order. Other .db files in a directory
+    are left out, while a file given by name must be a ledger.
+    :param skipped: optional list that receives (path, reason) for every file of a directory that was left out.
+    :return: list of absolute file paths.
+    """
+    ledgers = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if not os.path.isdir(path):
+            problem = ledger_problem(path)
+            if problem is not None:
+                raise ValueError(f"{path}: {problem}")
+            ledgers.append(path)
+            continue
+        for name in sorted(os.listdir(path)):
+            if not name.endswith('.db'):
+                continue
+            problem = ledger_problem(os.path.join(path, name))
+            if problem is None:
+                ledgers.append(os.path.join(path, name))
+            elif skipped is not None:
+                skipped.append((os.path.join(path, name), problem))
+    return ledgers
+
+
+def consolidate(paths, as_of=None, workers=None):
+    """
+    Merges the balance sheets of many ledgers into one.
+    :param paths: ledger files, or directories of them.
+    :param as_of: see SqliteDb.get_category_tree().
+    :param workers: number of processes. Defaults to the number of cores, and 1 loads the ledgers in this process.
+    :return: dict of the merged 'Assets' and 'Liabilities' trees, the number of 'ledgers', and the (path, reason)
+    of every file of a directory that was 'skipped' as not a ledger.
+    """
+    skipped = []
+    ledgers = find_ledgers(paths, skipped)
+    if not ledgers:
+        raise ValueError("No ledger files to consolidate")
+    workers = min(workers or os.cpu_count() or 1, len(ledgers))
+
+    merged = dict.fromkeys(ROOT_CATEGORIES)
+    for trees in load_all(ledgers, as_of, workers):
+        for name, tree in zip(ROOT_CATEGORIES, trees):
+            merged[name] = merge_trees([tree], merged[name])
+    merged['ledgers'] = len(ledgers)
+    merged['skipped'] = skipped
+    return merged
+
+
+def load_all(ledgers, as_of, workers):
+    """
+    Yields the trees of every ledger in order, loaded by a pool of worker processes.
+    """
+    load = partial(load_trees, as_of=as_of)
+    if workers == 1:
+        yield from map(load, ledgers)
+        return
+    # spawned rather than forked workers, so no SQLite connection of this process is inherited
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as executor:
+        yield from executor.map(load, ledgers, chunksize=max(1, len(ledgers) // (workers * 4)))
@@ -1,61 +1,232 @@
 import os
 import sqlite3
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, time, timezone
+from itertools import combinations, islice
 from rich import print
 
+from db_layer import instrumentation, schema, vectorized as numpy_rollups
+from db_layer.connections import DEFAULT_PROFILE, open_read_only, registry, resolve_profile
+from models.compact import CompactTree
+
+BULK_CHUNK_SIZE = 500
+# SQLITE_MAX_VARIABLE_NUMBER of standard builds since 3.32, so no statement binds more parameters than this
+MAX_VARIABLES = 32766
+# columns of iter_ledger_rows(), named like the fields the importer reads so an export can be imported again
+LEDGER_COLUMNS = ('type', 'name', 'parent', 'category', 'value', 'description', 'remarks', 'is_disabled', 'depth')
+SEARCH_KINDS = ('account', 'category')
+SEARCH_LIMIT = 10
+# the trigram index cannot match fewer than three characters, shorter queries only match the start of names
+TRIGRAM_LENGTH = 3
+# share of the trigrams of a query a name needs for a fuzzy match
+FUZZY_THRESHOLD = 0.5
+# rows read from the full-text index per step of a search, the only ones ranked
+SEARCH_CANDIDATES = 200
+
+
+def chunked(iterable, size):
+    """
+    Yields lists of at most size items from any iterable without materialising it.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def trigrams(text):
+    return {text[index:index + TRIGRAM_LENGTH] for index in range(len(text) - TRIGRAM_LENGTH + 1)}
+
+
+def fts_phrase(text):
+    """
+    Quotes text as one FTS5 phrase, so operators and punctuation in it are matched literally.
+    """
+    return '"' + text.replace('"', '""') + '"'
+
+
+def build_tree(categories, accounts):
+    """
+    Builds the nested dict of a category subtree in one pass and sums category values on the way.
+    :param categories: (id, name, parent_id) rows with the root first and every parent before its children.
+    :param accounts: (category_id, name, value, remarks) rows of enabled accounts in the subtree.
+    :return: nested dict of the root category.
+    """
+    return CompactTree.from_rows(categories, accounts).to_dict()
+
+
+def to_utc_timestamp(moment):
+    """
+    Converts a datetime, date or ISO string to the UTC text format the history tables are stamped with.
+    Naive datetimes are taken as local time, and a date, or a string holding only a date, means the end of that day.
+    """
+    if isinstance(moment, str):
+        parsed = datetime.fromisoformat(moment)
+        moment = parsed.date() if len(moment.strip()) == 10 else parsed
+    if not isinstance(moment, datetime):
+        moment = datetime.combine(moment, time.max)
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
 
 class SqliteDb:
     """
     Handles reading and writing to a SQLite database file.
     """
 
-    def __init__(self, filename=None, test=False):
+    def __init__(self, filename=None, test=False, incremental=True, profile=DEFAULT_PROFILE, cache_size=None,
+                 mmap_size=None, instrument=False, read_only=False):
+        """
+        :param filename: name of the database file inside the database directory.
+        :param test: use a test database in the working directory instead.
+        :param incremental: apply only value deltas up the ancestor chain on writes instead of recalculating every
+        category. Set to False for the old full recalculation after every upsert.
+        :param profile: 'performance' for WAL and synchronous=NORMAL, or 'durable' for a rollback journal and a sync
+        on every commit. See PROFILES in db_layer/connections.py.
+        :param cache_size: overrides the page cache size of the profile, in KiB when negative.
+        :param mmap_size: overrides the memory-mapped I/O size of the profile, in bytes.
+        :param instrument: record method and statement timings for stats(). Off by default, when nothing is wrapped.
+        :param read_only: open an existing ledger without writing to it, e.g. for reports over files that belong to
+        someone else. Nothing is migrated, and a file that is not a ledger at the current schema raises ValueError.
+        """
+        self.incremental = incremental
+        self.profile = profile
+        pragmas = resolve_profile(profile, cache_size=cache_size, mmap_size=mmap_size)
         directory = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'database'))
         self.filename = filename
         if test:
             directory = 'database'
             self.filename = f"test_{filename}"
-        os.makedirs(directory, exist_ok=True)
-        db_path = os.path.join(directory, self.filename)
-        self.connection = sqlite3.connect(db_path)
+        self.path = os.path.join(directory, self.filename)
+        self.read_only = read_only
+        if read_only:
+            self.connection = open_read_only(self.path, pragmas)
+            problem = schema.check_ledger(self.connection)
+            if problem is not None:
+                self.connection.close()
+                raise ValueError(f"{self.path}: {problem}")
+        else:
+            # connections are pooled per file and the schema is set up by the registry on first use
+            self.connection = registry.acquire(self.path, pragmas)
         self.cursor = self.connection.cursor()
+        # category ids, category names, leaf sets and account names, shared with every SqliteDb on this file
+        self.cache = registry.cache(self.path)
+        self.profiler = instrumentation.instrument(self) if instrument else None
+        # state of transaction(): nesting depth, whether a full rollup was put off to its end, whether a step failed,
+        # and the cache entries to drop again once it commits or rolls back
+        self._transaction_depth = 0
+        self._rollup_pending = False
+        self._transaction_failed = False
+        self._transaction_invalidations = set()
 
-        # create categories table if it doesn't exist
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS categories (
-                id INTEGER PRIMARY KEY,
-                name TEXT NOT NULL UNIQUE,
-                value REAL NOT NULL,
-                parent_id INTEGER DEFAULT NULL,
-                description TEXT,
-                FOREIGN KEY(parent_id) REFERENCES categories(id)
-            )
-        """)
-
-        # create accounts table if it doesn't exist
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS accounts (
-                id INTEGER PRIMARY KEY,
-                name TEXT NOT NULL UNIQUE,
-                value REAL NOT NULL,
-                category_id INTEGER NOT NULL,
-                remarks TEXT,
-                is_disabled INTEGER DEFAULT 0,
-                FOREIGN KEY(category_id) REFERENCES categories(id)
-            )
-        """)
-
-        # create enabled_accounts view if it doesn't exist
-        self.cursor.execute("""
-            CREATE VIEW IF NOT EXISTS enabled_accounts AS
-            SELECT * FROM accounts WHERE is_disabled = 0
-        """)
+    def __enter__(self):
+        return self
 
-        self.connection.commit()
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
-    # did not grok
     def close(self):
+        """
+        Hands the connection back to the registry. Safe to call more than once.
+        """
+        if self.connection is None:
+            return
+        if self.profiler is not None:
+            # the connection goes back to the pool, so the next user must not be traced
+            self.connection.set_trace_callback(None)
         self.cursor.close()
-        self.connection.close()
+        if self.read_only:
+            self.connection.close()
+        else:
+            registry.release(self.path, self.connection)
+        self.connection = None
+        self.cursor = None
+
+    @contextmanager
+    def transaction(self):
+        """
+        Unit of work: every write inside the block lands in one transaction with one commit at the end, instead of a
+        commit per method. Full rollups that writes would run are put off until the end and run once. If the block
+        raises, or a write inside it failed, everything is rolled back. Transactions nest, and only the outermost one
+        commits.
+            with db.transaction():
+                db.upsert_category(category)
+                db.bulk_upsert_accounts(accounts)
+        """
+        outermost = self._transaction_depth == 0
+        if outermost and not self.connection.in_transaction:
+            # take the write lock up front, so the block cannot fail halfway on a lock upgrade
+            self.cursor.execute("BEGIN IMMEDIATE")
+        self._transaction_depth += 1
+        try:
+            yield self
+            if outermost:
+                if self._transaction_failed:
+                    raise ValueError("A write inside the transaction failed, so it was rolled back")
+                if self._rollup_pending:
+                    self.calculate_every_category()
+        except BaseException:
+            if outermost:
+                self._transaction_depth = 0
+                self._end_transaction(self.connection.rollback)
+            raise
+        finally:
+            if self._transaction_depth:
+                self._transaction_depth -= 1
+        if outermost:
+            self._end_transaction(self.connection.commit)
+
+    def _end_transaction(self, finish):
+        try:
+            finish()
+        finally:
+            self._rollup_pending = False
+            self._transaction_failed = False
+            # entries may have been loaded from uncommitted rows, or from rows that were since rolled back
+            invalidations, self._transaction_invalidations = self._transaction_invalidations, set()
+            for kind, argument in invalidations:
+                self.cache.invalidate(kind, argument)
+
+    def _commit(self):
+        """
+        Commits, unless a transaction() is open, which commits once at its end.
+        """
+        if not self._transaction_depth:
+            self.connection.commit()
+
+    def _rollback(self):
+        """
+        Rolls back, unless a transaction() is open, which is then marked to roll back as a whole at its end.
+        """
+        if self._transaction_depth:
+            self._transaction_failed = True
+        else:
+            self.connection.rollback()
+
+    def _recalculate(self):
+        """
+        Runs the full rollup after a write, or puts it off to the end of the open transaction().
+        """
+        if self._transaction_depth:
+            self._rollup_pending = True
+        else:
+            self.calculate_every_category()
+
+    def _invalidate(self, kind, argument=None):
+        self.cache.invalidate(kind, argument)
+        if self._transaction_depth:
+            self._transaction_invalidations.add((kind, argument))
+
+    def stats(self):
+        """
+        Returns what was recorded since the SqliteDb was opened with instrument=True. See Profiler.stats().
+        :return: dict
+        """
+        if self.profiler is None:
+            raise ValueError("Instrumentation is off. Open the SqliteDb with instrument=True.")
+        return self.profiler.stats()
 
     def calculate_category_value(self, category_id):
         """
@@ -77,33 +248,82 @@ class SqliteDb:
         total_value += sum(child_category_values)
 
         self.cursor.execute("UPDATE categories SET value=? WHERE id=?", (total_value, category_id))
-        self.connection.commit()
+        self._commit()
 
-    def calculate_every_category(self):
+    def calculate_every_category(self, vectorized=False):
         """
         Get all category IDs, ordered by hierarchy depth, then calculate_category_value() to each.
+        :param vectorized: compute every total at once with NumPy instead, which must be installed.
         """
-        # Reset all category values to 0 before calculating
-        self.cursor.execute("UPDATE categories SET value = 0")
-        self.connection.commit()
+        self._rollup_pending = False
+        if vectorized:
+            numpy_rollups.calculate_every_category(self.connection, commit=not self._transaction_depth)
+            return
+        # one transaction for the whole recalculation rather than a commit per category
+        with self.transaction():
+            # Reset all category values to 0 before calculating
+            self.cursor.execute("UPDATE categories SET value = 0")
+
+            # Calculate category values in order of depth in the hierarchy tree. The depth of a category is the
+            # distance to its furthest ancestor in the closure table.
+            query = """
+                SELECT descendant_id FROM category_closure
+                GROUP BY descendant_id
+                ORDER BY MAX(depth) DESC
+            """
+            category_ids = [row[0] for row in self.cursor.execute(query)]
+            for category_id in category_ids:
+                self.calculate_category_value(category_id)
 
-        # Calculate category values in order of depth in the hierarchy tree
+    def propagate_value(self, category_id, delta):
+        """
+        Adds delta to the given category and every one of its ancestors. Does not commit, so the change lands in the
+        same transaction as the write that caused it.
+        :param category_id: id of the category whose subtree value changed.
+        :param delta: amount to add.
+        """
+        if category_id is None or not delta:
+            return
         query = """
-            WITH RECURSIVE category_tree(id, name, value, parent_id, depth) AS (
-                SELECT id, name, value, parent_id, 0
-                FROM categories
-                WHERE parent_id IS NULL
-                UNION ALL
-                SELECT c.id, c.name, c.value, c.parent_id, ct.depth + 1
-                FROM categories c
-                JOIN category_tree ct ON c.parent_id = ct.id
-            )
-            SELECT id FROM category_tree ORDER BY depth DESC;
+            UPDATE categories SET value = value + ?
+            WHERE id IN (SELECT ancestor_id FROM category_closure WHERE descendant_id = ?)
+        """
+        self.cursor.execute(query, (delta, category_id))
+
+    def is_descendant(self, category_id, ancestor_id):
+        """
+        Checks whether category_id sits in the subtree rooted at ancestor_id, the root itself included.
+        """
+        query = "SELECT 1 FROM category_closure WHERE ancestor_id = ? AND descendant_id = ?"
+        self.cursor.execute(query, (ancestor_id, category_id))
+        return self.cursor.fetchone() is not None
+
+    def get_expected_category_values(self):
+        """
+        Recomputes every category value from enabled accounts without writing anything.
+        :return: dict of category name to (stored value, recomputed value).
+        """
+        query = """
+            SELECT c.name, c.value, COALESCE(SUM(a.value), 0.0)
+            FROM categories c
+            LEFT JOIN category_closure cc ON cc.ancestor_id = c.id
+            LEFT JOIN enabled_accounts a ON a.category_id = cc.descendant_id
+            GROUP BY c.id
+        """
+        self.cursor.execute(query)
+        return {name: (stored, expected) for name, stored, expected in self.cursor.fetchall()}
+
+    def check_rollups(self, tolerance=1e-6):
+        """
+        Compares the stored category values against a full recompute.
+        :param tolerance: absolute difference allowed for floating point drift.
+        :return: list of (name, stored value, expected value) for every category that does not match.
         """
-        category_ids = [row[0] for row in self.cursor.execute(query)]
-        self.connection.commit()
-        for category_id in category_ids:
-            self.calculate_category_value(category_id)
+        mismatches = []
+        for name, (stored, expected) in self.get_expected_category_values().items():
+            if abs(stored - expected) > tolerance:
+                mismatches.append((name, stored, expected))
+        return mismatches
 
     def upsert_category(self, category):
         """
@@ -111,43 +331,56 @@ class SqliteDb:
         """
         if category.parent is not None:
             # Check if parent category exists
-            parent_query = "SELECT id FROM categories WHERE name = ?"
-            self.cursor.execute(parent_query, (category.parent.name,))
-            parent_row = self.cursor.fetchone()
-            if parent_row:
-                parent_id = parent_row[0]
-            else:
+            parent_id = self.get_category_id(category.parent.name)
+            if parent_id is None:
                 raise ValueError("Parent category does not exist in the database")
         else:
             parent_id = None
 
-        # Insert or update category record
+        self.cursor.execute("SELECT id, value, parent_id FROM categories WHERE name = ?", (category.name,))
+        old_row = self.cursor.fetchone()
+        if old_row and parent_id is not None and self.is_descendant(parent_id, old_row[0]):
+            raise ValueError("Category cannot be moved under itself or its own subcategory")
+
+        # Insert or update category record. The value column holds the calculated total, so it is never taken from
+        # the Category object: a new category has no children yet and an existing one keeps its subtree total.
         query = """
             INSERT INTO categories (name, value, parent_id, description)
-            VALUES (?, ?, ?, ?)
+            VALUES (?, 0, ?, ?)
             ON CONFLICT (name) DO UPDATE SET
-                value = excluded.value,
                 parent_id = excluded.parent_id,
                 description = excluded.description
         """
-        values = (category.name, category.value, parent_id, category.description)
+        values = (category.name, parent_id, category.description)
         self.cursor.execute(query, values)
-        self.connection.commit()
-        self.calculate_every_category()
+        moved = old_row is not None and old_row[2] != parent_id
+        if self.incremental:
+            # moving a category carries its whole subtree total from the old ancestors to the new ones
+            if moved:
+                self.propagate_value(old_row[2], -old_row[1])
+                self.propagate_value(parent_id, old_row[1])
+        self._commit()
+        if old_row is None:
+            # the id is read through the cache by later writes, and a rolled back transaction() must not leave it there
+            self._invalidate('category_id', category.name)
+            self._invalidate('category_names')
+        if old_row is None or moved:
+            self._invalidate('leaf_categories')
+        if not self.incremental:
+            self._recalculate()
 
     def upsert_account(self, account):
         """
         Upserts the given Account object to the accounts table.
         """
         # Check if category exists
-        category_query = "SELECT id FROM categories WHERE name = ?"
-        self.cursor.execute(category_query, (account.category.name,))
-        category_row = self.cursor.fetchone()
-        if category_row:
-            category_id = category_row[0]
-        else:
+        category_id = self.get_category_id(account.category.name)
+        if category_id is None:
             raise ValueError("Category does not exist in the database")
 
+        self.cursor.execute("SELECT value, category_id, is_disabled FROM accounts WHERE name = ?", (account.name,))
+        old_row = self.cursor.fetchone()
+
         # Insert or update account record
         query = """
             INSERT INTO accounts (name, value, category_id, remarks, is_disabled)
@@ -159,88 +392,591 @@ class SqliteDb:
         """
         values = (account.name, account.value, category_id, account.remarks, account.is_disabled)
         self.cursor.execute(query, values)
-        self.connection.commit()
-        self.calculate_every_category()
+        if self.incremental:
+            # is_disabled is not touched on conflict, so an existing account keeps its old state
+            if old_row is None:
+                is_disabled = account.is_disabled
+            else:
+                is_disabled = old_row[2]
+                if not is_disabled:
+                    self.propagate_value(old_row[1], -old_row[0])
+            if not is_disabled:
+                self.propagate_value(category_id, account.value)
+        self._commit()
+        if old_row is None:
+            self._invalidate('accounts')
+        if not self.incremental:
+            self._recalculate()
 
-    def disable_account(self, name):
-        query = "UPDATE accounts SET is_disabled = 1 WHERE name = ?"
-        self.cursor.execute(query, (name,))
+    def bulk_upsert_categories(self, categories, chunk_size=BULK_CHUNK_SIZE):
+        """
+        Upserts many Category objects in one transaction. A parent may be any existing category or one that appears
+        earlier in the same iterable. Accepts a generator, which is consumed chunk by chunk.
+        :param categories: iterable of Category objects.
+        :param chunk_size: number of rows handed to each executemany call.
+        :return: number of categories written.
+        """
+        self.cursor.execute("SELECT name, id, parent_id FROM categories")
+        existing = {row[0]: row[1:] for row in self.cursor.fetchall()}
+        created = set()
+        query = """
+            INSERT INTO categories (name, value, parent_id, description)
+            VALUES (?, 0, (SELECT id FROM categories WHERE name = ?), ?)
+            ON CONFLICT (name) DO UPDATE SET
+                parent_id = excluded.parent_id,
+                description = excluded.description
+        """
+        count = 0
+        moved = False
+        try:
+            for chunk in chunked(categories, chunk_size):
+                rows = []
+                for category in chunk:
+                    parent_name = category.parent.name if category.parent is not None else None
+                    if parent_name is not None and parent_name not in existing and parent_name not in created:
+                        raise ValueError(f"Parent category {parent_name} does not exist in the database")
+                    if category.name in existing:
+                        # a parent created in this call is never the old parent of an existing category
+                        if parent_name is None:
+                            parent_id = None
+                        elif parent_name in existing:
+                            parent_id = existing[parent_name][0]
+                        else:
+                            parent_id = -1
+                        moved = moved or parent_id != existing[category.name][1]
+                    elif category.name in created:
+                        moved = True
+                    else:
+                        created.add(category.name)
+                    rows.append((category.name, parent_name, category.description))
+                self.cursor.executemany(query, rows)
+                count += len(rows)
+
+            self._commit()
+        except sqlite3.IntegrityError as error:
+            # raised by the category_closure_refuse_cycle trigger
+            self._rollback()
+            raise ValueError(str(error)) from error
+        except Exception:
+            self._rollback()
+            raise
+        for name in created:
+            self._invalidate('category_id', name)
+        if created:
+            self._invalidate('category_names')
+        if created or moved:
+            self._invalidate('leaf_categories')
+
+        # new categories start at zero, so only moves change any total
+        if moved or not self.incremental:
+            self._recalculate()
+        return count
+
+    def bulk_upsert_accounts(self, accounts, chunk_size=BULK_CHUNK_SIZE):
+        """
+        Upserts many Account objects in one transaction, then runs the rollup once. Category names are resolved from
+        a single lookup. Accepts a generator, which is consumed chunk by chunk. Each chunk is written by multi-row
+        statements, because the search index triggers flush the full-text index once per statement, each binding at
+        most MAX_VARIABLES parameters whatever the chunk size.
+        :param accounts: iterable of Account objects.
+        :param chunk_size: number of accounts read from the iterable at a time.
+        :return: number of accounts written.
+        """
+        self.cursor.execute("SELECT name, id FROM categories")
+        category_ids = dict(self.cursor.fetchall())
+        query = """
+            INSERT INTO accounts (name, value, category_id, remarks, is_disabled)
+            VALUES {values}
+            ON CONFLICT (name) DO UPDATE SET
+                value = excluded.value,
+                category_id = excluded.category_id,
+                remarks = excluded.remarks
+        """
+        count = 0
+        deltas = defaultdict(float)
+        # without the incremental lookups there is no telling whether an account is new
+        inserted = not self.incremental
+        try:
+            for chunk in chunked(accounts, chunk_size):
+                rows = []
+                for account in chunk:
+                    category_id = category_ids.get(account.category.name)
+                    if category_id is None:
+                        raise ValueError(f"Category {account.category.name} does not exist in the database")
+                    rows.append((account.name, account.value, category_id, account.remarks, account.is_disabled))
+
+                if self.incremental:
+                    state = {}
+                    for names in chunked({row[0] for row in rows}, MAX_VARIABLES):
+                        placeholders = ", ".join("?" * len(names))
+                        self.cursor.execute("SELECT name, value, category_id, is_disabled FROM accounts "
+                                            f"WHERE name IN ({placeholders})", names)
+                        state.update((row[0], row[1:]) for row in self.cursor.fetchall())
+                    for name, value, category_id, _, is_disabled in rows:
+                        old = state.get(name)
+                        inserted = inserted or old is None
+                        if old is not None:
+                            # is_disabled is not touched on conflict, so an existing account keeps its old state
+                            is_disabled = old[2]
+                            if not is_disabled:
+                                deltas[old[1]] -= old[0]
+                        if not is_disabled:
+                            deltas[category_id] += value
+                        state[name] = (value, category_id, is_disabled)
+
+                for part in chunked(rows, MAX_VARIABLES // 5):
+                    self.cursor.execute(query.format(values=", ".join(["(?, ?, ?, ?, ?)"] * len(part))),
+                                        [column for row in part for column in row])
+                count += len(rows)
+
+            for category_id, delta in deltas.items():
+                self.propagate_value(category_id, delta)
+            self._commit()
+        except Exception:
+            self._rollback()
+            raise
+        if inserted:
+            self._invalidate('accounts')
+
+        if not self.incremental:
+            self._recalculate()
+        return count
+
+    def post_entry(self, entry):
+        """
+        Records one JournalEntry. See bulk_post().
+        :return: id of the journal entry.
+        """
+        entry_ids = []
+        self.bulk_post([entry], entry_ids=entry_ids)
+        return entry_ids[0]
+
+    def bulk_post(self, entries, chunk_size=BULK_CHUNK_SIZE, entry_ids=None):
+        """
+        Records many JournalEntry objects in one transaction. Postings are written with executemany, each carrying
+        the running balance of its account, and every touched account's value is set to its final balance once at
+        the end, followed by one rollup. Accepts a generator, which is consumed chunk by chunk.
+        Note that upsert_account() still overwrites an account's value, which then acts as the opening balance for
+        the postings after it.
+        Entries must be posted in date order: one dated before the latest posting of any of its accounts is refused,
+        because running balances follow the order postings are recorded in. Likewise get_category_tree_as_of() reads
+        the history, so a sheet as of a moment shows the postings recorded by then, whatever their posted_at.
+        :param entries: iterable of JournalEntry objects.
+        :param chunk_size: number of entries per executemany call.
+        :param entry_ids: optional list that receives the id of every entry written.
+        :return: number of postings written.
+        """
+        accounts = {}
+        count = 0
+        query = """
+            INSERT INTO postings (entry_id, account_id, amount, running_balance, memo)
+            VALUES (?, ?, ?, ?, ?)
+        """
+        try:
+            for chunk in chunked(entries, chunk_size):
+                names = list({posting.account.name for entry in chunk for posting in entry.postings
+                              if posting.account.name not in accounts})
+                for names_chunk in chunked(names, BULK_CHUNK_SIZE):
+                    placeholders = ", ".join("?" * len(names_chunk))
+                    # postings are in date order, so the latest by id is the latest by date
+                    self.cursor.execute(f"""
+                        SELECT a.name, a.id, a.value, a.category_id, a.is_disabled,
+                               (SELECT e.posted_at FROM postings p JOIN journal_entries e ON e.id = p.entry_id
+                                WHERE p.account_id = a.id ORDER BY p.id DESC LIMIT 1)
+                        FROM accounts a WHERE a.name IN ({placeholders})
+                    """, names_chunk)
+                    for name, *account in self.cursor.fetchall():
+                        # [id, opening value, balance, category id, is_disabled, posted_at of the latest posting]
+                        accounts[name] = [account[0], account[1], account[1], *account[2:]]
+
+                rows = []
+                for entry in chunk:
+                    posted_at = to_utc_timestamp(entry.posted_at if entry.posted_at is not None
+                                                 else datetime.now(timezone.utc))
+                    for posting in entry.postings:
+                        account = accounts.get(posting.account.name)
+                        if account is None:
+                            raise ValueError(f"Account {posting.account.name} does not exist in the database")
+                        if account[5] is not None and posted_at < account[5]:
+                            raise ValueError(f"Entry dated {posted_at} is before the latest posting of "
+                                             f"{posting.account.name}, dated {account[5]}")
+                    self.cursor.execute("INSERT INTO journal_entries (posted_at, description) VALUES (?, ?)",
+                                        (posted_at, entry.description))
+                    entry_id = self.cursor.lastrowid
+                    if entry_ids is not None:
+                        entry_ids.append(entry_id)
+                    for posting in entry.postings:
+                        account = accounts[posting.account.name]
+                        account[2] += posting.amount
+                        account[5] = posted_at
+                        rows.append((entry_id, account[0], posting.amount, account[2], posting.memo))
+                self.cursor.executemany(query, rows)
+                count += len(rows)
+
+            changed = [account for account in accounts.values() if account[2] != account[1]]
+            self.cursor.executemany("UPDATE accounts SET value = ? WHERE id = ?",
+                                    ((account[2], account[0]) for account in changed))
+            if self.incremental:
+                deltas = defaultdict(float)
+                for _, opening, balance, category_id, is_disabled, _ in changed:
+                    if not is_disabled:
+                        deltas[category_id] += balance - opening
+                for category_id, delta in deltas.items():
+                    self.propagate_value(category_id, delta)
+            self._commit()
+        except Exception:
+            self._rollback()
+            raise
+
+        if not self.incremental:
+            self._recalculate()
+        return count
+
+    def get_postings(self, account_name):
+        """
+        Returns the postings of an account in the order they were recorded.
+        :param account_name: str
+        :return: list of dicts with posted_at, description, amount, running_balance and memo.
+        """
+        query = """
+            SELECT e.posted_at, e.description, p.amount, p.running_balance, p.memo
+            FROM postings p
+            JOIN journal_entries e ON e.id = p.entry_id
+            WHERE p.account_id = (SELECT id FROM accounts WHERE name = ?)
+            ORDER BY p.id
+        """
+        self.cursor.execute(query, (account_name,))
+        columns = [desc[0] for desc in self.cursor.description]
+        return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+
+    def delete_account(self, name):
+        """
+        Deletes an account by name, taking its value out of the category totals. Refuses to delete an account that
+        has postings, which would lose the record of how its balance came about.
+        :param name: str
+        """
+        self.cursor.execute("SELECT value, category_id, is_disabled, id FROM accounts WHERE name = ?", (name,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return
+        self.cursor.execute("SELECT 1 FROM postings WHERE account_id = ? LIMIT 1", (row[3],))
+        if self.cursor.fetchone() is not None:
+            raise ValueError(f"Account {name} has postings")
+        self.cursor.execute("DELETE FROM accounts WHERE name = ?", (name,))
+        if self.incremental and not row[2]:
+            self.propagate_value(row[1], -row[0])
+        self._commit()
+        self._invalidate('accounts')
+        if not self.incremental:
+            self._recalculate()
+
+    def delete_category(self, name):
+        """
+        Deletes a category by name. Refuses to delete a category that still holds accounts or subcategories.
+        :param name: str
+        """
+        self.cursor.execute("SELECT id FROM categories WHERE name = ?", (name,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return
+        self.cursor.execute("SELECT 1 FROM accounts WHERE category_id = ? LIMIT 1", (row[0],))
+        has_accounts = self.cursor.fetchone() is not None
+        self.cursor.execute("SELECT 1 FROM categories WHERE parent_id = ? LIMIT 1", (row[0],))
+        has_subcategories = self.cursor.fetchone() is not None
+        if has_accounts or has_subcategories:
+            raise ValueError("Category still has accounts or subcategories")
+        self.cursor.execute("DELETE FROM categories WHERE id = ?", (row[0],))
+        self._commit()
+        self._invalidate('category_id', name)
+        self._invalidate('category_names')
+        self._invalidate('leaf_categories')
+
+    def set_account_disabled(self, name, is_disabled):
+        """
+        Toggles is_disabled of a single account, moving its value in or out of the category totals when the state
+        actually changes.
+        :return: the account row after the update.
+        """
+        self.cursor.execute("SELECT value, category_id, is_disabled FROM accounts WHERE name = ?", (name,))
+        old_row = self.cursor.fetchone()
+        query = "UPDATE accounts SET is_disabled = ? WHERE name = ?"
+        self.cursor.execute(query, (is_disabled, name))
+        if self.incremental and old_row and bool(old_row[2]) != bool(is_disabled):
+            delta = -old_row[0] if is_disabled else old_row[0]
+            self.propagate_value(old_row[1], delta)
         self.cursor.execute("SELECT * FROM accounts WHERE name = ?", (name,))
-        disabled_account = self.cursor.fetchone()
-        self.connection.commit()
+        account_row = self.cursor.fetchone()
+        self._commit()
+        if old_row and bool(old_row[2]) != bool(is_disabled):
+            self._invalidate('accounts')
+            if not self.incremental:
+                self._recalculate()
+        return account_row
+
+    def disable_account(self, name):
+        disabled_account = self.set_account_disabled(name, 1)
         print(f'\nDisabled account: {disabled_account}')
         return disabled_account
 
+    def set_many_accounts_disabled(self, list_account_names, is_disabled):
+        """
+        Sets is_disabled for many accounts with one UPDATE in one transaction, then moves the values of the accounts
+        that changed in or out of the category totals once. Nothing is printed.
+        :param list_account_names: iterable of account names.
+        :param is_disabled: 1 to disable, 0 to enable.
+        :return: list of account rows that changed, as they are after the update.
+        """
+        is_disabled = int(bool(is_disabled))
+        try:
+            # a temp table instead of an IN list, so any number of names fits in one statement
+            self.cursor.execute("CREATE TEMP TABLE IF NOT EXISTS toggled_names (name TEXT PRIMARY KEY)")
+            self.cursor.execute("DELETE FROM toggled_names")
+            self.cursor.executemany("INSERT OR IGNORE INTO toggled_names (name) VALUES (?)",
+                                    ((name,) for name in list_account_names))
+            changed_filter = "is_disabled != ? AND name IN (SELECT name FROM toggled_names)"
+            self.cursor.execute(f"SELECT * FROM accounts WHERE {changed_filter} ORDER BY id", (is_disabled,))
+            columns = [desc[0] for desc in self.cursor.description]
+            changed_rows = self.cursor.fetchall()
+            self.cursor.execute(f"UPDATE accounts SET is_disabled = ? WHERE {changed_filter}",
+                                (is_disabled, is_disabled))
+
+            value_index, category_index = columns.index('value'), columns.index('category_id')
+            disabled_index = columns.index('is_disabled')
+            if self.incremental:
+                deltas = defaultdict(float)
+                for row in changed_rows:
+                    deltas[row[category_index]] += -row[value_index] if is_disabled else row[value_index]
+                for category_id, delta in deltas.items():
+                    self.propagate_value(category_id, delta)
+            self.cursor.execute("DELETE FROM toggled_names")
+            self._commit()
+        except Exception:
+            self._rollback()
+            raise
+        if changed_rows:
+            self._invalidate('accounts')
+
+        if changed_rows and not self.incremental:
+            self._recalculate()
+        return [row[:disabled_index] + (is_disabled,) + row[disabled_index + 1:] for row in changed_rows]
+
     def disable_many_accounts(self, list_account_names):
-        for account in list_account_names:
-            self.disable_account(account)
+        return self.set_many_accounts_disabled(list_account_names, 1)
 
     def enable_account(self, name):
-        query = "UPDATE accounts SET is_disabled = 0 WHERE name = ?"
-        self.cursor.execute(query, (name,))
-        self.cursor.execute("SELECT * FROM accounts WHERE name = ?", (name,))
-        enabled_account = self.cursor.fetchone()
-        self.connection.commit()
+        enabled_account = self.set_account_disabled(name, 0)
         print(f'\nEnabled account: {enabled_account}')
         return enabled_account
 
     def enable_many_accounts(self, list_account_names):
-        for account in list_account_names:
-            self.enable_account(account)
+        return self.set_many_accounts_disabled(list_account_names, 0)
 
-    # did not grok
-    def get_category_tree(self, name=None):
+    def get_category_tree(self, name=None, as_of=None):
         """
         Returns a nested dict from categories and enabled accounts databases.
+        The whole subtree is loaded by get_compact_tree() and converted to dicts in one pass.
         :param name: name of category i.e. Assets, Liabilities, etc.
+        :param as_of: optional datetime, date or ISO string. Builds the tree from the history as it stood then.
         :return: nested dict
         """
-        self.calculate_every_category()
-        categories_query = "SELECT id, name, value FROM categories WHERE name=?"
-        accounts_query = "SELECT id, name, value, remarks FROM enabled_accounts WHERE category_id=?"
+        if as_of is not None:
+            return self.get_category_tree_as_of(name, as_of)
+        return self.get_compact_tree(name).to_dict()
 
-        result = {'name': None, 'value': 0.0, 'children': []}
+    def get_balance_summary(self):
+        """
+        Returns the headline numbers of the balance sheet from the balance_summary table, which triggers keep in step
+        with every write. Reads a handful of rows and never builds a tree, so it is cheap to poll.
+        :return: dict of 'assets', 'liabilities', 'net_worth', 'categories' mapping every root category and its
+        direct subcategories to their totals, and 'updated_at', the UTC time of the latest change.
+        """
+        self.cursor.execute("SELECT name, value, updated_at FROM balance_summary ORDER BY parent_id IS NOT NULL, "
+                            "category_id")
+        categories = {}
+        updated_at = None
+        for name, value, changed_at in self.cursor.fetchall():
+            categories[name] = value
+            updated_at = max(updated_at or changed_at, changed_at)
+        assets = categories.get('Assets', 0.0)
+        liabilities = categories.get('Liabilities', 0.0)
+        return {
+            'assets': assets,
+            'liabilities': liabilities,
+            'net_worth': assets - liabilities,
+            'categories': categories,
+            'updated_at': updated_at,
+        }
 
-        # Select the category with the given name
+    def get_compact_tree(self, name):
+        """
+        Returns the subtree of get_category_tree() as a CompactTree. The subtree is fetched from the closure table with
+        one query for the categories and one for their enabled accounts, whose rows are streamed straight from the
+        cursor, and category values are summed in the arrays.
+        :param name: name of category i.e. Assets, Liabilities, etc.
+        :return: CompactTree
+        """
+        categories_query = """
+            SELECT c.id, c.name, c.parent_id
+            FROM category_closure cc
+            JOIN categories c ON c.id = cc.descendant_id
+            WHERE cc.ancestor_id = (SELECT id FROM categories WHERE name = ?)
+            ORDER BY cc.depth, c.id
+        """
+        accounts_query = """
+            SELECT a.category_id, a.name, a.value, a.remarks
+            FROM category_closure cc
+            CROSS JOIN enabled_accounts a ON a.category_id = cc.descendant_id
+            WHERE cc.ancestor_id = (SELECT id FROM categories WHERE name = ?)
+            ORDER BY a.id
+        """
         self.cursor.execute(categories_query, (name,))
-        category = self.cursor.fetchone()
-        if category is None:
+        categories = self.cursor.fetchall()
+        if not categories:
             raise ValueError("No category found with name {}".format(name))
-        result['name'] = category[1]
-        result['value'] = category[2]
+        self.cursor.execute(accounts_query, (name,))
+        return CompactTree.from_rows(categories, self.cursor)
 
-        # Select child categories
-        self.cursor.execute("SELECT id, name, value FROM categories WHERE parent_id=?", (category[0],))
-        child_categories = self.cursor.fetchall()
+    def iter_ledger_rows(self, name=None):
+        """
+        Streams the categories and accounts of a subtree, or of the whole ledger, straight from a cursor of its own,
+        so nothing but the current row is held in memory. Categories come first, one root at a time, parents before
+        children, then every account including disabled ones, oldest first. Category values are the stored rollup
+        totals. Both queries read rows in index order, so SQLite never sorts the ledger in a temporary b-tree.
+        :param name: name of the root category, or None for every root.
+        :return: generator of tuples in the order of LEDGER_COLUMNS.
+        """
+        roots = "SELECT id FROM categories WHERE name = ?" if name is not None else \
+            "SELECT id FROM categories WHERE parent_id IS NULL ORDER BY id"
+        arguments = (name,) if name is not None else ()
+        categories_query = """
+            SELECT 'category', c.name, p.name, NULL, c.value, c.description, NULL, NULL, cc.depth
+            FROM category_closure cc
+            JOIN categories c ON c.id = cc.descendant_id
+            LEFT JOIN categories p ON p.id = c.parent_id
+            WHERE cc.ancestor_id = ?
+            ORDER BY cc.depth, cc.descendant_id
+        """
+        # driven from accounts in rowid order, with one closure lookup per account
+        accounts_query = f"""
+            SELECT 'account', a.name, NULL, c.name, a.value, NULL, a.remarks, a.is_disabled, cc.depth + 1
+            FROM accounts a
+            CROSS JOIN category_closure cc ON cc.descendant_id = a.category_id
+            JOIN categories c ON c.id = a.category_id
+            WHERE cc.ancestor_id IN ({roots})
+            ORDER BY a.id
+        """
+        if name is not None and self.get_category_id(name) is None:
+            raise ValueError("No category found with name {}".format(name))
+        cursor = self.connection.cursor()
+        try:
+            root_ids = [row[0] for row in cursor.execute(roots, arguments).fetchall()]
+            for root_id in root_ids:
+                yield from cursor.execute(categories_query, (root_id,))
+            yield from cursor.execute(accounts_query, arguments)
+        finally:
+            cursor.close()
 
-        # Recursively call get_category_tree for each child category and add resulting nested dict to children array
-        for child_category in child_categories:
-            result['children'].append(self.get_category_tree(name=child_category[1]))
+    def get_category_tree_as_of(self, name, as_of):
+        """
+        Returns the nested dict of get_category_tree() as it was at the given moment, from the latest history row of
+        every category and account at or before it. The item ids are walked one index seek at a time and the latest
+        row of each is another seek on ({item}_id, id), so the cost grows with the number of items, not with the
+        length of the history.
+        :param name: name of category i.e. Assets, Liabilities, etc.
+        :param as_of: datetime, date or ISO string. Naive values are local time and a date means the end of that day.
+        :return: nested dict
+        """
+        timestamp = to_utc_timestamp(as_of)
+        latest_query = """
+            WITH RECURSIVE items(item_id) AS (
+                SELECT MIN({item}_id) FROM {table}
+                UNION ALL
+                SELECT (SELECT MIN({item}_id) FROM {table} WHERE {item}_id > items.item_id) FROM items
+                WHERE items.item_id IS NOT NULL
+            )
+            SELECT {columns} FROM items
+            JOIN {table} h ON h.id = (SELECT MAX(id) FROM {table} WHERE {item}_id = items.item_id AND id <= ?)
+            WHERE h.is_deleted = 0{filters}
+        """
+        cutoff_query = "SELECT id FROM {table} WHERE recorded_at <= ? ORDER BY recorded_at DESC, id DESC LIMIT 1"
+
+        rows = {}
+        for item, table, columns, filters in (
+                ('category', 'category_history', "h.category_id, h.name, h.parent_id", ""),
+                ('account', 'account_history', "h.category_id, h.name, h.value, h.remarks", " AND h.is_disabled = 0")):
+            self.cursor.execute(cutoff_query.format(table=table), (timestamp,))
+            cutoff = self.cursor.fetchone()
+            self.cursor.execute(latest_query.format(item=item, table=table, columns=columns, filters=filters),
+                                (cutoff[0] if cutoff else 0,))
+            rows[item] = self.cursor.fetchall()
+
+        # order the subtree parents first, the way the closure table query does
+        children = defaultdict(list)
+        root = None
+        for row in rows['category']:
+            children[row[2]].append(row)
+            if row[1] == name:
+                root = row
+        if root is None:
+            raise ValueError("No category found with name {} as of {}".format(name, timestamp))
+        categories = []
+        level = [root]
+        while level:
+            categories.extend(level)
+            level = [child for row in level for child in children[row[0]]]
+
+        subtree = {category[0] for category in categories}
+        accounts = [row for row in rows['account'] if row[0] in subtree]
+        return build_tree(categories, accounts)
+
+    def get_import_checkpoint(self, source):
+        """
+        Returns how many rows of the given import source were committed by an earlier, unfinished import.
+        :param source: str identifying the imported file.
+        :return: int
+        """
+        self.cursor.execute("SELECT rows_committed FROM import_checkpoints WHERE source = ?", (source,))
+        row = self.cursor.fetchone()
+        return row[0] if row else 0
+
+    def save_import_checkpoint(self, source, rows_committed):
+        query = """
+            INSERT INTO import_checkpoints (source, rows_committed) VALUES (?, ?)
+            ON CONFLICT (source) DO UPDATE SET
+                rows_committed = excluded.rows_committed,
+                updated_at = CURRENT_TIMESTAMP
+        """
+        self.cursor.execute(query, (source, rows_committed))
+        self._commit()
 
-        # Select child accounts
-        self.cursor.execute(accounts_query, (category[0],))
-        child_accounts = self.cursor.fetchall()
-        self.connection.commit()
+    def clear_import_checkpoint(self, source):
+        self.cursor.execute("DELETE FROM import_checkpoints WHERE source = ?", (source,))
+        self._commit()
 
-        # Add a nested dict to children array for each child account
-        for child_account in child_accounts:
-            result['children'].append({
-                'name': child_account[1],
-                'value': child_account[2],
-                'remarks': child_account[3]
-            })
+    def get_category_id(self, name):
+        """
+        Returns the id of a category, read through the lookup cache.
+        :param name: str
+        :return: int, or None if there is no such category.
+        """
+        def load():
+            self.cursor.execute("SELECT id FROM categories WHERE name = ?", (name,))
+            row = self.cursor.fetchone()
+            return row[0] if row else None
 
-        return result
+        return self.cache.get('category_id', name, load)
 
     def get_category_names(self):
         """
         Returns a list of unique category names.
         :return: list of category names.
         """
-        self.cursor.execute("SELECT DISTINCT name FROM categories")
-        rows = self.cursor.fetchall()  # fetch all the results
-        category_names = [row[0] for row in rows]  # extract the first column of each row
-        return category_names
+        def load():
+            self.cursor.execute("SELECT DISTINCT name FROM categories")
+            rows = self.cursor.fetchall()  # fetch all the results
+            return tuple(row[0] for row in rows)  # extract the first column of each row
+
+        return list(self.cache.get('category_names', None, load))
 
     # did not grok
     def get_subcategories(self, category_name):
@@ -257,30 +993,44 @@ class SqliteDb:
         subcategories = [row[0] for row in results]
         return subcategories
 
-    # did not grok
     def get_leaf_categories(self, category_name):
+        """
+        Returns the names of categories below the given one that have no subcategories of their own.
+        :param category_name: str
+        :return: list of category names, not including category_name itself.
+        """
         query = """
-            WITH RECURSIVE subcategories AS (
-                SELECT id, name, parent_id
-                FROM categories
-                WHERE name = ?
-                UNION ALL
-                SELECT c.id, c.name, c.parent_id
-                FROM categories AS c
-                INNER JOIN subcategories AS sub ON c.parent_id = sub.id
-            )
-            SELECT subcategories.name
-            FROM subcategories
-            LEFT JOIN categories AS child ON subcategories.id = child.parent_id
-            WHERE child.id IS NULL
+            SELECT c.name
+            FROM category_closure AS cc
+            JOIN categories AS c ON c.id = cc.descendant_id
+            WHERE cc.ancestor_id = (SELECT id FROM categories WHERE name = ?)
+              AND cc.depth > 0
+              AND NOT EXISTS (SELECT 1 FROM categories AS child WHERE child.parent_id = c.id)
+            ORDER BY cc.depth, c.id
         """
 
+        def load():
+            self.cursor.execute(query, (category_name,))
+            return tuple(result[0] for result in self.cursor.fetchall())
+
+        return list(self.cache.get('leaf_categories', category_name, load))
+
+    def get_ancestors(self, category_name):
+        """
+        Returns the chain of categories above the given one, nearest parent first.
+        :param category_name: str
+        :return: list of category names.
+        """
+        query = """
+            SELECT c.name
+            FROM category_closure AS up
+            JOIN categories AS c ON c.id = up.ancestor_id
+            WHERE up.descendant_id = (SELECT id FROM categories WHERE name = ?)
+              AND up.depth > 0
+            ORDER BY up.depth
+        """
         self.cursor.execute(query, (category_name,))
-        results = self.cursor.fetchall()
-        leaf_categories = [result[0] for result in results]
-        if category_name in leaf_categories:
-            leaf_categories.remove(category_name)
-        return leaf_categories
+        return [row[0] for row in self.cursor.fetchall()]
 
     def get_account_by_name(self, name):
         """
@@ -303,14 +1053,16 @@ class SqliteDb:
         :param enabled: toggle mode
         :return: list of tuples
         """
-        if enabled:
-            self.cursor.execute("SELECT * FROM enabled_accounts")
-        else:
-            self.cursor.execute("SELECT * FROM accounts WHERE is_disabled = 1")
+        def load():
+            if enabled:
+                self.cursor.execute("SELECT * FROM enabled_accounts")
+            else:
+                self.cursor.execute("SELECT * FROM accounts WHERE is_disabled = 1")
 
-        rows = self.cursor.fetchall()
-        account_names = [row[1] for row in rows]
-        return account_names
+            rows = self.cursor.fetchall()
+            return tuple(row[1] for row in rows)
+
+        return list(self.cache.get('accounts', bool(enabled), load))
 
     def get_all_account_names_in_category(self, name):
         query = """
@@ -328,3 +1080,113 @@ class SqliteDb:
 
         return account_names
 
+    def search(self, query, kind=None, limit=SEARCH_LIMIT, is_disabled=None):
+        """
+        Finds accounts and categories by part of their name, remarks or description. Names starting with the query
+        come first in name order, read from the case-insensitive name indexes. Then come names containing it, then
+        remarks and descriptions containing it, both from the search_index table. When that finds fewer than limit,
+        names sharing most of the trigrams of the query are added, so a typo still matches. Every step reads at most
+        SEARCH_CANDIDATES rows and ranks only those, so a query matching most of a large ledger stays fast.
+        :param query: str
+        :param kind: 'account', 'category', or None for both.
+        :param limit: most matches returned.
+        :param is_disabled: only accounts that are disabled when 1, enabled when 0. Categories count as enabled.
+        :return: list of dicts of 'kind', 'name', 'notes' and 'is_disabled', best match first.
+        """
+        if kind is not None and kind not in SEARCH_KINDS:
+            raise ValueError(f"Unknown kind {kind}. Choose one of {', '.join(SEARCH_KINDS)}.")
+        query = query.strip()
+        if not query or limit <= 0:
+            return []
+        rows = self._prefix_search(query, kind, limit, is_disabled)
+        if len(query) >= TRIGRAM_LENGTH:
+            found = {row[1] for row in rows}
+            lowered = query.lower()
+            for column in ('name', 'notes'):
+                if len(rows) >= limit:
+                    break
+                candidates = [row for row in self._search_index_candidates(fts_phrase(query), column, kind, is_disabled)
+                              if row[1] not in found]
+                # earliest occurrence of the query first, then the shortest text
+                candidates.sort(key=lambda row: (row[2 if column == 'notes' else 1].lower().find(lowered),
+                                                 len(row[1]), row[1]))
+                candidates = candidates[:limit - len(rows)]
+                rows.extend(candidates)
+                found.update(row[1] for row in candidates)
+            if len(rows) < limit:
+                rows.extend(self._fuzzy_search(query, kind, is_disabled, limit - len(rows), {row[1] for row in rows}))
+        return [{'kind': kind, 'name': name, 'notes': notes, 'is_disabled': disabled}
+                for kind, name, notes, disabled in rows[:limit]]
+
+    def _prefix_search(self, query, kind, limit, is_disabled):
+        """
+        Reads names starting with the query, ignoring case, through the NOCASE name indexes in name order, so the
+        LIMIT stops the index walk instead of cutting an unsorted scan.
+        :return: list of (kind, name, notes, is_disabled) rows in name order.
+        """
+        pattern = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        rows = []
+        if kind in (None, 'account'):
+            disabled_filter = "" if is_disabled is None else " AND is_disabled = ?"
+            self.cursor.execute(f"""
+                SELECT 'account', name, COALESCE(remarks, ''), is_disabled FROM accounts
+                WHERE name LIKE ? ESCAPE '\\'{disabled_filter}
+                ORDER BY name COLLATE NOCASE LIMIT ?
+            """, [pattern, *([] if is_disabled is None else [int(bool(is_disabled))]), limit])
+            rows.extend(self.cursor.fetchall())
+        if kind in (None, 'category') and not is_disabled:
+            self.cursor.execute("""
+                SELECT 'category', name, COALESCE(description, ''), 0 FROM categories
+                WHERE name LIKE ? ESCAPE '\\'
+                ORDER BY name COLLATE NOCASE LIMIT ?
+            """, [pattern, limit])
+            rows.extend(self.cursor.fetchall())
+        rows.sort(key=lambda row: (row[1].lower(), row[1]))
+        return rows[:limit]
+
+    def _search_index_candidates(self, expression, column, kind, is_disabled):
+        """
+        Reads at most SEARCH_CANDIDATES rows of search_index whose column matches the FTS5 expression, in index
+        order. Ranking every match with bm25 would read them all. Kinds are told apart by rowid parity and disabled
+        accounts through their partial index, so rows are filtered without reading their stored columns. The unary +
+        keeps SQLite from handing the rowid list to FTS5, which would run the match once per disabled account.
+        :return: list of (kind, name, notes, is_disabled) rows.
+        """
+        filters = ""
+        if kind is not None:
+            filters += f" AND rowid % 2 = {SEARCH_KINDS.index(kind)}"
+        if is_disabled is not None:
+            operator = "IN" if is_disabled else "NOT IN"
+            filters += f" AND +rowid {operator} (SELECT 2 * id FROM accounts WHERE is_disabled = 1)"
+        self.cursor.execute(f"SELECT kind, name, notes, is_disabled FROM search_index WHERE search_index MATCH ?"
+                            f"{filters} LIMIT ?", (f"{column} : ({expression})", SEARCH_CANDIDATES))
+        return self.cursor.fetchall()
+
+    def _fuzzy_search(self, query, kind, is_disabled, limit, found):
+        """
+        Keeps the candidate names sharing at least FUZZY_THRESHOLD of the trigrams of the query. One typo breaks at
+        most one piece of the query, so a query long enough for three pieces looks up names holding any two of them,
+        and a shorter one names holding either half, or any trigram. Each lookup is capped on its own, so a common
+        piece cannot crowd the candidates of a rare one out.
+        :return: list of rows, most shared trigrams first.
+        """
+        lowered = query.lower()
+        wanted = trigrams(lowered)
+        if len(lowered) >= 3 * TRIGRAM_LENGTH:
+            third = len(lowered) // 3
+            pieces = [fts_phrase(piece) for piece in (lowered[:third], lowered[third:-third], lowered[-third:])]
+            expressions = [" OR ".join(f"({first} AND {second})" for first, second in combinations(pieces, 2))]
+        elif len(lowered) >= 2 * TRIGRAM_LENGTH:
+            middle = len(lowered) // 2
+            expressions = [fts_phrase(lowered[:middle]), fts_phrase(lowered[middle:])]
+        else:
+            expressions = [fts_phrase(gram) for gram in sorted(wanted)]
+        scored = {}
+        for expression in expressions:
+            for row in self._search_index_candidates(expression, 'name', kind, is_disabled):
+                if row[1] in found or row[1] in scored:
+                    continue
+                score = len(wanted & trigrams(row[1].lower())) / len(wanted)
+                if score >= FUZZY_THRESHOLD:
+                    scored[row[1]] = (-score, len(row[1]), row[1], row)
+        return [row for *_, row in sorted(scored.values())[:limit]]
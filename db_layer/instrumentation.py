@@ -0,0 +1,186 @@
+"""
+Opt-in profiling of SqliteDb, switched on with SqliteDb(..., instrument=True). A Profiler records per-method call
+counts, inclusive wall time and rows fetched. A cursor proxy times every statement, and the sqlite3 trace callback
+counts the statements SQLite actually ran, commits included. Nothing here is installed unless asked for, so an
+uninstrumented SqliteDb runs exactly the code it always did.
+"""
+import inspect
+import re
+import time
+from collections import defaultdict
+from functools import wraps
+
+# methods that are not wrapped: the report itself, closing, and generators, whose work happens after they return
+UNWRAPPED_METHODS = ('stats', 'close')
+PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+
+
+def normalize_statement(sql):
+    """
+    Collapses whitespace and placeholder lists, so statements that differ only in the number of bound names are
+    counted together.
+    """
+    return PLACEHOLDER_LIST.sub('?, ...', ' '.join(sql.split()))
+
+
+class Profiler:
+    """
+    Accumulates timings for one SqliteDb.
+    """
+
+    def __init__(self):
+        # name: [calls, seconds, rows]
+        self.methods = defaultdict(lambda: [0, 0.0, 0])
+        # normalized sql: [executions, seconds, rows]
+        self.statements = defaultdict(lambda: [0, 0.0, 0])
+        self.traced = 0
+        self.commits = 0
+        self.rollbacks = 0
+        self._active = []
+        self._statement = None
+
+    def wrap(self, name, method):
+        @wraps(method)
+        def call(*args, **kwargs):
+            self._active.append(name)
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                entry = self.methods[name]
+                entry[0] += 1
+                entry[1] += time.perf_counter() - started
+                self._active.pop()
+
+        return call
+
+    def trace(self, sql):
+        """
+        sqlite3 trace callback. Statements run by triggers are reported again under the statement that fired them.
+        """
+        self.traced += 1
+        keyword = sql.lstrip()[:8].upper()
+        if keyword.startswith('COMMIT'):
+            self.commits += 1
+        elif keyword.startswith('ROLLBACK'):
+            self.rollbacks += 1
+
+    def record_statement(self, sql, seconds):
+        self._statement = normalize_statement(sql)
+        entry = self.statements[self._statement]
+        entry[0] += 1
+        entry[1] += seconds
+
+    def record_fetch(self, rows, seconds):
+        """
+        Adds rows fetched, and the time SQLite spent producing them, to the last statement and the innermost method.
+        """
+        if self._statement is not None:
+            entry = self.statements[self._statement]
+            entry[1] += seconds
+            entry[2] += rows
+        if self._active:
+            self.methods[self._active[-1]][2] += rows
+
+    def stats(self):
+        """
+        :return: dict of 'methods' and 'statements', each mapping a name to calls, seconds and rows, sorted by time,
+        and the number of statements 'traced', 'commits' and 'rollbacks'.
+        """
+        def report(entries, count_name):
+            ordered = sorted(entries.items(), key=lambda item: item[1][1], reverse=True)
+            return {name: {count_name: calls, 'seconds': seconds, 'rows': rows}
+                    for name, (calls, seconds, rows) in ordered}
+
+        return {
+            'methods': report(self.methods, 'calls'),
+            'statements': report(self.statements, 'executions'),
+            'traced': self.traced,
+            'commits': self.commits,
+            'rollbacks': self.rollbacks,
+        }
+
+
+class ProfilingCursor:
+    """
+    Stands in for a sqlite3 cursor, timing execute calls and counting fetched rows. Everything else is passed through.
+    """
+
+    def __init__(self, cursor, profiler):
+        self._cursor = cursor
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _execute(self, method, sql, *args):
+        started = time.perf_counter()
+        method(sql, *args)
+        self._profiler.record_statement(sql, time.perf_counter() - started)
+        return self
+
+    def execute(self, sql, parameters=()):
+        return self._execute(self._cursor.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._execute(self._cursor.executemany, sql, seq_of_parameters)
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        result = method(*args)
+        if result is None:
+            rows = 0
+        elif isinstance(result, list):
+            rows = len(result)
+        else:
+            rows = 1
+        self._profiler.record_fetch(rows, time.perf_counter() - started)
+        return result
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetch(self._cursor.fetchmany, *(() if size is None else (size,)))
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self._fetch(self._cursor.fetchone)
+        if row is None:
+            raise StopIteration
+        return row
+
+
+def instrument(db):
+    """
+    Wraps the public methods of one SqliteDb instance and its cursor, and installs the trace callback.
+    :return: the Profiler.
+    """
+    profiler = Profiler()
+    for name, method in inspect.getmembers(type(db), inspect.isfunction):
+        if name.startswith('_') or name in UNWRAPPED_METHODS or inspect.isgeneratorfunction(method):
+            continue
+        setattr(db, name, profiler.wrap(name, getattr(db, name)))
+    db.cursor = ProfilingCursor(db.cursor, profiler)
+    db.connection.set_trace_callback(profiler.trace)
+    return profiler
+
+
+def format_report(stats, limit=10):
+    """
+    :return: lines of text for the slowest methods and statements of a stats() report.
+    """
+    lines = [f"{stats['traced']:,} statements run by SQLite, {stats['commits']:,} commits, "
+             f"{stats['rollbacks']:,} rollbacks"]
+    for title, key, count_name in (('Methods', 'methods', 'calls'), ('Statements', 'statements', 'executions')):
+        lines.append(f"{title} by time:")
+        for name, entry in list(stats[key].items())[:limit]:
+            name = name if len(name) <= 80 else name[:77] + '...'
+            lines.append(f"  {entry['seconds'] * 1000:10.2f} ms {entry[count_name]:>8,}x {entry['rows']:>10,} rows  "
+                         f"{name}")
+    return lines
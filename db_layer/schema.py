@@ -0,0 +1,446 @@
+"""
+Schema of the ledger database. Each entry of MIGRATIONS upgrades the schema by one version, and the version a file is
+at is kept in PRAGMA user_version, so a file is only ever set up once.
+"""
+
+# Statements on the accounts table, which migration 8 runs again after rebuilding the table.
+ENABLED_ACCOUNTS_VIEW = """
+    CREATE VIEW IF NOT EXISTS enabled_accounts AS
+    SELECT * FROM accounts WHERE is_disabled = 0
+    """
+ACCOUNT_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_accounts_category_id ON accounts(category_id)",
+    """
+    CREATE INDEX IF NOT EXISTS idx_enabled_accounts_category_id ON accounts(category_id, value)
+    WHERE is_disabled = 0
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_disabled_accounts_category_id ON accounts(category_id)
+    WHERE is_disabled = 1
+    """,
+]
+ACCOUNT_HISTORY_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS account_history_insert AFTER INSERT ON accounts
+    BEGIN
+        INSERT INTO account_history (account_id, name, value, category_id, remarks, is_disabled)
+        VALUES (NEW.id, NEW.name, NEW.value, NEW.category_id, NEW.remarks, COALESCE(NEW.is_disabled, 0));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS account_history_update AFTER UPDATE ON accounts
+    WHEN OLD.name IS NOT NEW.name OR OLD.value IS NOT NEW.value OR OLD.category_id IS NOT NEW.category_id
+      OR OLD.remarks IS NOT NEW.remarks OR OLD.is_disabled IS NOT NEW.is_disabled
+    BEGIN
+        INSERT INTO account_history (account_id, name, value, category_id, remarks, is_disabled)
+        VALUES (NEW.id, NEW.name, NEW.value, NEW.category_id, NEW.remarks, COALESCE(NEW.is_disabled, 0));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS account_history_delete AFTER DELETE ON accounts
+    BEGIN
+        INSERT INTO account_history (account_id, name, value, category_id, remarks, is_disabled, is_deleted)
+        VALUES (OLD.id, OLD.name, OLD.value, OLD.category_id, OLD.remarks, COALESCE(OLD.is_disabled, 0), 1);
+    END
+    """,
+]
+ACCOUNT_SEARCH_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS search_index_account_insert AFTER INSERT ON accounts
+    BEGIN
+        INSERT INTO search_index (rowid, name, notes, kind, is_disabled)
+        VALUES (2 * NEW.id, NEW.name, COALESCE(NEW.remarks, ''), 'account', NEW.is_disabled);
+    END
+    """,
+    # upserts set remarks on every call, so the index is only written when something it holds changed
+    """
+    CREATE TRIGGER IF NOT EXISTS search_index_account_update AFTER UPDATE OF name, remarks, is_disabled ON accounts
+    WHEN OLD.name IS NOT NEW.name OR OLD.remarks IS NOT NEW.remarks OR OLD.is_disabled IS NOT NEW.is_disabled
+    BEGIN
+        UPDATE search_index SET name = NEW.name, notes = COALESCE(NEW.remarks, ''), is_disabled = NEW.is_disabled
+        WHERE rowid = 2 * NEW.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_index_account_delete AFTER DELETE ON accounts
+    BEGIN
+        DELETE FROM search_index WHERE rowid = 2 * OLD.id;
+    END
+    """,
+]
+
+MIGRATIONS = [
+    # 1: categories, accounts, the enabled_accounts view and import checkpoints
+    [
+        """
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            value REAL NOT NULL,
+            parent_id INTEGER DEFAULT NULL,
+            description TEXT,
+            FOREIGN KEY(parent_id) REFERENCES categories(id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS accounts (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            value REAL NOT NULL,
+            category_id INTEGER NOT NULL,
+            remarks TEXT,
+            is_disabled INTEGER DEFAULT 0,
+            FOREIGN KEY(category_id) REFERENCES categories(id)
+        )
+        """,
+        ENABLED_ACCOUNTS_VIEW,
+        # remembers how far a file import got, so an interrupted import can resume
+        """
+        CREATE TABLE IF NOT EXISTS import_checkpoints (
+            source TEXT PRIMARY KEY,
+            rows_committed INTEGER NOT NULL,
+            updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ],
+    # 2: indexes on the columns every lookup filters on. Enabled and disabled accounts get partial indexes of their
+    # own, so totals and account lists only ever read the rows they need.
+    [
+        "CREATE INDEX IF NOT EXISTS idx_categories_parent_id ON categories(parent_id)",
+        *ACCOUNT_INDEXES,
+    ],
+    # 3: closure table holding one row per (ancestor, descendant) pair of categories, each category being its own
+    # ancestor at depth 0. Triggers keep it in step with every insert, move and delete of a category, so subtrees,
+    # leaves and ancestor chains are single indexed lookups instead of recursive queries.
+    [
+        """
+        CREATE TABLE IF NOT EXISTS category_closure (
+            ancestor_id INTEGER NOT NULL,
+            descendant_id INTEGER NOT NULL,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (ancestor_id, descendant_id),
+            FOREIGN KEY(ancestor_id) REFERENCES categories(id),
+            FOREIGN KEY(descendant_id) REFERENCES categories(id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_category_closure_descendant ON category_closure(descendant_id, depth)",
+        """
+        INSERT OR IGNORE INTO category_closure (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE paths(ancestor_id, descendant_id, depth) AS (
+            SELECT id, id, 0 FROM categories
+            UNION ALL
+            SELECT p.ancestor_id, c.id, p.depth + 1
+            FROM paths p
+            JOIN categories c ON c.parent_id = p.descendant_id
+            WHERE p.depth < (SELECT COUNT(*) FROM categories)
+        )
+        SELECT ancestor_id, descendant_id, depth FROM paths
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS category_closure_insert AFTER INSERT ON categories
+        BEGIN
+            INSERT INTO category_closure (ancestor_id, descendant_id, depth) VALUES (NEW.id, NEW.id, 0);
+            INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+            SELECT ancestor_id, NEW.id, depth + 1 FROM category_closure WHERE descendant_id = NEW.parent_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS category_closure_refuse_cycle BEFORE UPDATE OF parent_id ON categories
+        WHEN EXISTS (SELECT 1 FROM category_closure WHERE ancestor_id = NEW.id AND descendant_id = NEW.parent_id)
+        BEGIN
+            SELECT RAISE(ABORT, 'Category cannot be moved under itself or its own subcategory');
+        END
+        """,
+        # detach the moved subtree from its old ancestors, then attach it below every ancestor of the new parent
+        """
+        CREATE TRIGGER IF NOT EXISTS category_closure_move AFTER UPDATE OF parent_id ON categories
+        WHEN OLD.parent_id IS NOT NEW.parent_id
+        BEGIN
+            DELETE FROM category_closure
+            WHERE descendant_id IN (SELECT descendant_id FROM category_closure WHERE ancestor_id = NEW.id)
+              AND ancestor_id NOT IN (SELECT descendant_id FROM category_closure WHERE ancestor_id = NEW.id);
+            INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+            SELECT above.ancestor_id, below.descendant_id, above.depth + below.depth + 1
+            FROM category_closure AS above, category_closure AS below
+            WHERE above.descendant_id = NEW.parent_id AND below.ancestor_id = NEW.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS category_closure_delete AFTER DELETE ON categories
+        BEGIN
+            DELETE FROM category_closure WHERE descendant_id = OLD.id OR ancestor_id = OLD.id;
+        END
+        """,
+    ],
+    # 4: append-only history of accounts and categories. Triggers add a row for every insert, change and delete,
+    # stamped in UTC, so the ledger as of any moment is the latest history row of each item at or before it.
+    # Category values are totals that can be recomputed from the accounts, so only their shape is kept.
+    [
+        """
+        CREATE TABLE IF NOT EXISTS account_history (
+            id INTEGER PRIMARY KEY,
+            recorded_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+            account_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            value REAL NOT NULL,
+            category_id INTEGER NOT NULL,
+            remarks TEXT,
+            is_disabled INTEGER NOT NULL DEFAULT 0,
+            is_deleted INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS category_history (
+            id INTEGER PRIMARY KEY,
+            recorded_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+            category_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            parent_id INTEGER,
+            is_deleted INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_account_history_recorded_at ON account_history(recorded_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_account_history_account_id ON account_history(account_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_category_history_recorded_at ON category_history(recorded_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_category_history_category_id ON category_history(category_id, id)",
+        """
+        INSERT INTO account_history (account_id, name, value, category_id, remarks, is_disabled)
+        SELECT id, name, value, category_id, remarks, COALESCE(is_disabled, 0) FROM accounts
+        """,
+        """
+        INSERT INTO category_history (category_id, name, parent_id)
+        SELECT id, name, parent_id FROM categories
+        """,
+        *ACCOUNT_HISTORY_TRIGGERS,
+        """
+        CREATE TRIGGER IF NOT EXISTS category_history_insert AFTER INSERT ON categories
+        BEGIN
+            INSERT INTO category_history (category_id, name, parent_id) VALUES (NEW.id, NEW.name, NEW.parent_id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS category_history_update AFTER UPDATE OF name, parent_id ON categories
+        WHEN OLD.name IS NOT NEW.name OR OLD.parent_id IS NOT NEW.parent_id
+        BEGIN
+            INSERT INTO category_history (category_id, name, parent_id) VALUES (NEW.id, NEW.name, NEW.parent_id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS category_history_delete AFTER DELETE ON categories
+        BEGIN
+            INSERT INTO category_history (category_id, name, parent_id, is_deleted)
+            VALUES (OLD.id, OLD.name, OLD.parent_id, 1);
+        END
+        """,
+    ],
+    # 5: journal of entries and their postings. Each posting stores the running balance of its account after it,
+    # and accounts.value always holds the latest running balance.
+    [
+        """
+        CREATE TABLE IF NOT EXISTS journal_entries (
+            id INTEGER PRIMARY KEY,
+            posted_at TEXT NOT NULL,
+            description TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS postings (
+            id INTEGER PRIMARY KEY,
+            entry_id INTEGER NOT NULL,
+            account_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            running_balance REAL NOT NULL,
+            memo TEXT,
+            FOREIGN KEY(entry_id) REFERENCES journal_entries(id),
+            FOREIGN KEY(account_id) REFERENCES accounts(id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_postings_account_id ON postings(account_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_postings_entry_id ON postings(entry_id)",
+    ],
+    # 6: balance_summary, a copy of the totals of the root categories and their direct subcategories kept current by
+    # triggers, so a dashboard can poll the headline numbers without building a tree
+    [
+        """
+        CREATE TABLE IF NOT EXISTS balance_summary (
+            category_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            parent_id INTEGER,
+            value REAL NOT NULL,
+            updated_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+        )
+        """,
+        """
+        INSERT OR IGNORE INTO balance_summary (category_id, name, parent_id, value)
+        SELECT id, name, parent_id, value FROM categories
+        WHERE parent_id IS NULL OR parent_id IN (SELECT id FROM categories WHERE parent_id IS NULL)
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS balance_summary_value AFTER UPDATE OF value ON categories
+        WHEN OLD.value IS NOT NEW.value
+        BEGIN
+            UPDATE balance_summary SET value = NEW.value, updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+            WHERE category_id = NEW.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS balance_summary_insert AFTER INSERT ON categories
+        WHEN NEW.parent_id IS NULL OR (SELECT parent_id FROM categories WHERE id = NEW.parent_id) IS NULL
+        BEGIN
+            INSERT OR REPLACE INTO balance_summary (category_id, name, parent_id, value)
+            VALUES (NEW.id, NEW.name, NEW.parent_id, NEW.value);
+        END
+        """,
+        # a move changes the depth of the whole subtree, so the top two levels are simply selected again
+        """
+        CREATE TRIGGER IF NOT EXISTS balance_summary_move AFTER UPDATE OF name, parent_id ON categories
+        WHEN OLD.name IS NOT NEW.name OR OLD.parent_id IS NOT NEW.parent_id
+        BEGIN
+            DELETE FROM balance_summary;
+            INSERT INTO balance_summary (category_id, name, parent_id, value)
+            SELECT id, name, parent_id, value FROM categories
+            WHERE parent_id IS NULL OR parent_id IN (SELECT id FROM categories WHERE parent_id IS NULL);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS balance_summary_delete AFTER DELETE ON categories
+        BEGIN
+            DELETE FROM balance_summary WHERE category_id = OLD.id;
+        END
+        """,
+    ],
+    # 7: search_index, a trigram full-text index over the names and remarks of accounts and the names and
+    # descriptions of categories, kept current by triggers. Accounts are stored at rowid 2 * id and categories at
+    # 2 * id + 1, so both fit in one table and every trigger touches a single row.
+    [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            name, notes, kind UNINDEXED, is_disabled UNINDEXED, tokenize = 'trigram'
+        )
+        """,
+        """
+        INSERT INTO search_index (rowid, name, notes, kind, is_disabled)
+        SELECT 2 * id, name, COALESCE(remarks, ''), 'account', is_disabled FROM accounts
+        """,
+        """
+        INSERT INTO search_index (rowid, name, notes, kind, is_disabled)
+        SELECT 2 * id + 1, name, COALESCE(description, ''), 'category', 0 FROM categories
+        """,
+        *ACCOUNT_SEARCH_TRIGGERS,
+        """
+        CREATE TRIGGER IF NOT EXISTS search_index_category_insert AFTER INSERT ON categories
+        BEGIN
+            INSERT INTO search_index (rowid, name, notes, kind, is_disabled)
+            VALUES (2 * NEW.id + 1, NEW.name, COALESCE(NEW.description, ''), 'category', 0);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS search_index_category_update AFTER UPDATE OF name, description ON categories
+        WHEN OLD.name IS NOT NEW.name OR OLD.description IS NOT NEW.description
+        BEGIN
+            UPDATE search_index SET name = NEW.name, notes = COALESCE(NEW.description, '')
+            WHERE rowid = 2 * NEW.id + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS search_index_category_delete AFTER DELETE ON categories
+        BEGIN
+            DELETE FROM search_index WHERE rowid = 2 * OLD.id + 1;
+        END
+        """,
+    ],
+    # 8: accounts rebuilt with AUTOINCREMENT, so the id of a deleted account is never handed to a new one and its
+    # postings and history cannot be taken over. The sequence starts above every id the history and postings have
+    # seen. Dropping the table drops its view, indexes and triggers, which are created again.
+    [
+        """
+        CREATE TABLE accounts_rebuilt (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            value REAL NOT NULL,
+            category_id INTEGER NOT NULL,
+            remarks TEXT,
+            is_disabled INTEGER DEFAULT 0,
+            FOREIGN KEY(category_id) REFERENCES categories(id)
+        )
+        """,
+        """
+        INSERT INTO accounts_rebuilt (id, name, value, category_id, remarks, is_disabled)
+        SELECT id, name, value, category_id, remarks, is_disabled FROM accounts
+        """,
+        "DROP VIEW enabled_accounts",
+        "DROP TABLE accounts",
+        "ALTER TABLE accounts_rebuilt RENAME TO accounts",
+        "DELETE FROM sqlite_sequence WHERE name = 'accounts'",
+        """
+        INSERT INTO sqlite_sequence (name, seq)
+        SELECT 'accounts', MAX(COALESCE((SELECT MAX(id) FROM accounts), 0),
+                               COALESCE((SELECT MAX(account_id) FROM account_history), 0),
+                               COALESCE((SELECT MAX(account_id) FROM postings), 0))
+        """,
+        ENABLED_ACCOUNTS_VIEW,
+        *ACCOUNT_INDEXES,
+        *ACCOUNT_HISTORY_TRIGGERS,
+        *ACCOUNT_SEARCH_TRIGGERS,
+    ],
+    # 9: case-insensitive name indexes. A search for names starting with some text walks them in name order and
+    # stops at its limit, where the trigram index would have to read and sort every match.
+    [
+        "CREATE INDEX IF NOT EXISTS idx_accounts_name_nocase ON accounts(name COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_categories_name_nocase ON categories(name COLLATE NOCASE)",
+    ],
+    # 10: closure rows of each ancestor in depth order, so a subtree is read parents first without a sort.
+    [
+        "CREATE INDEX IF NOT EXISTS idx_category_closure_ancestor_depth "
+        "ON category_closure(ancestor_id, depth, descendant_id)",
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+# tables and views every ledger at SCHEMA_VERSION has, used to tell a ledger from any other SQLite file
+LEDGER_TABLES = ('categories', 'accounts', 'enabled_accounts', 'category_closure', 'account_history',
+                 'category_history', 'journal_entries', 'postings', 'balance_summary', 'search_index')
+
+
+def get_schema_version(connection):
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def check_ledger(connection):
+    """
+    Tells whether a file can be read as a ledger without migrating it.
+    :param connection: sqlite3 connection.
+    :return: str describing why it cannot, or None when it is a ledger at SCHEMA_VERSION.
+    """
+    version = get_schema_version(connection)
+    tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+    if not version or not tables.issuperset(LEDGER_TABLES):
+        return "not a ledger"
+    if version < SCHEMA_VERSION:
+        return f"ledger at schema version {version}, open it once with write access to upgrade it to {SCHEMA_VERSION}"
+    if version > SCHEMA_VERSION:
+        return f"ledger at schema version {version}, newer than this version of the program"
+    return None
+
+
+def migrate(connection):
+    """
+    Brings the database up to SCHEMA_VERSION. All pending migrations run in one write transaction, so another
+    process opening the same file at the same time waits instead of migrating twice.
+    :param connection: sqlite3 connection.
+    :return: the schema version the database was at before migrating.
+    """
+    if get_schema_version(connection) >= SCHEMA_VERSION:
+        return SCHEMA_VERSION
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        version = get_schema_version(connection)
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            for statement in statements:
+                connection.execute(statement)
+            connection.execute(f"PRAGMA user_version = {number}")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return version
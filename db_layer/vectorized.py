@@ -0,0 +1,95 @@
+"""
+Category rollups computed with NumPy arrays instead of one SQL round trip per category. NumPy is optional: the rest of
+the ledger runs without it, and only the functions here need it.
+"""
+import sqlite3
+
+
+def require_numpy():
+    """
+    :return: the numpy module.
+    :raises ImportError: with install instructions when NumPy is not available.
+    """
+    try:
+        import numpy
+    except ImportError as error:
+        raise ImportError("Vectorized rollups need NumPy. Install it with `pip install numpy`, "
+                          "or call calculate_every_category() without vectorized=True.") from error
+    return numpy
+
+
+def category_depths(parents):
+    """
+    :param parents: index of the parent of each category, -1 for roots.
+    :return: distance of each category to its root, found with one pass per level of the tree.
+    """
+    np = require_numpy()
+    depths = np.zeros(len(parents), dtype=np.int64)
+    has_parent = parents >= 0
+    while True:
+        updated = np.where(has_parent, depths[parents] + 1, 0)
+        if np.array_equal(updated, depths):
+            return depths
+        if updated.max(initial=0) > len(parents):
+            raise ValueError("The category hierarchy contains a cycle")
+        depths = updated
+
+
+def rollup(parents, account_categories, account_values):
+    """
+    Sums account values into their categories, then folds each level of the tree into the level above, deepest first.
+    :param parents: index of the parent of each category, -1 for roots.
+    :param account_categories: index of the category of each account.
+    :param account_values: value of each account.
+    :return: subtree total of each category.
+    """
+    np = require_numpy()
+    parents = np.asarray(parents, dtype=np.int64)
+    totals = np.bincount(np.asarray(account_categories, dtype=np.int64),
+                         weights=np.asarray(account_values, dtype=np.float64), minlength=len(parents))
+    depths = category_depths(parents)
+    for depth in range(int(depths.max(initial=0)), 0, -1):
+        level = np.flatnonzero(depths == depth)
+        np.add.at(totals, parents[level], totals[level])
+    return totals
+
+
+def load_arrays(cursor):
+    """
+    Reads the category hierarchy and the enabled account values in two queries. SQLite sums the accounts of each
+    category off the covering partial index, so one row per category crosses into Python instead of one per account.
+    :return: (category ids, parent indexes, category indexes, summed account values) as arrays.
+    """
+    np = require_numpy()
+    cursor.execute("SELECT id, COALESCE(parent_id, -1) FROM categories ORDER BY id")
+    categories = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+    category_ids = categories[:, 0]
+    parents = np.searchsorted(category_ids, categories[:, 1])
+    parents[categories[:, 1] < 0] = -1
+
+    cursor.execute("SELECT category_id, SUM(value) FROM enabled_accounts GROUP BY category_id")
+    accounts = np.fromiter(cursor, dtype=[('category_id', np.int64), ('value', np.float64)])
+    account_categories = np.searchsorted(category_ids, accounts['category_id'])
+    return category_ids, parents, account_categories, accounts['value']
+
+
+def calculate_every_category(connection, commit=True):
+    """
+    Recomputes every stored category value from the enabled accounts and writes them back in one transaction.
+    :param connection: open sqlite3 connection of the ledger.
+    :param commit: commit, or roll back on error. False leaves both to an enclosing SqliteDb.transaction().
+    """
+    cursor = connection.cursor()
+    try:
+        category_ids, parents, account_categories, account_values = load_arrays(cursor)
+        totals = rollup(parents, account_categories, account_values)
+        cursor.executemany("UPDATE categories SET value = ? WHERE id = ?",
+                           zip(totals.tolist(), category_ids.tolist()))
+        if commit:
+            connection.commit()
+    except (sqlite3.Error, ValueError):
+        if commit:
+            connection.rollback()
+        raise
+    finally:
+        cursor.close()
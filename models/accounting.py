@@ -1,9 +1,66 @@
+from datetime import datetime
+
 from rich import print
-# Define ANSI escape codes for color formatting
-COLOR_BROWN = "\033[33m"
-COLOR_GOLD = "\033[38;5;214m"
-COLOR_GRAY = "\033[37m"
-COLOR_END = "\033[0m"
+
+from models import render
+from models.render import COLOR_GOLD, COLOR_GRAY, COLOR_END
+
+
+class ChildList(list):
+    """
+    The children of a Category. Every change to the list links the new children to the category and clears the
+    cached values of the category and its ancestors.
+    """
+    def __init__(self, owner, children=()):
+        super().__init__()
+        self.owner = owner
+        self.extend(children)
+
+    def _adopt(self, children):
+        for child in children:
+            if isinstance(child, Category):
+                child.parent = self.owner
+            else:
+                child.category = self.owner
+        self.owner.invalidate()
+
+    def append(self, child):
+        super().append(child)
+        self._adopt([child])
+
+    def extend(self, children):
+        children = list(children)
+        super().extend(children)
+        self._adopt(children)
+
+    def __iadd__(self, children):
+        self.extend(children)
+        return self
+
+    def insert(self, index, child):
+        super().insert(index, child)
+        self._adopt([child])
+
+    def __setitem__(self, index, child):
+        super().__setitem__(index, child)
+        self._adopt(child if isinstance(index, slice) else [child])
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self.owner.invalidate()
+
+    def remove(self, child):
+        super().remove(child)
+        self.owner.invalidate()
+
+    def pop(self, index=-1):
+        child = super().pop(index)
+        self.owner.invalidate()
+        return child
+
+    def clear(self):
+        super().clear()
+        self.owner.invalidate()
 
 
 class Category:
@@ -12,13 +69,35 @@ class Category:
     as well as any custom subcategories.
     When user creates a category, instantiate an object from this class.
     """
+    __slots__ = ('name', 'value', 'parent', '_children', 'description', '_cached_value')
+
     def __init__(self, name, value=0, parent=None, description=''):
         self.name = name
         self.value = value
         self.parent = parent
-        self.children = []
+        self._cached_value = None
+        self._children = ChildList(self)
         self.description = description
 
+    @property
+    def children(self):
+        return self._children
+
+    @children.setter
+    def children(self, children):
+        self._children = ChildList(self, children)
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Clears the cached value of this category and its ancestors. Stops at the first ancestor without a cached
+        value, since a cached category always has cached subcategories.
+        """
+        category = self
+        while category is not None and category._cached_value is not None:
+            category._cached_value = None
+            category = category.parent
+
     def calculate_value(self):
         """
         Recursively calculates the summation of the children's values.
@@ -26,15 +105,20 @@ class Category:
         current_savings.calculate_value() will notice that traditional_savings is a category, so it'll
         trigger the subcategory's calculate_value() and perform that twice. If you assets.calculate_value(), the
         recursion will perform calculate_value() trice.
+        Each result is cached until a child account's value or the children of a category in the subtree change, so
+        calling it again, e.g. from to_dict() at every level, costs nothing.
         :return: the total summation value of accounts and subcategories of the category.
         :rtype: float
         """
+        if self._cached_value is not None:
+            return self._cached_value
         value = 0
         for child in self.children:
             if isinstance(child, Category):
                 value += child.calculate_value()
             else:
                 value += child.value
+        self._cached_value = value
         return value
 
     def to_dict(self):
@@ -53,8 +137,11 @@ class Category:
 
     @classmethod
     def from_enum(cls, category_enum):
+        """
+        :param category_enum: CategoryEnum member, or a category name.
+        """
         return cls(
-            name=category_enum.value,
+            name=getattr(category_enum, 'value', category_enum),
             value=0,
             parent=None,
             description=''
@@ -69,48 +156,140 @@ class Account:
     """
     Represents individual listings in a models' statement, such as cash in a bank or the value of a property.
     """
+    __slots__ = ('name', '_value', 'category', 'remarks', 'is_disabled')
+
     def __init__(self, name, value, category, remarks='', is_disabled=0):
         self.name = name
-        self.value = value
         self.category = category
+        self.value = value
         self.remarks = remarks
         self.is_disabled = is_disabled
 
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        if isinstance(self.category, Category):
+            self.category.invalidate()
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class Posting:
+    """
+    Represents one movement of an account's value, such as a deposit, a mortgage payment or interest.
+    A positive amount increases the account's value, whether the account is an asset or a liability.
+    """
+    __slots__ = ('account', 'amount', 'memo')
+
+    def __init__(self, account, amount, memo=''):
+        self.account = account
+        self.amount = amount
+        self.memo = memo
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class JournalEntry:
+    """
+    Groups the postings of one transaction, e.g. a mortgage payment is a posting that lowers the bank account and
+    one that lowers the mortgage.
+    """
+    __slots__ = ('postings', 'description', 'posted_at')
+
+    def __init__(self, postings, description='', posted_at=None):
+        self.postings = postings
+        self.description = description
+        self.posted_at = posted_at
+
     @classmethod
     def from_dict(cls, data):
         return cls(**data)
 
 
-def print_composite(data, indent=0):
+def print_composite(data, indent=0, mode='ansi', file=None):
     """
     A composite can be broken down into its individual components, but the individual components cannot exist
     independently of the composite.
     e.g. Assets are composite because they are made up of various individual assets that are added together to form a
     total value.
-    :param data: composite in dict format.
+    The lines are written in buffered chunks by models.render instead of one print per node.
+    :param data: composite in dict format, or a CompactTree.
     :param indent: how much to indent.
+    :param mode: 'ansi' for colors, 'plain' for none, or 'rich' to print through rich.
+    :param file: text stream, sys.stdout by default.
     :return: none.
     """
+    render.write(data, file=file, indent=indent, mode=mode)
 
-    if data.get('name'):
-        name = data['name']
-        value = "{:,.2f}".format(data['value'])
-        indent_spaces = "  " * indent
 
-        if data.get('children'):
-            print(indent_spaces + COLOR_BROWN + name + COLOR_END + ": " + value)
-        else:
-            print(indent_spaces + COLOR_GRAY + name + COLOR_END + ": " + value)
+def format_as_of(as_of=None):
+    """
+    Formats the moment a balance sheet is for, e.g. March 4, 2023. Defaults to now.
+    :param as_of: datetime, date, ISO string or None.
+    :return: str
+    """
+    if as_of is None:
+        as_of = datetime.now()
+    elif isinstance(as_of, str):
+        as_of = datetime.fromisoformat(as_of)
+    return f"{as_of:%B} {as_of.day}, {as_of.year}"
 
-    if data.get('children'):
-        for child in data['children']:
-            print_composite(child, indent+1)
+
+def merge_trees(trees, merged=None):
+    """
+    Adds nested dict trees of get_category_tree() together by name: nodes with the same name under the same parent
+    become one node holding the sum of their values, and children keep the order they were first seen in.
+    :param trees: iterable of nested dicts, e.g. the Assets tree of several ledgers.
+    :param merged: tree to add to, which is updated in place. A new tree is started when None.
+    :return: the merged tree, or None when there were no trees.
+    """
+    for tree in trees:
+        if merged is None:
+            merged = {'name': tree['name'], 'value': 0, 'children': []}
+        # (target, source) pairs, walked without recursion so deep trees are fine
+        stack = [(merged, tree)]
+        while stack:
+            target, source = stack.pop()
+            target['value'] += source['value']
+            if 'children' not in source:
+                continue
+            by_name = {(child['name'], 'children' in child): child for child in target['children']}
+            for child in source['children']:
+                key = (child['name'], 'children' in child)
+                if key not in by_name:
+                    by_name[key] = {name: value for name, value in child.items() if name != 'children'}
+                    by_name[key]['value'] = 0
+                    if 'children' in child:
+                        by_name[key]['children'] = []
+                    target['children'].append(by_name[key])
+                stack.append((by_name[key], child))
+    return merged
 
 
-def print_balance_sheet(db=None):
-    assets_dict = db.get_category_tree(name='Assets')
-    liabilities_dict = db.get_category_tree(name='Liabilities')
+def print_balance_sheet(db=None, as_of=None):
+    """
+    Prints the Assets and Liabilities trees and net worth.
+    :param db: SqliteDb object.
+    :param as_of: optional datetime, date or ISO string to print the balance sheet as it was then from the history.
+    """
+    assets_dict = db.get_category_tree(name='Assets', as_of=as_of)
+    liabilities_dict = db.get_category_tree(name='Liabilities', as_of=as_of)
+    print_balance_sheet_dict(assets_dict, liabilities_dict, as_of=as_of)
 
+
+def print_balance_sheet_dict(assets_dict, liabilities_dict, as_of=None, title='Balance Sheet'):
+    """
+    Prints a balance sheet from the nested dicts of the Assets and Liabilities trees.
+    :param title: heading, e.g. to tell a consolidated balance sheet apart.
+    """
     balance_sheet_dict = {
         'assets': assets_dict,
         'liabilities': liabilities_dict,
@@ -118,7 +297,7 @@ def print_balance_sheet(db=None):
     }
 
     # Print the balance sheet from the balance_sheet_dict
-    print(COLOR_GOLD + '\nBalance Sheet' + COLOR_GRAY + ' (as of March 4, 2023)')  # will need to timestamp and save each balance sheet.
+    print(COLOR_GOLD + f'\n{title}' + COLOR_GRAY + f' (as of {format_as_of(as_of)})')
     print_composite(balance_sheet_dict['assets'])
     print_composite(balance_sheet_dict['liabilities'])
     print(COLOR_GOLD + 'Net Worth:' + COLOR_END, "{:,.2f}".format(balance_sheet_dict['net_worth']))
@@ -0,0 +1,128 @@
+from array import array
+
+CATEGORY = 1
+ACCOUNT = 0
+
+
+class CompactTree:
+    """
+    Struct-of-arrays form of a category tree for ledgers too large for one dict per node.
+    Node i is described by names[i], values[i], parents[i], kinds[i] and remarks[i], with -1 as the parent of the root
+    and None as the remarks of a category. Categories are added before accounts and every parent
+    before its children, so the root is node 0 and the children of a node in index order are its categories followed
+    by its accounts, as in the nested dict of SqliteDb.get_category_tree().
+    """
+    __slots__ = ('names', 'values', 'parents', 'kinds', 'remarks', '_child_index')
+
+    def __init__(self):
+        self.names = []
+        self.values = array('d')
+        self.parents = array('q')
+        self.kinds = bytearray()
+        self.remarks = []
+        self._child_index = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def _add(self, name, value, parent, kind, remarks=None):
+        self.names.append(name)
+        self.values.append(value)
+        self.parents.append(parent)
+        self.kinds.append(kind)
+        self.remarks.append(remarks)
+        self._child_index = None
+        return len(self.names) - 1
+
+    def add_category(self, name, parent=-1):
+        """
+        :param parent: index of the parent category, -1 for the root.
+        :return: index of the new node.
+        """
+        return self._add(name, 0.0, parent, CATEGORY)
+
+    def add_account(self, name, value, parent, remarks=''):
+        """
+        Adds an account and its value to its category. Call calculate_values() once all accounts are in.
+        :return: index of the new node.
+        """
+        index = self._add(name, value, parent, ACCOUNT, remarks)
+        self.values[parent] += value
+        return index
+
+    def calculate_values(self):
+        """
+        Adds every category's subtotal to its parent, deepest first. Relies on parents coming before children.
+        """
+        values, parents, kinds = self.values, self.parents, self.kinds
+        for index in range(len(self.names) - 1, 0, -1):
+            if kinds[index] == CATEGORY:
+                values[parents[index]] += values[index]
+
+    @classmethod
+    def from_rows(cls, categories, accounts):
+        """
+        :param categories: (id, name, parent_id) rows with the root first and every parent before its children.
+        :param accounts: (category_id, name, value, remarks) rows of enabled accounts in the subtree.
+        :return: CompactTree with category values calculated.
+        """
+        tree = cls()
+        positions = {}
+        for category_id, name, parent_id in categories:
+            positions[category_id] = tree.add_category(name, positions.get(parent_id, -1))
+        for category_id, name, value, remarks in accounts:
+            tree.add_account(name, value, positions[category_id], remarks)
+        tree.calculate_values()
+        return tree
+
+    def children(self, index):
+        """
+        :return: indexes of the children of a node, categories first.
+        """
+        if self._child_index is None:
+            # compressed offsets: children of node i are order[starts[i]:starts[i + 1]]
+            counts = array('q', bytes(8 * (len(self.names) + 1)))
+            for parent in self.parents:
+                if parent >= 0:
+                    counts[parent + 1] += 1
+            for position in range(1, len(counts)):
+                counts[position] += counts[position - 1]
+            order = array('q', bytes(8 * len(self.names)))
+            filled = array('q', counts)
+            for child, parent in enumerate(self.parents):
+                if parent >= 0:
+                    order[filled[parent]] = child
+                    filled[parent] += 1
+            self._child_index = (counts, order)
+        starts, order = self._child_index
+        return order[starts[index]:starts[index + 1]]
+
+    def iter_preorder(self, index=0, depth=0):
+        """
+        Walks the tree without recursion.
+        :return: generator of (node index, depth)
+        """
+        stack = [(index, depth)]
+        while stack:
+            index, depth = stack.pop()
+            yield index, depth
+            stack.extend((child, depth + 1) for child in reversed(self.children(index)))
+
+    def to_dict(self, index=0):
+        """
+        :return: the nested dict SqliteDb.get_category_tree() returns, for print_composite().
+        """
+        nodes = {}
+        for node_index in range(index, len(self.names)):
+            parent = self.parents[node_index]
+            if node_index != index and parent not in nodes:
+                continue
+            if self.kinds[node_index] == CATEGORY:
+                node = {'name': self.names[node_index], 'value': self.values[node_index], 'children': []}
+            else:
+                node = {'name': self.names[node_index], 'value': self.values[node_index],
+                        'remarks': self.remarks[node_index]}
+            nodes[node_index] = node
+            if node_index != index:
+                nodes[parent]['children'].append(node)
+        return nodes[index]
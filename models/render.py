@@ -0,0 +1,93 @@
+"""
+Renders category trees as indented "name: value" lines. The tree is walked without recursion and lines are produced by
+a generator, so a renderer can either join them into one buffered write or stream a very large tree in chunks.
+"""
+import sys
+
+from models.compact import CompactTree
+
+# Define ANSI escape codes for color formatting
+COLOR_BROWN = "\033[33m"
+COLOR_GOLD = "\033[38;5;214m"
+COLOR_GRAY = "\033[37m"
+COLOR_END = "\033[0m"
+
+# plain: no colors, for files and pipes. ansi: raw escape codes. rich: rich markup, printed by rich.
+MODES = ('plain', 'ansi', 'rich')
+STREAM_CHUNK_LINES = 4096
+
+
+def iter_nodes(data, indent=0):
+    """
+    Walks a tree depth first without recursion.
+    :param data: composite in dict format, or a CompactTree.
+    :param indent: depth of the root.
+    :return: generator of (name, value, depth, has_children)
+    """
+    if isinstance(data, CompactTree):
+        for index, depth in data.iter_preorder(depth=indent):
+            yield data.names[index], data.values[index], depth, len(data.children(index)) > 0
+        return
+
+    stack = [(data, indent)]
+    while stack:
+        node, depth = stack.pop()
+        children = node.get('children')
+        if node.get('name'):
+            yield node['name'], node['value'], depth, bool(children)
+        if children:
+            stack.extend((child, depth + 1) for child in reversed(children))
+
+
+def format_line(name, value, indent, has_children, mode='ansi'):
+    value = "{:,.2f}".format(value)
+    indent_spaces = "  " * indent
+    if mode == 'plain':
+        return indent_spaces + name + ": " + value
+    if mode == 'rich':
+        from rich.markup import escape
+        style = 'yellow' if has_children else 'white'
+        return f"{indent_spaces}[{style}]{escape(name)}[/{style}]: {value}"
+    color = COLOR_BROWN if has_children else COLOR_GRAY
+    return indent_spaces + color + name + COLOR_END + ": " + value
+
+
+def iter_lines(data, indent=0, mode='ansi'):
+    """
+    :return: generator of the lines of a tree, without line endings.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode}. Choose one of {', '.join(MODES)}.")
+    for name, value, depth, has_children in iter_nodes(data, indent):
+        yield format_line(name, value, depth, has_children, mode)
+
+
+def render(data, indent=0, mode='ansi'):
+    """
+    :return: the whole tree as one string, one line per node.
+    """
+    return "".join(line + "\n" for line in iter_lines(data, indent, mode))
+
+
+def write(data, file=None, indent=0, mode='ansi', chunk_lines=STREAM_CHUNK_LINES):
+    """
+    Writes a tree with one write per chunk of lines rather than one per node. The rich mode hands each chunk to a
+    rich Console instead, which parses the markup.
+    :param file: text stream, sys.stdout by default.
+    :param chunk_lines: lines per write, so a very large tree is never held as one string.
+    """
+    file = file if file is not None else sys.stdout
+    console = None
+    if mode == 'rich':
+        from rich.console import Console
+        console = Console(file=file)
+    lines = iter_lines(data, indent, mode)
+    while True:
+        chunk = [line for _, line in zip(range(chunk_lines), lines)]
+        if not chunk:
+            break
+        if console is not None:
+            console.print("\n".join(chunk), soft_wrap=True)
+        else:
+            file.write("\n".join(chunk) + "\n")
+    file.flush()
@@ -1,59 +1,47 @@
+import io
 import pytest
-from models.accounting import Category, Account, print_balance_sheet
+from models import render
+from models.accounting import Category, Account, print_balance_sheet, print_composite
 from db_layer.database import SqliteDb
 
 
 def insert_categories(db, assets):
     current_assets = Category('Current Assets', parent=assets)
-    db.upsert_category(current_assets)
     traditional_savings = Category('Traditional Savings', parent=current_assets, description='1M insured')
-    db.upsert_category(traditional_savings)
     e_savings = Category('E-Savings', parent=current_assets, description='1M insured')
-    db.upsert_category(e_savings)
     fixed_assets = Category('Fixed Assets', parent=assets, description='Cannot liquidate in 1y')
-    db.upsert_category(fixed_assets)
+    db.bulk_upsert_categories([current_assets, traditional_savings, e_savings, fixed_assets])
     return current_assets, traditional_savings, e_savings, fixed_assets
 
 
 def insert_traditional_savings(db, traditional_savings):
     scb_bank = Account('SCB Bank', 503.97, category=traditional_savings, remarks='has SCB Easy online access')
-    db.upsert_account(scb_bank)
     k_bank = Account('K Bank', 145253, category=traditional_savings)
-    db.upsert_account(k_bank)
     bkk_bank = Account('BKK Bank', 90744, category=traditional_savings)
-    db.upsert_account(bkk_bank)
     kt_bank = Account('KT Bank', 42287, category=traditional_savings)
-    db.upsert_account(kt_bank)
     gh_bank = Account('GH Bank (partnered savings)', 19377, category=traditional_savings,
                       remarks='50% of 38,754')
-    db.upsert_account(gh_bank)
     baac_bank = Account('BAAC Bank (partnered savings)', 9915.5, category=traditional_savings,
                         remarks='50% of 23,231')
-    db.upsert_account(baac_bank)
+    db.bulk_upsert_accounts([scb_bank, k_bank, bkk_bank, kt_bank, gh_bank, baac_bank])
 
 
 def insert_e_savings(db, e_savings):
     g_wallet = Account('G-wallet (paotang)', 0, category=e_savings, remarks='KTBank')
-    db.upsert_account(g_wallet)
     kpp_dime = Account('KPP Dime (high-yield)', 30000, category=e_savings)
-    db.upsert_account(kpp_dime)
     lhb_you = Account('LHB You (high-yield)', 10000, category=e_savings)
-    db.upsert_account(lhb_you)
+    db.bulk_upsert_accounts([g_wallet, kpp_dime, lhb_you])
 
 
 def insert_fixed_assets(db, fixed_assets):
     gh_bank_fd = Account('GH Bank 3-year Fixed Deposit (since 23M02)', 300000, category=fixed_assets,
                          remarks='2.25% semiannual')
-    db.upsert_account(gh_bank_fd)
     real_estate_equity = Account('Real estate partnership equity', 250000, category=fixed_assets,
                                  remarks='50% of the 500,000 down payment of 2.2M Baht house')
-    db.upsert_account(real_estate_equity)
     maxvalu_fl3 = Account('MaxValu FL3', 300000, category=fixed_assets)
-    db.upsert_account(maxvalu_fl3)
     midsoi_fl4 = Account('MidSoi FL4 (co-own sis)', 150000, category=fixed_assets, remarks='50% of 300,000')
-    db.upsert_account(midsoi_fl4)
     midsoi_fl2 = Account('MidSoi FL2 (co-own sis)', 115000, category=fixed_assets, remarks='50% of 230,000')
-    db.upsert_account(midsoi_fl2)
+    db.bulk_upsert_accounts([gh_bank_fd, real_estate_equity, maxvalu_fl3, midsoi_fl4, midsoi_fl2])
 
 
 def insert_liabilities(db, liabilities):
@@ -110,3 +98,62 @@ def test_print_balance_sheet(db):
     """
     print_balance_sheet(db=db)
     # There are no asserts here. Use visual inspection.
+
+
+@pytest.mark.depends(on=['test_create_ledger'])
+def test_compact_tree_matches_dict_tree(db, capsys):
+    tree = db.get_compact_tree('Assets')
+    assert tree.to_dict() == db.get_category_tree('Assets')
+    assert tree.to_dict(tree.names.index('Current Assets')) == db.get_category_tree('Current Assets')
+
+    print_composite(tree)
+    compact_output = capsys.readouterr().out
+    print_composite(db.get_category_tree('Assets'))
+    assert compact_output == capsys.readouterr().out
+
+
+def test_models_have_no_instance_dict():
+    assert not hasattr(Category('Assets'), '__dict__')
+    assert not hasattr(Account('Cash', 1.0, category=None), '__dict__')
+
+
+def test_category_value_is_cached_until_the_tree_changes():
+    assets = Category('Assets')
+    savings = Category('Savings')
+    cash = Account('Cash', 100.0, category=None)
+    assets.children.append(savings)
+    savings.children.extend([cash, Account('Bonds', 50.0, category=None)])
+    assert savings.parent is assets and cash.category is savings
+    assert assets.calculate_value() == 150.0
+
+    cash.value = 120.0
+    assert assets.calculate_value() == 170.0
+    savings.children.pop()
+    assert assets.calculate_value() == 120.0
+    assets.children.append(Account('Gold', 30.0, category=None))
+    assert assets.to_dict()['value'] == 150.0
+    assert assets.to_dict()['children'][0] == {'name': 'Savings', 'value': 120.0,
+                                               'children': [{'name': 'Cash', 'value': 120.0}]}
+
+
+def test_render_modes_and_streaming():
+    tree = {'name': 'Assets', 'value': 1500.0, 'children': [
+        {'name': 'Cash [wallet]', 'value': 1500.0, 'children': [{'name': 'Coins', 'value': 1500.0, 'remarks': ''}]}]}
+    assert render.render(tree, mode='plain') == "Assets: 1,500.00\n  Cash [wallet]: 1,500.00\n    Coins: 1,500.00\n"
+    assert render.render(tree).splitlines()[2] == "    " + render.COLOR_GRAY + "Coins" + render.COLOR_END + ": 1,500.00"
+
+    output = io.StringIO()
+    print_composite(tree, mode='rich', file=output)
+    assert output.getvalue().splitlines()[1] == "  Cash [wallet]: 1,500.00"
+
+    # deeper than the recursion limit, written in chunks of 100 lines
+    deep = node = {'name': 'Level 0', 'value': 1.0, 'children': []}
+    for level in range(1, 5000):
+        child = {'name': f'Level {level}', 'value': 1.0, 'children': []}
+        node['children'].append(child)
+        node = child
+    output = io.StringIO()
+    render.write(deep, file=output, mode='plain', chunk_lines=100)
+    assert output.getvalue() == render.render(deep, mode='plain')
+    with pytest.raises(ValueError):
+        next(render.iter_lines(tree, mode='html'))
@@ -0,0 +1,32 @@
+import asyncio
+import threading
+from db_layer.async_database import AsyncSqliteDb, NOT_DELEGATED, READ_METHODS, WRITE_METHODS
+from db_layer.database import SqliteDb
+from benchmarks.ledger import generate_accounts, generate_categories
+from models.accounting import Account, Category
+
+
+def test_async_db_covers_sqlite_db_methods():
+    public = {name for name in vars(SqliteDb) if not name.startswith('_') and callable(getattr(SqliteDb, name))}
+    assert public - set(NOT_DELEGATED) == set(READ_METHODS) | set(WRITE_METHODS)
+
+
+def test_reads_are_served_while_writing(tmp_path):
+    async def scenario():
+        async with AsyncSqliteDb(str(tmp_path / 'async.db'), readers=3) as db:
+            categories, leaves = generate_categories(2, 3)
+            await db.bulk_upsert_categories(categories)
+            writes = [db.bulk_upsert_accounts(list(generate_accounts(leaves, 500, seed)))
+                      for seed in range(4)]
+            reads = [db.get_category_tree('Assets') for _ in range(20)]
+            results = await asyncio.gather(*writes, *reads)
+            assert results[:4] == [500] * 4
+            assert all(tree['name'] == 'Assets' for tree in results[4:])
+
+            await db.upsert_account(Account('Async Account', 10.0, category=Category(leaves[0].name)))
+            assert await db.get_account_by_name('Async Account') is not None
+            assert await db.check_rollups() == []
+            thread_names = {thread.name for thread in threading.enumerate()}
+            assert sum(name.startswith('ledger-writer') for name in thread_names) == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,17 @@
+import json
+
+from benchmarks import run
+
+
+def test_benchmark_suite_writes_comparable_json(tmp_path, capsys):
+    output = tmp_path / 'results.json'
+    assert run.main(['--sizes', '100', '--repeat', '1', '--skip-startup', '--output', str(output)]) == 0
+    results = json.loads(output.read_text())
+    names = {item['benchmark'] for item in results['results']}
+    assert {'upsert_account', 'calculate_every_category', 'get_category_tree', 'print_balance_sheet',
+            'disable_enable_account', 'disable_enable_many_accounts'} <= names
+    assert results['meta']['sqlite']
+
+    slower = {'results': [dict(item, seconds=item['seconds'] * 2) for item in results['results']]}
+    assert len(run.compare(slower, results)) == len(results['results'])
+    assert run.compare(results, results) == []
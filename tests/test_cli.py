@@ -1,20 +1,24 @@
 import pytest
 import typer
 
+from typer.testing import CliRunner
+
+from cli_layer import cli
 from cli_layer.cli import save_account, save_category, exit_menu, start_menu
+from db_layer.connections import registry
 from db_layer.database import SqliteDb
 from models.accounting import Category
-from cli_layer.enums import CategoryEnum
+from cli_layer.enums import CategoryEnum, resolve_category_choice, search_selected_choice
+from benchmarks.ledger import populate
+from benchmarks.startup import run_cli_help
 
 
 def delete_account_by_name(db, name: str):
-    db.cursor.execute("DELETE FROM accounts WHERE name = ?", (name,))
-    db.connection.commit()
+    db.delete_account(name)
 
 
 def delete_category_by_name(db, name: str):
-    db.cursor.execute("DELETE FROM categories WHERE name = ?", (name,))
-    db.connection.commit()
+    db.delete_category(name)
 
 
 @pytest.fixture(scope="module")
@@ -59,6 +63,64 @@ def test_save_account(db):
         delete_account_by_name(db, 'test account')
 
 
+def test_rejected_category_releases_the_connection(db, monkeypatch):
+    opened = []
+
+    def open_db(use_test_db=False):
+        opened.append(SqliteDb('ledger.db', test=use_test_db))
+        return opened[-1]
+
+    monkeypatch.setattr(cli, 'open_db', open_db)
+    with pytest.raises(typer.BadParameter):
+        save_category(use_test_db=True, name='test category', parent='No Such Category', description='test')
+    with pytest.raises(typer.BadParameter):
+        save_account(use_test_db=True, name='test account', value=1.0, category='No Such Category', remarks='')
+    assert len(opened) == 2 and all(opened_db.connection is None for opened_db in opened)
+
+
 def test_exit_menu():
     with pytest.raises(typer.Exit):
         exit_menu()
+
+
+def test_help_does_no_database_io():
+    _, connections = run_cli_help()
+    assert connections == 0
+
+
+def test_profile_flag_reports_database_work(db):
+    result = CliRunner().invoke(cli.app, ['--profile', 'check-rollups', '--use-test-db'])
+    assert result.exit_code == 0, result.output
+    assert 'Profile of' in result.output
+    assert 'check_rollups' in result.output
+    # the pooled connection is closed on the way out
+    assert registry.idle_count(db.path) == 0
+    cli.profiled_dbs = None
+
+
+def test_search_picker_lists_only_matches(tmp_path, monkeypatch):
+    db = SqliteDb(str(tmp_path / 'picker.db'))
+    populate(db, accounts=100, depth=2, fanout=2)
+    prompts = []
+    answers = iter(['zzzz', 'Acount 42', '0', 'Account 42', '99', '1'])
+
+    def prompt(text, **kwargs):
+        prompts.append(text)
+        return next(answers)
+
+    monkeypatch.setattr(typer, 'prompt', prompt)
+    assert search_selected_choice(db, 'account', is_disabled=0) == 'Account 42'
+    # only the few matches are numbered, never the whole list
+    assert '1. Account 42' in prompts[2] and 'Account 7\n' not in prompts[4]
+
+    # leaf categories are indented, as the full list used to show them
+    prompts.clear()
+    answers = iter(['Assets.1', '2'])
+    leaves = set(db.get_leaf_categories('Assets'))
+    assert search_selected_choice(db, 'category', matching_items=leaves) == 'Assets.1.1'
+    assert '\n\t2. Assets.1.1' in prompts[1] and '\t1. Assets.1\n' not in prompts[1]
+
+    assert resolve_category_choice('assets.1', db) == 'Assets.1'
+    with pytest.raises(typer.BadParameter, match='Did you mean Assets'):
+        resolve_category_choice('Asets', db)
+    db.close()
@@ -0,0 +1,78 @@
+import sqlite3
+
+import pytest
+from cli_layer.cli import consolidate as consolidate_command
+from db_layer.consolidation import consolidate
+from db_layer.database import SqliteDb
+from benchmarks.ledger import populate
+from models.accounting import merge_trees
+
+
+@pytest.fixture(scope="module")
+def ledgers(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('ledgers')
+    totals = {}
+    for seed in range(3):
+        path = str(directory / f'household_{seed}.db')
+        with SqliteDb(path) as db:
+            populate(db, accounts=50 + seed * 10, depth=2, fanout=2, seed=seed)
+            totals[path] = db.get_category_tree('Assets')['value']
+    return directory, totals
+
+
+def test_merge_trees_adds_up_by_name():
+    first = {'name': 'Assets', 'value': 3.0, 'children': [
+        {'name': 'Cash', 'value': 3.0, 'children': [{'name': 'Wallet', 'value': 3.0, 'remarks': ''}]}]}
+    second = {'name': 'Assets', 'value': 5.0, 'children': [
+        {'name': 'Stocks', 'value': 1.0, 'children': []},
+        {'name': 'Cash', 'value': 4.0, 'children': [{'name': 'Wallet', 'value': 4.0, 'remarks': ''}]}]}
+    assert merge_trees([first, second]) == {'name': 'Assets', 'value': 8.0, 'children': [
+        {'name': 'Cash', 'value': 7.0, 'children': [{'name': 'Wallet', 'value': 7.0, 'remarks': ''}]},
+        {'name': 'Stocks', 'value': 1.0, 'children': []}]}
+    assert first['value'] == 3.0
+    assert merge_trees([]) is None
+
+
+def test_consolidate_in_worker_processes(ledgers):
+    directory, totals = ledgers
+    merged = consolidate([directory], workers=2)
+    assert merged['ledgers'] == 3
+    assert merged['Assets']['value'] == pytest.approx(sum(totals.values()))
+    assert merged == consolidate(sorted(totals), workers=1)
+    with pytest.raises(ValueError):
+        consolidate([])
+
+
+def test_consolidate_command(ledgers, capsys):
+    directory, totals = ledgers
+    merged = consolidate_command([directory], workers=1, as_of=None)
+    assert 'Consolidated Balance Sheet of 3 ledgers' in capsys.readouterr().out
+    assert merged['Assets']['value'] == pytest.approx(sum(totals.values()))
+
+
+def test_consolidate_reads_without_writing(ledgers, tmp_path):
+    directory, totals = ledgers
+    other = directory / 'other.db'
+    connection = sqlite3.connect(other)
+    connection.execute("CREATE TABLE notes (body TEXT)")
+    connection.commit()
+    connection.close()
+    ledger = sorted(totals)[0]
+    with open(ledger, 'rb') as file:
+        before = file.read()
+
+    merged = consolidate([directory], workers=1)
+    assert merged['ledgers'] == 3
+    assert merged['skipped'] == [(str(other), 'not a ledger')]
+    with pytest.raises(ValueError, match='not a ledger'):
+        consolidate([other], workers=1)
+
+    # neither the ledgers nor the other file were migrated or switched to WAL
+    with open(ledger, 'rb') as file:
+        assert file.read() == before
+    connection = sqlite3.connect(other)
+    assert connection.execute("PRAGMA user_version").fetchone() == (0,)
+    assert connection.execute("PRAGMA journal_mode").fetchone() == ('delete',)
+    assert connection.execute("SELECT name FROM sqlite_master").fetchall() == [('notes',)]
+    connection.close()
+    other.unlink()
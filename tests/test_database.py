@@ -1,8 +1,17 @@
+import os
 import pytest
 import random
+import re
+import sqlite3
+import time
+from datetime import datetime
 from rich import print
-from db_layer.database import SqliteDb
-from models.accounting import Account, Category
+from db_layer.cache import LookupCache
+from db_layer.connections import registry
+from db_layer.database import MAX_VARIABLES, SqliteDb
+from db_layer.schema import MIGRATIONS, SCHEMA_VERSION, get_schema_version, migrate
+from benchmarks.ledger import populate
+from models.accounting import Account, Category, JournalEntry, Posting
 
 
 @pytest.fixture(scope="module")
@@ -52,8 +61,7 @@ def test_upsert_account(db):
         assert account_row[3] == category_id
 
         # Delete the test account
-        db.cursor.execute("DELETE FROM accounts WHERE name = ?", (test_account.name,))
-        db.connection.commit()
+        db.delete_account(test_account.name)
 
 
 @pytest.mark.depends(on=['test_create_ledger'])
@@ -63,8 +71,7 @@ def test_enabled_accounts_view(db):
     account_row = db.get_account_by_name('Test Account')
     assert account_row['is_disabled'] == 1
     # Delete the test account
-    db.cursor.execute("DELETE FROM accounts WHERE name = ?", (test_account.name,))
-    db.connection.commit()
+    db.delete_account(test_account.name)
 
 
 def test_get_enabled_accounts(db):
@@ -126,3 +133,661 @@ def test_get_all_account_names_in_category(db):
         assert names is not None
         assert isinstance(names, list)
         assert all(isinstance(account, str) for account in names)
+
+
+def test_incremental_rollups_match_full_recalculation(db):
+    db.upsert_account(Account(name='Rollup Account', value=250.0, category=Category(name='Assets')))
+    assert db.check_rollups() == []
+    db.upsert_account(Account(name='Rollup Account', value=75.5, category=Category(name='Liabilities')))
+    assert db.check_rollups() == []
+    db.disable_account('Rollup Account')
+    assert db.check_rollups() == []
+    db.enable_account('Rollup Account')
+    db.delete_account('Rollup Account')
+    assert db.check_rollups() == []
+
+
+def test_move_category_carries_subtree_total(db):
+    db.upsert_category(Category(name='Rollup Parent', parent=Category(name='Assets')))
+    db.upsert_category(Category(name='Rollup Child', parent=Category(name='Rollup Parent')))
+    db.upsert_account(Account(name='Rollup Child Account', value=40.0, category=Category(name='Rollup Child')))
+    db.upsert_category(Category(name='Rollup Child', parent=Category(name='Liabilities')))
+    assert db.check_rollups() == []
+    with pytest.raises(ValueError):
+        db.upsert_category(Category(name='Rollup Parent', parent=Category(name='Rollup Parent')))
+    db.delete_account('Rollup Child Account')
+    db.delete_category('Rollup Child')
+    db.delete_category('Rollup Parent')
+    assert db.check_rollups() == []
+
+
+def test_vectorized_rollups_match_sql(tmp_path):
+    pytest.importorskip('numpy')
+    with SqliteDb(str(tmp_path / 'vectorized.db')) as db:
+        populate(db, accounts=2000, depth=3, fanout=3)
+        db.disable_many_accounts(['Account 1', 'Account 2'])
+        db.calculate_every_category()
+        expected = {name: stored for name, (stored, _) in db.get_expected_category_values().items()}
+        db.cursor.execute("UPDATE categories SET value = 0")
+        db.connection.commit()
+        db.calculate_every_category(vectorized=True)
+        actual = {name: stored for name, (stored, _) in db.get_expected_category_values().items()}
+        assert actual == pytest.approx(expected)
+        assert db.check_rollups() == []
+
+
+def test_lookup_cache_is_invalidated_by_writes(tmp_path):
+    with SqliteDb(str(tmp_path / 'cache.db')) as db, SqliteDb(str(tmp_path / 'cache.db')) as other:
+        populate(db, accounts=20, depth=2, fanout=2)
+        names = db.get_category_names()
+        leaves = db.get_leaf_categories('Assets')
+        accounts = db.get_accounts()
+        db.cache.reset_stats()
+        assert other.get_category_names() == names
+        assert db.get_leaf_categories('Assets') == leaves
+        assert db.get_accounts() == accounts
+        db.upsert_account(Account('Cached Account', 1.0, category=Category(leaves[0])))
+        db.upsert_account(Account('Cached Account', 5.0, category=Category(leaves[0])))
+        # only the first category id lookup of the upserts reaches the database
+        assert db.cache.stats()['hits'] == 4
+        assert db.cache.stats()['misses'] == 1
+
+        assert sorted(other.get_accounts()) == sorted(accounts + ['Cached Account'])
+        db.disable_account('Cached Account')
+        assert 'Cached Account' in db.get_accounts(enabled=False)
+        db.upsert_category(Category('Cached Leaf', parent=Category(leaves[0])))
+        assert other.get_leaf_categories('Assets') == leaves[1:] + ['Cached Leaf']
+        assert 'Cached Leaf' in other.get_category_names()
+        db.delete_category('Cached Leaf')
+        assert other.get_category_id('Cached Leaf') is None
+        assert 'Cached Leaf' not in db.get_category_names()
+        assert db.get_leaf_categories('Assets') == leaves
+        db.delete_account('Cached Account')
+        assert db.get_accounts(enabled=False) == []
+
+
+def test_lookup_cache_evicts_least_recently_used():
+    cache = LookupCache(max_entries=2)
+    cache.get('category_id', 'a', lambda: 1)
+    cache.get('category_id', 'b', lambda: 2)
+    cache.get('category_id', 'a', lambda: 1)
+    cache.get('category_id', 'c', lambda: 3)
+    assert cache.get('category_id', 'a', lambda: -1) == 1
+    assert cache.get('category_id', 'b', lambda: -2) == -2
+    assert cache.stats() == {'hits': 2, 'misses': 4, 'evictions': 2, 'entries': 2}
+
+
+def test_instrumentation_records_methods_statements_and_commits(tmp_path):
+    path = str(tmp_path / 'profiled.db')
+    with SqliteDb(path) as db:
+        populate(db, accounts=30, depth=1, fanout=2)
+        assert isinstance(db.cursor, sqlite3.Cursor)
+        with pytest.raises(ValueError):
+            db.stats()
+
+    db = SqliteDb(path, instrument=True)
+    db.upsert_account(Account('Account 0', 1.0, category=Category('Assets.1')))
+    db.get_category_tree('Assets')
+    db.disable_many_accounts(['Account 1', 'Account 2'])
+    stats = db.stats()
+    assert stats['methods']['upsert_account']['calls'] == 1
+    assert stats['methods']['get_compact_tree']['rows'] > 0
+    assert stats['methods']['disable_many_accounts']['calls'] == 1
+    assert stats['commits'] == 2
+    assert any('toggled_names' in sql for sql in stats['statements'])
+    assert all(entry['seconds'] >= 0 for entry in stats['statements'].values())
+    connection = db.connection
+    db.close()
+    # the pooled connection is handed back without the trace callback
+    with SqliteDb(path) as other:
+        assert other.connection is connection
+        other.get_category_tree('Assets')
+    assert db.stats()['traced'] == stats['traced']
+
+
+def test_transaction_commits_once_and_rolls_back_as_a_whole(tmp_path):
+    path = str(tmp_path / 'unit_of_work.db')
+    with SqliteDb(path) as db:
+        populate(db, accounts=30, depth=1, fanout=2)
+
+    db = SqliteDb(path, incremental=False, instrument=True)
+    with db.transaction():
+        db.upsert_category(Category('Unit Savings', parent=Category('Assets')))
+        db.upsert_account(Account('Unit Account', 25.0, category=Category('Unit Savings')))
+        db.disable_many_accounts(['Account 1'])
+    stats = db.stats()
+    assert stats['commits'] == 1
+    # the full rollups the writes asked for ran once, at the end
+    assert stats['methods']['calculate_every_category']['calls'] == 1
+    assert db.check_rollups() == []
+
+    db.calculate_every_category()
+    assert db.stats()['commits'] == 2
+
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.upsert_category(Category('Doomed', parent=Category('Assets')))
+            assert 'Doomed' in db.get_category_names()
+            raise RuntimeError
+    assert db.get_category_id('Doomed') is None
+    assert 'Doomed' not in db.get_category_names()
+
+    # a failed write that is caught inside the block still rolls the block back
+    with pytest.raises(ValueError):
+        with db.transaction():
+            db.upsert_account(Account('Doomed Account', 1.0, category=Category('Assets.1')))
+            try:
+                db.bulk_upsert_categories([Category('Assets', parent=Category('Assets.1'))])
+            except ValueError:
+                pass
+    assert db.get_account_by_name('Doomed Account') is None
+    assert db.check_rollups() == []
+    db.close()
+
+
+def test_rolled_back_category_leaves_no_cached_id(tmp_path):
+    db = SqliteDb(str(tmp_path / 'rolled_back.db'))
+    populate(db, accounts=10, depth=1, fanout=1)
+    for upsert in (lambda category: db.upsert_category(category),
+                   lambda category: db.bulk_upsert_categories([category])):
+        with pytest.raises(RuntimeError):
+            with db.transaction():
+                upsert(Category('Doomed', parent=Category('Assets')))
+                db.upsert_account(Account('Doomed Account', 7.0, category=Category('Doomed')))
+                raise RuntimeError
+        assert db.get_category_id('Doomed') is None
+        with pytest.raises(ValueError):
+            db.upsert_account(Account('Orphan', 7.0, category=Category('Doomed')))
+
+    # the id the rolled back category had is taken by the next one, which must start empty
+    db.upsert_category(Category('Savings', parent=Category('Assets')))
+    assert db.get_all_account_names_in_category('Savings') == []
+    assert db.check_rollups() == []
+    db.close()
+
+
+def test_balance_summary_follows_writes(tmp_path):
+    db = SqliteDb(str(tmp_path / 'summary.db'), instrument=True)
+    populate(db, accounts=40, depth=2, fanout=2)
+
+    def check():
+        summary = db.get_balance_summary()
+        for name in ('Assets', 'Liabilities', 'Assets.1', 'Assets.2', 'Liabilities.1', 'Liabilities.2'):
+            if name in summary['categories']:
+                assert summary['categories'][name] == pytest.approx(db.get_category_tree(name)['value'])
+        assert summary['net_worth'] == pytest.approx(
+            db.get_category_tree('Assets')['value'] - db.get_category_tree('Liabilities')['value'])
+        return summary
+
+    summary = check()
+    assert set(summary['categories']) == {'Assets', 'Assets.1', 'Assets.2', 'Liabilities', 'Liabilities.1',
+                                          'Liabilities.2'}
+    db.upsert_account(Account('Summary Account', 1000.0, category=Category('Assets.1.2')))
+    assert check()['assets'] == pytest.approx(summary['assets'] + 1000.0)
+    assert check()['updated_at'] >= summary['updated_at']
+    db.disable_many_accounts(['Summary Account', 'Account 3'])
+    check()
+
+    # moving a category changes which ones are in the top two levels
+    db.upsert_category(Category('Assets.1', parent=Category('Liabilities.2')))
+    assert 'Assets.1' not in check()['categories']
+    db.upsert_category(Category('Assets.1', parent=Category('Assets')))
+    assert 'Assets.1' in check()['categories']
+    db.upsert_category(Category('Summary Top', parent=Category('Assets')))
+    assert check()['categories']['Summary Top'] == 0
+    db.delete_category('Summary Top')
+    assert 'Summary Top' not in check()['categories']
+
+    calls = db.stats()['methods']['get_compact_tree']['calls']
+    db.get_balance_summary()
+    assert db.stats()['methods']['get_compact_tree']['calls'] == calls
+    db.close()
+
+
+def test_search_index_follows_writes(tmp_path):
+    db = SqliteDb(str(tmp_path / 'search.db'))
+    populate(db, accounts=200, depth=2, fanout=3)
+
+    def names(query, **kwargs):
+        return [match['name'] for match in db.search(query, **kwargs)]
+
+    # prefix matches first, then names containing the query
+    assert names('Account 12')[:2] == ['Account 12', 'Account 120']
+    assert names('count 19', limit=3) == ['Account 19', 'Account 190', 'Account 191']
+    assert names('as', kind='category', limit=2) == ['Assets', 'Assets.1']
+    # a typo still finds the name
+    assert names('Acount 157')[0] == 'Account 157'
+    assert names('Asets.2.1', kind='category')[0] == 'Assets.2.1'
+    assert names('qqqqq') == [] and names('  ') == []
+    assert names('"Account" OR') == []
+    # matches are read up to a cap and never all ranked, and short prefixes are sorted by the name index
+    for query in ('ount 1', 'Ac'):
+        for statement in trace_statements(db, lambda: db.search(query)):
+            plan = ' '.join(row[3] for row in db.cursor.execute(f"EXPLAIN QUERY PLAN {statement}"))
+            assert 'LIMIT' in statement and 'rank' not in statement and 'TEMP B-TREE' not in plan, statement
+
+    db.upsert_account(Account('Rainy Day Fund', 10.0, category=Category('Assets.1.1'), remarks='emergency savings'))
+    db.upsert_category(Category('Vehicles', parent=Category('Assets'), description='cars and bikes'))
+    assert db.search('emergency') == [{'kind': 'account', 'name': 'Rainy Day Fund', 'notes': 'emergency savings',
+                                       'is_disabled': 0}]
+    assert names('bikes') == ['Vehicles']
+
+    db.disable_many_accounts(['Rainy Day Fund', 'Account 5'])
+    assert names('Rainy', is_disabled=0) == []
+    assert names('Rainy', is_disabled=1) == ['Rainy Day Fund']
+    assert 'Account 5' not in names('Account 5', kind='account', is_disabled=0)
+    db.enable_many_accounts(['Account 5'])
+    assert names('Account 5', is_disabled=0)[0] == 'Account 5'
+
+    db.delete_account('Rainy Day Fund')
+    db.delete_category('Vehicles')
+    assert names('Rainy') == [] and names('Vehicles') == []
+    with pytest.raises(ValueError):
+        db.search('Assets', kind='journal')
+    db.close()
+
+
+def test_get_category_tree(db):
+    expected = db.get_expected_category_values()
+
+    def check(node):
+        if 'children' not in node:
+            assert set(node) == {'name', 'value', 'remarks'}
+            return
+        assert node['value'] == pytest.approx(expected[node['name']][1])
+        accounts_seen = False
+        for child in node['children']:
+            # child categories are listed before child accounts
+            accounts_seen = accounts_seen or 'children' not in child
+            assert not (accounts_seen and 'children' in child)
+            check(child)
+
+    for name in ('Assets', 'Liabilities'):
+        tree = db.get_category_tree(name)
+        assert tree['name'] == name
+        check(tree)
+    with pytest.raises(ValueError):
+        db.get_category_tree('No Such Category')
+
+
+def test_bulk_upsert_stays_under_the_variable_limit(tmp_path):
+    db = SqliteDb(str(tmp_path / 'variables.db'))
+    # the limit of standard builds, lower than the one some Linux distributions compile in
+    db.connection.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, MAX_VARIABLES)
+    db.bulk_upsert_categories([Category('Assets')])
+    for value in (1.0, 2.0):
+        accounts = (Account(f'Account {i}', value, category=Category('Assets')) for i in range(7000))
+        assert db.bulk_upsert_accounts(accounts, chunk_size=7000) == 7000
+    assert db.get_category_tree('Assets')['value'] == pytest.approx(14000.0)
+    assert db.check_rollups() == []
+    db.close()
+
+
+def test_bulk_upsert_from_generator(db):
+    categories = (Category(name=f'Bulk Category {i}', parent=Category(name='Assets' if i == 0 else 'Bulk Category 0'))
+                  for i in range(3))
+    assert db.bulk_upsert_categories(categories) == 3
+    accounts = (Account(name=f'Bulk Account {i}', value=float(i), category=Category(name=f'Bulk Category {i % 3}'))
+                for i in range(1200))
+    assert db.bulk_upsert_accounts(accounts, chunk_size=500) == 1200
+    assert db.get_account_by_name('Bulk Account 1199')['value'] == 1199.0
+    assert db.check_rollups() == []
+
+    # upserting again replaces values instead of adding to them
+    db.bulk_upsert_accounts(Account(name=f'Bulk Account {i}', value=1.0, category=Category(name='Bulk Category 1'))
+                            for i in range(1200))
+    assert db.get_category_tree('Bulk Category 1')['value'] == pytest.approx(1200.0)
+    assert db.check_rollups() == []
+
+    with pytest.raises(ValueError):
+        db.bulk_upsert_accounts([Account(name='Bulk Orphan', value=1.0, category=Category(name='No Such Category'))])
+    assert db.get_account_by_name('Bulk Orphan') is None
+    with pytest.raises(ValueError):
+        db.bulk_upsert_categories([Category(name='Bulk Category 0', parent=Category(name='Bulk Category 1'))])
+    db.bulk_upsert_categories([Category(name='Bulk Category 2', parent=Category(name='Liabilities'))])
+    assert db.check_rollups() == []
+
+    for i in range(1200):
+        db.delete_account(f'Bulk Account {i}')
+    for i in reversed(range(3)):
+        db.delete_category(f'Bulk Category {i}')
+    assert db.check_rollups() == []
+
+
+def test_connections_are_pooled_per_file():
+    with SqliteDb('ledger.db', test=True) as first:
+        connection = first.connection
+        assert get_schema_version(connection) == SCHEMA_VERSION
+    assert first.connection is None
+    assert registry.idle_count(first.path) >= 1
+    with SqliteDb('ledger.db', test=True) as second:
+        assert second.connection is connection
+        # the reused connection works as before
+        assert isinstance(second.get_category_names(), list)
+
+
+def test_replaced_files_are_set_up_again(tmp_path):
+    path = str(tmp_path / 'replaced.db')
+    with SqliteDb(path) as db:
+        db.upsert_category(Category(name='Assets'))
+        assert db.get_category_id('Assets') is not None
+        old_connection = db.connection
+    assert registry.idle_count(path) == 1
+
+    # deleted while its connection is idle: the new file is migrated and nothing cached from the old one is used
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    with SqliteDb(path) as db:
+        assert db.connection is not old_connection
+        assert get_schema_version(db.connection) == SCHEMA_VERSION
+        assert db.get_category_id('Assets') is None and db.get_category_names() == []
+        db.upsert_category(Category(name='Liabilities'))
+
+    # replaced while in use: the connection to the old file is closed on release, not pooled. A WAL file would be
+    # left behind for the replacement to read, so these use a rollback journal.
+    path = str(tmp_path / 'swapped.db')
+    for name, category in ((path, 'Assets'), (str(tmp_path / 'other.db'), 'Other')):
+        with SqliteDb(name, profile='durable') as db:
+            db.upsert_category(Category(name=category))
+    db = SqliteDb(path, profile='durable')
+    in_use = db.connection
+    os.replace(str(tmp_path / 'other.db'), path)
+    with SqliteDb(path, profile='durable') as replacement:
+        assert replacement.get_category_names() == ['Other']
+    db.close()
+    assert registry.idle_count(path) == 1
+    with SqliteDb(path, profile='durable') as db:
+        assert db.connection is not in_use and db.get_category_names() == ['Other']
+
+
+def test_performance_profiles(tmp_path):
+    with SqliteDb(str(tmp_path / 'performance.db'), profile='performance', cache_size=-1000) as db:
+        assert db.connection.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        assert db.connection.execute("PRAGMA synchronous").fetchone()[0] == 1
+        assert db.connection.execute("PRAGMA cache_size").fetchone()[0] == -1000
+    with SqliteDb(str(tmp_path / 'durable.db'), profile='durable') as db:
+        assert db.connection.execute("PRAGMA journal_mode").fetchone()[0] == 'delete'
+        assert db.connection.execute("PRAGMA synchronous").fetchone()[0] == 2
+    with pytest.raises(ValueError):
+        SqliteDb(str(tmp_path / 'other.db'), profile='reckless')
+
+
+def scanned_tables(statement, plan):
+    """
+    Names the tables a query plan scans in full, resolving the aliases of the statement. CTEs defined by the
+    statement are left out, since scanning one is how recursion works, but a table aliased like a CTE is not.
+    """
+    references = re.findall(r"\b(?:FROM|JOIN)\s+(\w+)\s+(?:AS\s+)?(\w+)", statement, re.I)
+    aliases = {alias: table for table, alias in references}
+    ctes = set(re.findall(r"\b(\w+)\s*(?:\([^)]*\))?\s+AS\s+\(", statement, re.I))
+    tables = []
+    for row in plan:
+        scan = re.fullmatch(r"SCAN (\S+)", row[3])
+        if scan is not None:
+            table = aliases.get(scan.group(1), scan.group(1))
+            if table not in ctes:
+                tables.append(table)
+    return tables
+
+
+def trace_statements(db, call):
+    statements = []
+    db.connection.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        db.connection.set_trace_callback(None)
+    # statements run by virtual tables, such as the full-text index, are traced as comments
+    return [statement for statement in statements
+            if statement.split()[0].upper() not in ('BEGIN', 'COMMIT') and not statement.startswith('--')]
+
+
+def test_hot_queries_use_indexes(tmp_path):
+    """
+    Fails when a hot lookup goes back to scanning the accounts or categories table.
+    """
+    db = SqliteDb(str(tmp_path / 'plans.db'))
+    leaves = populate(db, accounts=50, depth=2, fanout=2)
+    category_id = db.cursor.execute("SELECT id FROM categories WHERE name = ?", (leaves[0].name,)).fetchone()[0]
+    hot_calls = [
+        lambda: db.calculate_category_value(category_id),
+        lambda: db.propagate_value(category_id, 1.0),
+        lambda: db.get_subcategories('Assets'),
+        lambda: db.get_all_account_names_in_category(leaves[0].name),
+        lambda: db.get_category_tree('Assets'),
+        lambda: db.get_accounts(enabled=True),
+        lambda: db.get_accounts(enabled=False),
+        lambda: db.get_account_by_name('Account 1'),
+        lambda: db.upsert_account(Account('Account 1', 1.0, category=leaves[1])),
+        lambda: db.disable_account('Account 1'),
+    ]
+    for call in hot_calls:
+        for statement in trace_statements(db, call):
+            plan = db.connection.execute("EXPLAIN QUERY PLAN " + statement).fetchall()
+            assert scanned_tables(statement, plan) == [], f"{plan} in {statement}"
+
+    # a table aliased with the name of a CTE still counts
+    plan = [(0, 0, 0, 'SCAN s')]
+    assert scanned_tables("SELECT * FROM category_closure s", plan) == ['category_closure']
+    assert scanned_tables("WITH RECURSIVE s(id) AS (SELECT 1 UNION ALL SELECT id + 1 FROM s) SELECT * FROM s",
+                          plan) == []
+    db.close()
+
+
+def test_ledger_rows_stream_without_sorting(tmp_path):
+    """
+    Fails when an export has SQLite sort the ledger in a temporary b-tree, held in memory under temp_store=MEMORY.
+    """
+    db = SqliteDb(str(tmp_path / 'export_plans.db'))
+    populate(db, accounts=50, depth=2, fanout=2)
+    for name in (None, 'Assets'):
+        rows = []
+        for statement in trace_statements(db, lambda: rows.extend(db.iter_ledger_rows(name))):
+            plan = db.connection.execute("EXPLAIN QUERY PLAN " + statement).fetchall()
+            assert not any('TEMP B-TREE' in row[3] for row in plan), f"{plan} in {statement}"
+        categories = [row[1] for row in rows if row[0] == 'category']
+        # parents before children, and accounts oldest first
+        assert all(row[2] is None or categories.index(row[2]) < categories.index(row[1])
+                   for row in rows if row[0] == 'category' and row[1] != name)
+        accounts = [row[1] for row in rows if row[0] == 'account']
+        assert accounts == sorted(accounts, key=lambda account: int(account.split()[1]))
+    db.close()
+
+
+def hierarchy_pairs(connection):
+    query = """
+        WITH RECURSIVE paths(ancestor_id, descendant_id, depth) AS (
+            SELECT id, id, 0 FROM categories
+            UNION ALL
+            SELECT p.ancestor_id, c.id, p.depth + 1 FROM paths p JOIN categories c ON c.parent_id = p.descendant_id
+        )
+        SELECT ancestor_id, descendant_id, depth FROM paths
+    """
+    return set(connection.execute(query).fetchall())
+
+
+def test_category_closure_follows_moves(db):
+    db.upsert_category(Category(name='Closure Parent', parent=Category(name='Assets')))
+    db.upsert_category(Category(name='Closure Child', parent=Category(name='Closure Parent')))
+    db.upsert_category(Category(name='Closure Leaf', parent=Category(name='Closure Child')))
+    assert db.get_ancestors('Closure Leaf') == ['Closure Child', 'Closure Parent', 'Assets']
+    assert db.get_leaf_categories('Closure Parent') == ['Closure Leaf']
+
+    db.upsert_category(Category(name='Closure Child', parent=Category(name='Liabilities')))
+    assert db.get_ancestors('Closure Leaf') == ['Closure Child', 'Liabilities']
+    closure = set(db.connection.execute("SELECT ancestor_id, descendant_id, depth FROM category_closure").fetchall())
+    assert closure == hierarchy_pairs(db.connection)
+
+    for name in ('Closure Leaf', 'Closure Child', 'Closure Parent'):
+        db.delete_category(name)
+    closure = set(db.connection.execute("SELECT ancestor_id, descendant_id, depth FROM category_closure").fetchall())
+    assert closure == hierarchy_pairs(db.connection)
+
+
+def test_closure_migration_backfills_existing_categories(tmp_path):
+    connection = sqlite3.connect(tmp_path / 'old.db')
+    for statements in MIGRATIONS[:2]:
+        for statement in statements:
+            connection.execute(statement)
+    connection.executemany("INSERT INTO categories (id, name, value, parent_id) VALUES (?, ?, 0, ?)",
+                           [(1, 'Assets', None), (2, 'Current Assets', 1), (3, 'Savings', 2), (4, 'Liabilities', None)])
+    connection.execute("PRAGMA user_version = 2")
+    connection.commit()
+    migrate(connection)
+    closure = set(connection.execute("SELECT ancestor_id, descendant_id, depth FROM category_closure").fetchall())
+    assert closure == hierarchy_pairs(connection)
+    assert (1, 3, 2) in closure
+    summary = {row[0] for row in connection.execute("SELECT name FROM balance_summary")}
+    assert summary == {'Assets', 'Current Assets', 'Liabilities'}
+    connection.close()
+
+
+def test_disable_and_enable_many_accounts(db):
+    db.upsert_category(Category(name='Toggle Category', parent=Category(name='Assets')))
+    names = [f'Toggle Account {i}' for i in range(5)]
+    db.bulk_upsert_accounts(Account(name, 10.0, category=Category(name='Toggle Category')) for name in names)
+    db.disable_account(names[0])
+
+    disabled = db.disable_many_accounts(names + ['No Such Account'])
+    # the account that was already disabled is not reported again
+    assert [row[1] for row in disabled] == names[1:]
+    assert all(row[5] == 1 for row in disabled)
+    assert db.get_category_tree('Toggle Category')['value'] == 0
+    assert db.check_rollups() == []
+
+    enabled = db.enable_many_accounts(names)
+    assert [row[1] for row in enabled] == names
+    assert db.get_category_tree('Toggle Category')['value'] == pytest.approx(50.0)
+    assert db.check_rollups() == []
+
+    for name in names:
+        db.delete_account(name)
+    db.delete_category('Toggle Category')
+
+
+def test_toggling_one_account_without_incremental_rollups(tmp_path):
+    db = SqliteDb(str(tmp_path / 'full_rollups.db'), incremental=False)
+    db.bulk_upsert_categories([Category('Assets'), Category('Savings', parent=Category('Assets'))])
+    db.upsert_account(Account('Piggy Bank', 100.0, category=Category('Savings')))
+
+    db.disable_account('Piggy Bank')
+    assert db.check_rollups() == []
+    assert db.get_balance_summary()['assets'] == 0
+    db.enable_account('Piggy Bank')
+    assert db.check_rollups() == []
+    assert db.get_balance_summary()['assets'] == pytest.approx(100.0)
+    db.close()
+
+
+def test_balance_sheet_as_of(tmp_path):
+    db = SqliteDb(str(tmp_path / 'history.db'))
+    db.bulk_upsert_categories([Category('Assets'), Category('Savings', parent=Category('Assets'))])
+    db.upsert_account(Account('History Bank', 10.0, category=Category('Savings')))
+    time.sleep(0.01)
+    first = datetime.now()
+    time.sleep(0.01)
+    db.upsert_account(Account('History Bank', 20.0, category=Category('Savings')))
+    db.upsert_account(Account('History Wallet', 5.0, category=Category('Assets')))
+    time.sleep(0.01)
+    second = datetime.now()
+    time.sleep(0.01)
+    db.delete_account('History Wallet')
+    db.disable_account('History Bank')
+
+    assert db.get_category_tree('Assets', as_of=first)['value'] == 10.0
+    assert db.get_category_tree('Assets', as_of=second)['value'] == 25.0
+    assert db.get_category_tree('Assets', as_of=second) == {
+        'name': 'Assets', 'value': 25.0, 'children': [
+            {'name': 'Savings', 'value': 20.0, 'children': [
+                {'name': 'History Bank', 'value': 20.0, 'remarks': ''}]},
+            {'name': 'History Wallet', 'value': 5.0, 'remarks': ''},
+        ]}
+    assert db.get_category_tree('Assets', as_of=datetime.now()) == db.get_category_tree('Assets')
+    with pytest.raises(ValueError):
+        db.get_category_tree('Assets', as_of='2000-01-01')
+    # the latest rows are found by index seeks per item, never by scanning or sorting the history
+    for statement in trace_statements(db, lambda: db.get_category_tree('Assets', as_of=second)):
+        plan = db.connection.execute("EXPLAIN QUERY PLAN " + statement).fetchall()
+        assert scanned_tables(statement, plan) == [], f"{plan} in {statement}"
+        assert not any('TEMP B-TREE' in row[3] for row in plan), f"{plan} in {statement}"
+    db.close()
+
+
+def test_journal_postings_keep_account_values(db):
+    db.upsert_category(Category(name='Journal Category', parent=Category(name='Assets')))
+    bank = Account('Journal Bank', 1000.0, category=Category('Journal Category'))
+    loan = Account('Journal Loan', 500.0, category=Category('Liabilities'))
+    db.bulk_upsert_accounts([bank, loan])
+
+    entry_id = db.post_entry(JournalEntry([Posting(bank, -200.0), Posting(loan, -200.0)], 'loan payment',
+                                          posted_at='2023-03-01 09:00:00'))
+    assert isinstance(entry_id, int)
+    deposits = (JournalEntry([Posting(bank, 10.0, memo=f'deposit {i}')], posted_at='2023-03-04 10:00:00')
+                for i in range(1000))
+    assert db.bulk_post(deposits) == 1000
+
+    assert db.get_account_by_name('Journal Bank')['value'] == pytest.approx(10800.0)
+    assert db.get_account_by_name('Journal Loan')['value'] == pytest.approx(300.0)
+    postings = db.get_postings('Journal Bank')
+    assert [posting['running_balance'] for posting in postings[:3]] == pytest.approx([800.0, 810.0, 820.0])
+    assert postings[0]['description'] == 'loan payment'
+    assert db.check_rollups() == []
+
+    with pytest.raises(ValueError):
+        db.post_entry(JournalEntry([Posting(Account('No Such Account', 0, None), 1.0)]))
+    assert db.get_account_by_name('Journal Bank')['value'] == pytest.approx(10800.0)
+    # running balances follow the order postings are recorded in, so backdating is refused
+    with pytest.raises(ValueError):
+        db.post_entry(JournalEntry([Posting(loan, 1.0)], posted_at='2023-02-28'))
+    with pytest.raises(ValueError):
+        db.post_entry(JournalEntry([Posting(bank, 1.0)], posted_at='2023-03-02'))
+    assert len(db.get_postings('Journal Bank')) == 1001
+    with pytest.raises(ValueError):
+        db.delete_account('Journal Bank')
+
+    db.connection.execute("DELETE FROM postings")
+    db.connection.execute("DELETE FROM journal_entries")
+    db.connection.commit()
+    db.delete_account('Journal Bank')
+    db.delete_account('Journal Loan')
+    db.delete_category('Journal Category')
+
+
+def test_deleted_account_ids_are_not_reused(tmp_path):
+    db = SqliteDb(str(tmp_path / 'reuse.db'))
+    db.upsert_category(Category('Assets'))
+    old_bank = Account('Old Bank', 100.0, category=Category('Assets'))
+    db.upsert_account(old_bank)
+    db.post_entry(JournalEntry([Posting(old_bank, 50.0, memo='deposit')]))
+    with pytest.raises(ValueError):
+        db.delete_account('Old Bank')
+
+    db.upsert_account(Account('Spare', 0.0, category=Category('Assets')))
+    spare_id = db.get_account_by_name('Spare')['id']
+    db.delete_account('Spare')
+    db.upsert_account(Account('New Bank', 0.0, category=Category('Assets')))
+    assert db.get_account_by_name('New Bank')['id'] > spare_id
+    assert db.get_postings('New Bank') == []
+    db.close()
+
+
+def test_account_rebuild_migration_keeps_rows_and_skips_old_ids(tmp_path):
+    connection = sqlite3.connect(tmp_path / 'old.db')
+    for statements in MIGRATIONS[:7]:
+        for statement in statements:
+            connection.execute(statement)
+    connection.execute("INSERT INTO categories (id, name, value) VALUES (1, 'Assets', 0)")
+    connection.executemany("INSERT INTO accounts (id, name, value, category_id) VALUES (?, ?, ?, 1)",
+                           [(1, 'Kept', 5.0), (2, 'Deleted', 7.0)])
+    connection.execute("DELETE FROM accounts WHERE id = 2")
+    connection.execute("PRAGMA user_version = 7")
+    connection.commit()
+    migrate(connection)
+    assert connection.execute("SELECT id, name, value FROM accounts").fetchall() == [(1, 'Kept', 5.0)]
+    connection.execute("INSERT INTO accounts (name, value, category_id) VALUES ('Added', 1.0, 1)")
+    assert connection.execute("SELECT id FROM accounts WHERE name = 'Added'").fetchone() == (3,)
+    assert connection.execute("SELECT name FROM search_index WHERE search_index MATCH 'Added'").fetchall() == \
+        [('Added',)]
+    assert connection.execute("SELECT COUNT(*) FROM account_history WHERE account_id = 3").fetchone() == (1,)
+    connection.close()
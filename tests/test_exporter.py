@@ -0,0 +1,63 @@
+import csv
+import io
+import json
+
+import pytest
+
+from benchmarks.ledger import populate
+from cli_layer.exporter import export_ledger, read_columnar, write_columnar
+from cli_layer.importer import import_file
+from db_layer.database import LEDGER_COLUMNS, SqliteDb
+
+
+@pytest.fixture(scope="module")
+def db(tmp_path_factory):
+    db = SqliteDb(str(tmp_path_factory.mktemp('export') / 'export.db'))
+    populate(db, accounts=300, depth=2, fanout=3)
+    db.disable_many_accounts(['Account 4'])
+    return db
+
+
+def expected_rows(db, name=None):
+    return [dict(zip(LEDGER_COLUMNS, row)) for row in db.iter_ledger_rows(name)]
+
+
+def test_export_json_and_csv(db, tmp_path):
+    rows = expected_rows(db)
+    assert rows[0]['type'] == 'category' and rows[-1]['type'] == 'account'
+    assert export_ledger(db, str(tmp_path / 'ledger.json')) == len(rows)
+    assert json.loads((tmp_path / 'ledger.json').read_text()) == rows
+
+    export_ledger(db, str(tmp_path / 'ledger.csv'))
+    with open(tmp_path / 'ledger.csv', newline='') as file:
+        exported = list(csv.DictReader(file))
+    assert [row['name'] for row in exported] == [row['name'] for row in rows]
+    assert float(exported[-1]['value']) == rows[-1]['value']
+
+    assets = expected_rows(db, 'Assets')
+    assert export_ledger(db, str(tmp_path / 'assets.jsonl'), name='Assets') == len(assets)
+    with pytest.raises(ValueError):
+        export_ledger(db, str(tmp_path / 'missing.jsonl'), name='Missing')
+    with pytest.raises(ValueError):
+        export_ledger(db, str(tmp_path / 'ledger.txt'))
+
+
+def test_columnar_round_trip(db, tmp_path):
+    rows = expected_rows(db)
+    buffer = io.BytesIO()
+    # small row groups, so the export spans several of them
+    assert write_columnar(db.iter_ledger_rows(), buffer, row_group_size=50) == len(rows)
+    buffer.seek(0)
+    assert list(read_columnar(buffer)) == rows
+
+    export_ledger(db, str(tmp_path / 'ledger.ledgerc'))
+    with open(tmp_path / 'ledger.ledgerc', 'rb') as file:
+        assert list(read_columnar(file)) == rows
+
+
+def test_jsonl_export_imports_again(db, tmp_path):
+    export_ledger(db, str(tmp_path / 'ledger.jsonl'))
+    with SqliteDb(str(tmp_path / 'copy.db')) as copy:
+        import_file(copy, str(tmp_path / 'ledger.jsonl'))
+        assert copy.get_category_tree('Assets') == db.get_category_tree('Assets')
+        assert copy.get_accounts(enabled=False) == ['Account 4']
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from cli_layer.importer import import_file, parse_record
+from db_layer.database import SqliteDb
+from models.accounting import Account, Category
+
+
+@pytest.fixture(scope="module")
+def db():
+    db = SqliteDb('ledger.db', test=True)
+    db.bulk_upsert_categories([Category('Assets'), Category('Liabilities')])
+    return db
+    db.close()
+
+
+def remove_imported(db, account_names, category_names):
+    for name in account_names:
+        db.delete_account(name)
+    for name in category_names:
+        db.delete_category(name)
+
+
+def test_parse_record():
+    category = parse_record({'type': 'category', 'name': 'Brokerage', 'parent': 'Assets', 'description': ''})
+    assert isinstance(category, Category)
+    assert category.parent.name == 'Assets'
+    account = parse_record({'type': 'account', 'name': 'Fund', 'value': '12.5', 'category': 'Brokerage',
+                            'is_disabled': '1'})
+    assert isinstance(account, Account)
+    assert account.value == 12.5
+    assert account.is_disabled == 1
+    with pytest.raises(ValueError):
+        parse_record({'type': 'account', 'name': 'Fund', 'value': 'lots', 'category': 'Brokerage'}, 3)
+    with pytest.raises(ValueError):
+        parse_record({'type': 'account', 'name': 'Fund'})
+    with pytest.raises(ValueError):
+        parse_record({'type': 'transaction', 'name': 'Fund'})
+
+
+def test_import_csv(db, tmp_path):
+    path = tmp_path / 'statement.csv'
+    lines = ['type,name,value,category,parent,remarks,description,is_disabled',
+             'category,Import Savings,,,Assets,,imported,']
+    lines += [f'account,Import Account {i},{i},Import Savings,,row {i},,' for i in range(25)]
+    path.write_text('\n'.join(lines) + '\n')
+
+    imported, skipped, _ = import_file(db, str(path), batch_size=10)
+    assert (imported, skipped) == (26, 0)
+    assert db.get_account_by_name('Import Account 24')['remarks'] == 'row 24'
+    assert db.get_category_tree('Import Savings')['value'] == pytest.approx(sum(range(25)))
+    assert db.get_import_checkpoint(str(path)) == 0
+    remove_imported(db, [f'Import Account {i}' for i in range(25)], ['Import Savings'])
+
+
+def test_import_resumes_after_crash(db, tmp_path):
+    path = tmp_path / 'statement.jsonl'
+    records = [{'type': 'category', 'name': 'Import Resume', 'parent': 'Assets'}]
+    records += [{'type': 'account', 'name': f'Resume Account {i}', 'value': 1, 'category': 'Import Resume'}
+                for i in range(9)]
+    path.write_text('\n'.join(json.dumps(record) for record in records) + '\n')
+
+    def crash(rows, rate):
+        raise RuntimeError('crashed')
+
+    with pytest.raises(RuntimeError):
+        import_file(db, str(path), batch_size=4, on_batch=crash)
+    assert db.get_import_checkpoint(str(path.resolve())) == 4
+
+    imported, skipped, _ = import_file(db, str(path), batch_size=4)
+    assert (imported, skipped) == (6, 4)
+    assert db.get_category_tree('Import Resume')['value'] == pytest.approx(9)
+    remove_imported(db, [f'Resume Account {i}' for i in range(9)], ['Import Resume'])